@@ -4,7 +4,9 @@ from datetime import date
 from app.deps import get_current_user
 from app.db.client import get_database
 from app.services.ai_service import get_latest_insights
+from app.services.ai_jobs import get_job
 from app.models.error import ErrorResponse
+from app.models.insight_model import AIJobResponse
 from app.services.health_profile_service import get_health_profile, get_baseline_status
 
 router = APIRouter(prefix="/ai", tags=["ai"])
@@ -95,3 +97,29 @@ async def ai_status(current_user=Depends(get_current_user), db=Depends(get_datab
     if status_info.get("baseline_status") == "not_initialized":
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail={"error_type": "not_initialized", "detail": "Health profile not initialized. Please complete signup."})
     return status_info
+
+
+@router.get("/jobs/{job_id}", response_model=AIJobResponse,
+            responses={
+                401: {"model": ErrorResponse},
+                404: {"model": ErrorResponse},
+            })
+async def ai_job(job_id: str, current_user=Depends(get_current_user), db=Depends(get_database)):
+    """Poll the background AI job started by `POST /metrics` (its `ai_job_id`).
+
+    `status` moves from `queued` to `running` to `done` (or `failed`); a done
+    job carries the deviation flags, risk score and the new insight (none
+    while the baseline is still collecting).
+
+    Errors:
+    - 401 Unauthorized: invalid credentials
+    - 404 Not Found: unknown job, or the job expired (AI_JOB_RETENTION_HOURS)
+    """
+    user_id = current_user.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail={"error_type": "authentication", "detail": "Invalid user"})
+
+    job = await get_job(db, user_id, job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail={"error_type": "not_found", "detail": "Job not found"})
+    return job
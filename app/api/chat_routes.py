@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
 from app.models.chat import ChatRequest, ChatResponse
 from app.models.error import ErrorResponse
 from app.services.chat_service import chat_with_user, _check_rate_limit, _increment_usage, _truncate_content
 from app.services.gemini_service import ask_gemini
 from app.services.chat_history_service import save_chat_message, get_chat_history
+from app.services.idempotency import IdempotencyConflict, idempotency_store
 from app.config.settings import settings
 from app.deps import get_current_user
 from app.db.client import get_database
@@ -24,11 +26,15 @@ async def chat_history(current_user=Depends(get_current_user), db=Depends(get_da
 @router.post("", response_model=ChatResponse,
              responses={
                  401: {"model": ErrorResponse},
+                 409: {"model": ErrorResponse},
+                 422: {"model": ErrorResponse},
                  503: {"model": ErrorResponse},
                  500: {"model": ErrorResponse},
              })
 async def chat_endpoint(
     payload: ChatRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user=Depends(get_current_user),
     db=Depends(get_database),
 ):
@@ -54,6 +60,11 @@ async def chat_endpoint(
     Earlier versions returned a fallback message on 200 when the model was
     unreachable; the new behaviour returns 503 with a structured error instead.
 
+    With an `Idempotency-Key` header a retried request returns the first
+    reply (with `Idempotent-Replayed: true`) without calling the model again
+    or counting against the daily limit. 409 means the first request is still
+    running; 422 means the key was used with a different body.
+
     Example error payloads:
     ```json
     { "error_type": "authentication", "detail": "Invalid user" }
@@ -65,53 +76,64 @@ async def chat_endpoint(
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail={"error_type": "authentication", "detail": "Invalid user"})
 
-    # daily rate limit per user
-    if not _check_rate_limit(user_id):
-        raise HTTPException(
-            status_code=429,
-            detail={"error_type": "rate_limit", "detail": "Daily chat limit reached"}
-        )
+    async def chat():
+        # daily rate limit per user
+        if not _check_rate_limit(user_id):
+            raise HTTPException(
+                status_code=429,
+                detail={"error_type": "rate_limit", "detail": "Daily chat limit reached"}
+            )
 
-    # choose backend
-    try:
-        user_text = payload.messages[-1].content if payload.messages else ""
-        # save user message
-        await save_chat_message(db, user_id, "user", user_text)
+        # choose backend
+        try:
+            user_text = payload.messages[-1].content if payload.messages else ""
+            # save user message
+            await save_chat_message(db, user_id, "user", user_text)
 
-        # Gemini is only invoked when both a key and a model name are
-        # configured; otherwise continue to local endpoint if available.
-        if settings.GEMINI_API_KEY and settings.GEMINI_MODEL:
-            try:
-                ai_reply = ask_gemini(user_text)
-                reply = {"role": "assistant", "content": ai_reply, "any": {"provider": "gemini"}}
-            except Exception as exc:
-                # bubble up so the outer except will convert to 500
-                raise
-        else:
-            reply = await chat_with_user(user_id, [m.model_dump() for m in payload.messages])
-            if reply.get("provider"):
-                reply.setdefault("any", {})["provider"] = reply.pop("provider")
-        # store assistant message
-        # increment quota
-        _increment_usage(user_id)
-        # truncate reply if necessary
-        if reply.get("content"):
-            reply["content"] = await _truncate_content(reply["content"])
-        await save_chat_message(db, user_id, "assistant", reply.get("content", ""))
-        return reply
-    except RuntimeError as exc:
-        # propagate the message so callers know why the LLM call failed
-        msg = str(exc) or "LLM provider unreachable"
-        raise HTTPException(
-            status_code=503,
-            detail={"error_type": "service_unavailable", "detail": msg}
-        )
-    except Exception as exc:
-        detail_msg = str(exc)
-        # quota messages are already prefixed when raised
-        if detail_msg.startswith("quota_exceeded"):
+            # Gemini is only invoked when both a key and a model name are
+            # configured; otherwise continue to local endpoint if available.
+            if settings.GEMINI_API_KEY and settings.GEMINI_MODEL:
+                try:
+                    ai_reply = ask_gemini(user_text)
+                    reply = {"role": "assistant", "content": ai_reply, "any": {"provider": "gemini"}}
+                except Exception as exc:
+                    # bubble up so the outer except will convert to 500
+                    raise
+            else:
+                reply = await chat_with_user(user_id, [m.model_dump() for m in payload.messages])
+                if reply.get("provider"):
+                    reply.setdefault("any", {})["provider"] = reply.pop("provider")
+            # store assistant message
+            # increment quota
+            _increment_usage(user_id)
+            # truncate reply if necessary
+            if reply.get("content"):
+                reply["content"] = await _truncate_content(reply["content"])
+            await save_chat_message(db, user_id, "assistant", reply.get("content", ""))
+            return reply
+        except RuntimeError as exc:
+            # propagate the message so callers know why the LLM call failed
+            msg = str(exc) or "LLM provider unreachable"
             raise HTTPException(
-                status_code=429,
-                detail={"error_type": "quota_exceeded", "detail": detail_msg}
+                status_code=503,
+                detail={"error_type": "service_unavailable", "detail": msg}
             )
-        raise HTTPException(status_code=500, detail={"error_type": "service_error", "detail": f"Chat service error: {exc}"})
+        except Exception as exc:
+            detail_msg = str(exc)
+            # quota messages are already prefixed when raised
+            if detail_msg.startswith("quota_exceeded"):
+                raise HTTPException(
+                    status_code=429,
+                    detail={"error_type": "quota_exceeded", "detail": detail_msg}
+                )
+            raise HTTPException(status_code=500, detail={"error_type": "service_error", "detail": f"Chat service error: {exc}"})
+
+    if idempotency_key is None:
+        return await chat()
+    try:
+        reply, replayed = await idempotency_store.run(db, user_id, "chat", idempotency_key, payload, chat)
+    except IdempotencyConflict as exc:
+        raise HTTPException(status_code=exc.status_code, detail={"error_type": exc.error_type, "detail": exc.detail})
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return reply
@@ -1,22 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from app.models.metrics_model import MetricsCreate, MetricsResponse
-from app.services.metrics_service import ingest_metrics, get_metrics_for_date
+import hmac
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
+from typing import Any, Dict, List, Optional
+from fastapi import Body
+from app.config.settings import settings
+from app.models.metrics_model import MetricsCreate, MetricsResponse, MetricsHistoryResponse, MetricsBatchResponse, MetricsDelta, MetricsDeltaResponse
+from app.services.metrics_service import ingest_metrics, ingest_metrics_batch, get_metrics_for_date
+from app.services.replay_service import replay_history
+from app.services.intraday_service import apply_metrics_delta
+from app.services.ndjson_import import import_ndjson
+from app.services.health_service import store_health_samples
+from app.models.health import HealthSample, HealthSamplesResponse
+from app.services.idempotency import IdempotencyConflict, idempotency_store
 from app.deps import get_current_user
 from app.db.client import get_database
 from datetime import date
 from app.models.error import ErrorResponse
+from app.middleware.body_decoding import DecodedBodyRoute
 
-router = APIRouter(prefix="/metrics", tags=["metrics"])
+# ingest bodies may also be MessagePack/CBOR, gzipped or columnar (see body_decoding)
+router = APIRouter(prefix="/metrics", tags=["metrics"], route_class=DecodedBodyRoute)
 
 
 @router.post("", response_model=MetricsResponse,
              responses={
                  400: {"model": ErrorResponse},
                  401: {"model": ErrorResponse},
+                 409: {"model": ErrorResponse},
+                 422: {"model": ErrorResponse},
                  500: {"model": ErrorResponse},
              })
 async def post_metrics(
     payload: MetricsCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user=Depends(get_current_user),
     db=Depends(get_database)
 ):
@@ -35,9 +51,15 @@ async def post_metrics(
     }
     ```
 
+    Send an `Idempotency-Key` header to make retries safe: a repeat of the
+    same request within IDEMPOTENCY_TTL_SECONDS returns the first response
+    (with `Idempotent-Replayed: true`) without storing or scoring again.
+
     Possible errors:
     - 401 Unauthorized: invalid credentials
     - 400 Bad Request: payload validation error (handled automatically)
+    - 409 Conflict: a request with the same Idempotency-Key is still running
+    - 422 Unprocessable Entity: the Idempotency-Key was used with another body
     - 500 Internal Server Error: database write failure
 
     Example error response:
@@ -49,12 +71,232 @@ async def post_metrics(
     if not user_id:
         raise HTTPException(status_code=401, detail={"error_type": "authentication", "detail": "Invalid user"})
 
-    result = await ingest_metrics(db, user_id, payload)
-    if not result:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail={"error_type": "database_error", "detail": "Failed to store metrics"})
+    async def ingest():
+        result = await ingest_metrics(db, user_id, payload)
+        if not result:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail={"error_type": "database_error", "detail": "Failed to store metrics"})
+        return result
+
+    if idempotency_key is None:
+        return await ingest()
+    try:
+        result, replayed = await idempotency_store.run(db, user_id, "metrics", idempotency_key, payload, ingest)
+    except IdempotencyConflict as exc:
+        raise HTTPException(status_code=exc.status_code, detail={"error_type": exc.error_type, "detail": exc.detail})
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+@router.post("/batch", response_model=MetricsBatchResponse,
+             responses={
+                 400: {"model": ErrorResponse},
+                 401: {"model": ErrorResponse},
+                 404: {"model": ErrorResponse},
+                 413: {"model": ErrorResponse},
+                 415: {"model": ErrorResponse},
+             })
+async def post_metrics_batch(
+    payload: List[Dict[str, Any]] = Body(...),
+    current_user=Depends(get_current_user),
+    db=Depends(get_database)
+):
+    """Ingest many days (e.g. a wearable sync after being offline) in one request.
+
+    Each item has the `MetricsCreate` shape. Items are validated one by one;
+    valid items are stored with a single bulk write and run through the AI
+    pipeline once, in date order. The response reports every item:
+
+    ```json
+    {
+      "stored": 2, "invalid": 1, "failed": 0,
+      "baseline_status": "active", "risk_score": 12.5,
+      "items": [
+        {"index": 0, "status": "stored", "date": "2026-02-20", "deviation_flags": {"steps": false}, "risk_score": 0.0},
+        {"index": 1, "status": "invalid", "errors": [{"loc": ["steps"], "msg": "...", "type": "..."}]},
+        {"index": 2, "status": "stored", "date": "2026-02-21", "deviation_flags": {"steps": true}, "risk_score": 12.5}
+      ]
+    }
+    ```
+
+    Large syncs can send the items column by column (one array per field),
+    as `application/msgpack` or `application/cbor`, and/or with
+    `Content-Encoding: gzip`:
+
+    ```json
+    {"date": ["2026-02-20", "2026-02-21"], "steps": [5000, 6100], "sleep_duration_minutes": [420, 390], ...}
+    ```
+
+    Errors:
+    - 400 Bad Request: more than METRICS_BATCH_MAX_ITEMS items, undecodable body
+    - 401 Unauthorized: missing credentials
+    - 404 Not Found: the user has no health profile yet
+    - 413 Payload Too Large: decoded body over METRICS_MAX_BODY_BYTES
+    - 415 Unsupported Media Type: unknown Content-Encoding or body format
+    """
+    user_id = current_user.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail={"error_type": "authentication", "detail": "Invalid user"})
+    if len(payload) > settings.METRICS_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail={"error_type": "batch_too_large", "detail": f"At most {settings.METRICS_BATCH_MAX_ITEMS} items per batch"})
+
+    result = await ingest_metrics_batch(db, user_id, payload)
+    if result is None:
+        raise HTTPException(status_code=404, detail={"error_type": "not_found", "detail": "Health profile not found"})
     return result
 
 
+@router.post("/delta", response_model=MetricsDeltaResponse,
+             responses={
+                 400: {"model": ErrorResponse},
+                 401: {"model": ErrorResponse},
+             })
+async def post_metrics_delta(
+    payload: MetricsDelta,
+    current_user=Depends(get_current_user),
+    db=Depends(get_database)
+):
+    """Add intraday increments to today's metrics.
+
+    Counters (`steps`, `active_minutes`, `sedentary_minutes`,
+    `screen_time_minutes`) are added to the stored day; `sleep_duration_minutes`
+    and `location_diversity_score` are running totals and only ever go up.
+
+    ```json
+    { "date": "2026-02-21", "steps": 340, "active_minutes": 4 }
+    ```
+
+    The AI pipeline (baseline, flags, risk, insight) runs when `close` is true
+    or when the first delta of a later day arrives. While the day is open, a
+    score-free run every INTRADAY_PIPELINE_INTERVAL_MINUTES after its first
+    delta only does bookkeeping; `pipeline_ran` tells whether this request
+    ran either.
+
+    Errors:
+    - 400 Bad Request: negative increments or invalid payload
+    - 401 Unauthorized: missing credentials
+    """
+    user_id = current_user.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail={"error_type": "authentication", "detail": "Invalid user"})
+    return await apply_metrics_delta(db, user_id, payload)
+
+
+@router.post("/samples", response_model=HealthSamplesResponse,
+             responses={
+                 400: {"model": ErrorResponse},
+                 401: {"model": ErrorResponse},
+                 413: {"model": ErrorResponse},
+                 415: {"model": ErrorResponse},
+             })
+async def post_metrics_samples(
+    payload: List[HealthSample],
+    current_user=Depends(get_current_user),
+    db=Depends(get_database)
+):
+    """Store raw (e.g. per-minute) samples from a device.
+
+    ```json
+    [
+      {"type": "steps", "timestamp": "2026-02-21T08:31:00Z", "value": 112},
+      {"type": "sedentary", "timestamp": "2026-02-21T08:32:00Z", "value": 1}
+    ]
+    ```
+
+    Samples are stored as they are in the `health` collection. `steps`,
+    `sleep`, `sedentary` and `screen_time` samples are summed per UTC day into
+    daily metrics by the background rollup (every HEALTH_ROLLUP_TICK_SECONDS),
+    which then runs the AI pipeline like `POST /metrics/delta`. Accepts the
+    same columnar, MessagePack/CBOR and gzip bodies as `POST /metrics/batch`.
+
+    Errors:
+    - 400 Bad Request: more than HEALTH_SAMPLES_MAX_ITEMS samples, undecodable body
+    - 401 Unauthorized: missing credentials
+    - 413 Payload Too Large: decoded body over METRICS_MAX_BODY_BYTES
+    - 415 Unsupported Media Type: unknown Content-Encoding or body format
+    """
+    user_id = current_user.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail={"error_type": "authentication", "detail": "Invalid user"})
+    if len(payload) > settings.HEALTH_SAMPLES_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail={"error_type": "batch_too_large", "detail": f"At most {settings.HEALTH_SAMPLES_MAX_ITEMS} samples per request"})
+    stored = await store_health_samples(db, user_id, [sample.model_dump() for sample in payload])
+    return {"stored": stored}
+
+
+@router.post("/history", response_model=MetricsHistoryResponse,
+             responses={
+                 400: {"model": ErrorResponse},
+                 401: {"model": ErrorResponse},
+                 404: {"model": ErrorResponse},
+                 413: {"model": ErrorResponse},
+                 415: {"model": ErrorResponse},
+             })
+async def post_metrics_history(
+    payload: List[MetricsCreate],
+    current_user=Depends(get_current_user),
+    db=Depends(get_database)
+):
+    """Backfill many past days for the authenticated user in one request.
+
+    Days are replayed in date order in a single pass (baseline learning,
+    activation, deviation flags, risk scores and insights) with the same
+    results as posting them one at a time to `POST /metrics`, then written
+    in bulk. Accepts the same columnar, MessagePack/CBOR and gzip bodies as
+    `POST /metrics/batch`.
+
+    Errors:
+    - 400 Bad Request: more than METRICS_HISTORY_MAX_ITEMS items, undecodable body
+    - 401 Unauthorized: missing credentials
+    - 404 Not Found: the user has no health profile yet
+    - 413 Payload Too Large: decoded body over METRICS_MAX_BODY_BYTES
+    - 415 Unsupported Media Type: unknown Content-Encoding or body format
+    """
+    user_id = current_user.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail={"error_type": "authentication", "detail": "Invalid user"})
+    if len(payload) > settings.METRICS_HISTORY_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail={"error_type": "batch_too_large", "detail": f"At most {settings.METRICS_HISTORY_MAX_ITEMS} days per request"})
+
+    summary = await replay_history(db, user_id, payload)
+    if summary is None:
+        raise HTTPException(status_code=404, detail={"error_type": "not_found", "detail": "Health profile not found"})
+    return summary
+
+
+@router.post("/import",
+             responses={
+                 403: {"model": ErrorResponse},
+                 415: {"model": ErrorResponse},
+             })
+async def post_metrics_import(request: Request, replay: bool = True, db=Depends(get_database)):
+    """Stream an `application/x-ndjson` upload of daily metrics for many users.
+
+    Meant for migrations and research imports; requires the `X-Import-Key`
+    header to match `METRICS_IMPORT_KEY` (the route is disabled while that
+    setting is empty). Each line is one JSON object:
+
+    ```
+    {"user_id": "u-1", "date": "2026-02-21", "steps": 5000, "sleep_duration_minutes": 420, ...}
+    ```
+
+    The body is parsed line by line and flushed in per-user batches, so memory
+    use does not grow with the upload (`Content-Encoding: gzip` is decoded as
+    it streams). With `replay=true` (default) rows go
+    through the AI pipeline like `POST /metrics/history`; `replay=false` only
+    upserts daily_metrics (rows of users still collecting a baseline are
+    replayed anyway, so they count towards activation). Returns line/row counts, throughput and the first
+    errors with their line numbers.
+    """
+    key = request.headers.get("x-import-key", "")
+    if not settings.METRICS_IMPORT_KEY or not hmac.compare_digest(key, settings.METRICS_IMPORT_KEY):
+        raise HTTPException(status_code=403, detail={"error_type": "forbidden", "detail": "Invalid import key"})
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in ("application/x-ndjson", "application/jsonl"):
+        raise HTTPException(status_code=415, detail={"error_type": "unsupported_media_type", "detail": "Use application/x-ndjson"})
+    return await import_ndjson(db, request.stream(), replay=replay)
+
+
 @router.get("/{metrics_date}", response_model=MetricsResponse,
             responses={
                 400: {"model": ErrorResponse},
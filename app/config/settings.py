@@ -10,6 +10,11 @@ class Settings(BaseSettings):
     JWT_SECRET: str = "super-secret-change-me"
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+    # refresh tokens / device OTPs expire through TTL indexes; revoked tokens
+    # are kept REVOKED_TOKEN_RETENTION_HOURS (see app.jobs.compact_auth_tokens)
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+    REVOKED_TOKEN_RETENTION_HOURS: int = 24
+    DEVICE_OTP_TTL_MINUTES: int = 15
 
     # SMTP / delivery
     SENDER_EMAIL: str = ""
@@ -44,7 +49,7 @@ class Settings(BaseSettings):
     # AI / behavioral risk monitoring
     AI_MODEL_PATH: str = ""
     AI_MODEL_NAME: str = ""
-    AI_MODEL_TYPE: str = "baseline"
+    AI_MODEL_TYPE: str = "baseline"  # "robust" = median / MAD baselines over MAX_HISTORY_DAYS
     AI_REFRESH_INTERVAL_HOURS: int = 24
     ENABLE_AI_INSIGHTS: bool = True
     DEVIATION_THRESHOLD: float = 2.0
@@ -52,6 +57,86 @@ class Settings(BaseSettings):
     USE_SYNTHETIC_DATA: bool = False
     SIMULATION_MODE: bool = False
 
+    # CPU-bound scoring process pool (0 = score inline on the event loop)
+    SCORING_PROCESSES: int = 2
+    SCORING_CHUNK_SIZE: int = 250
+
+    # batch rescoring job (python -m app.jobs.rescore)
+    RESCORE_CHUNK_SIZE: int = 500
+    RESCORE_WORKERS: int = 4
+
+    # POST /metrics/batch
+    METRICS_BATCH_MAX_ITEMS: int = 366
+    # POST /metrics/history (days replayed in one request)
+    METRICS_HISTORY_MAX_ITEMS: int = 1098
+    # largest metrics request body after gzip decoding
+    METRICS_MAX_BODY_BYTES: int = 16 * 1024 * 1024
+
+    # background AI job queue for POST /metrics (0 workers = run inline)
+    AI_JOB_WORKERS: int = 4
+    AI_JOB_MAX_PENDING: int = 10000
+    AI_JOB_LEASE_SECONDS: int = 120
+    AI_JOB_SWEEP_SECONDS: float = 30
+    AI_JOB_MAX_ATTEMPTS: int = 3
+    AI_JOB_RETENTION_HOURS: int = 24
+
+    # Idempotency-Key replay window for POST /metrics and /ai/chat
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    IDEMPOTENCY_CACHE_SIZE: int = 5000
+
+    # daily metrics storage: "flat" (a document per day), "monthly" (a
+    # bucket per user and month, see app.jobs.migrate_metrics_buckets) or
+    # "timeseries" (daily_metrics and health as native time-series
+    # collections, created at startup; MongoDB 7.0+)
+    DAILY_METRICS_LAYOUT: str = "flat"
+
+    # write-behind buffer for daily_metrics upserts (0 = write through)
+    METRICS_WRITE_BUFFER_SECONDS: float = 5
+    METRICS_WRITE_BUFFER_MAX_KEYS: int = 10000
+    # flushes a day rejected by the server is retried in before it moves to metrics_dead_letters
+    METRICS_WRITE_BUFFER_MAX_ATTEMPTS: int = 3
+
+    # POST /metrics/samples: raw samples in `health`, rolled up into
+    # daily_metrics every HEALTH_ROLLUP_TICK_SECONDS (0 = no rollups);
+    # samples newer than HEALTH_ROLLUP_LAG_SECONDS wait for the next pass
+    HEALTH_SAMPLES_MAX_ITEMS: int = 10080
+    HEALTH_SAMPLE_INSERT_BATCH: int = 1000
+    HEALTH_ROLLUP_TICK_SECONDS: float = 60
+    HEALTH_ROLLUP_LAG_SECONDS: int = 10
+    HEALTH_ROLLUP_BATCH_SIZE: int = 200
+    HEALTH_ROLLUP_LEASE_SECONDS: int = 300
+
+    # POST /metrics/delta: score-free run cadence for open days (0 = none); fold, count and scoring wait for the close
+    INTRADAY_PIPELINE_INTERVAL_MINUTES: int = 60
+
+    # streaming NDJSON import (POST /metrics/import); empty key disables it
+    METRICS_IMPORT_KEY: str = ""
+    IMPORT_USER_BUFFER_ROWS: int = 500
+    IMPORT_MAX_BUFFERED_ROWS: int = 5000
+    IMPORT_MAX_INFLIGHT_FLUSHES: int = 4
+    IMPORT_MAX_LINE_BYTES: int = 65536
+    IMPORT_ERROR_SAMPLES: int = 20
+
+    # per-user trailing window cache (trend checks, dashboard sparklines)
+    WINDOW_CACHE_DAYS: int = 14
+    WINDOW_CACHE_TTL_SECONDS: int = 60
+    WINDOW_CACHE_MAX_USERS: int = 10000
+
+    # serve dashboards from per-user dashboard_snapshots maintained on write
+    DASHBOARD_SNAPSHOTS_ENABLED: bool = True
+    # in-process dashboard response cache (0 TTL disables it)
+    DASHBOARD_CACHE_TTL_SECONDS: float = 10
+    DASHBOARD_CACHE_MAX_USERS: int = 10000
+    DASHBOARD_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+
+    # periodic baseline refresh over the trailing MAX_HISTORY_DAYS
+    BASELINE_REFRESH_ENABLED: bool = True
+    BASELINE_REFRESH_TICK_SECONDS: int = 300
+    BASELINE_REFRESH_BATCH_SIZE: int = 200
+    BASELINE_REFRESH_CONCURRENCY: int = 4
+    BASELINE_REFRESH_JITTER: float = 0.1  # fraction of the interval added at random
+    BASELINE_REFRESH_LEASE_SECONDS: int = 300
+
     # ignore extra environment variables such as deprecated OpenRouter keys
     # and load values from .env
     model_config = ConfigDict(extra="ignore", env_file=".env")
@@ -115,7 +115,10 @@ async def refresh(response: Response, request: Request, db=Depends(get_database)
         raise HTTPException(status_code=401, detail="Missing refresh token")
 
     token_hash = hash_token(refresh)
-    token_doc = await db.refresh_tokens.find_one({"token_hash": token_hash, "revoked": False})
+    # expires_at is checked here too: the TTL monitor deletes lapsed tokens only every ~60 s
+    token_doc = await db.refresh_tokens.find_one(
+        {"token_hash": token_hash, "revoked": False, "expires_at": {"$gt": datetime.utcnow()}}
+    )
     if not token_doc:
         raise HTTPException(status_code=401, detail="Invalid or revoked refresh token")
 
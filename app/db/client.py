@@ -1,12 +1,53 @@
+import logging
+
 from motor.motor_asyncio import AsyncIOMotorClient
 from fastapi import FastAPI, Request
 from typing import AsyncGenerator
 from app.config.settings import settings
+from app.db.indexes import ensure_indexes
+
+logger = logging.getLogger(__name__)
+
+# collections created as native time-series with DAILY_METRICS_LAYOUT=timeseries;
+# days and health samples are written about once per user per day/hour
+TIMESERIES_COLLECTIONS = {
+    "daily_metrics": {"timeField": "date", "metaField": "user_id", "granularity": "hours"},
+    # legacy health entries carry their time in `timestamp` (see health_service)
+    "health": {"timeField": "timestamp", "metaField": "user_id", "granularity": "minutes"},
+}
+
+
+async def ensure_timeseries_collections(db) -> None:
+    """Create the metrics collections as time-series collections if they do not exist yet.
+
+    A collection that already exists as a regular collection is left as it is
+    (MongoDB cannot convert it in place); copy it into a new time-series
+    collection with an ``$out`` stage before switching the layout.
+    """
+    cursor = await db.list_collections(filter={"name": {"$in": list(TIMESERIES_COLLECTIONS)}})
+    existing = {info["name"]: info for info in await cursor.to_list(length=None)}
+    for name, options in TIMESERIES_COLLECTIONS.items():
+        info = existing.get(name)
+        if info is None:
+            await db.create_collection(name, timeseries=options)
+            logger.info(f"created time-series collection {name} ({options})")
+        elif info.get("type") != "timeseries":
+            logger.warning(f"{name} is a regular collection; time-series storage needs it recreated")
 
 
 async def connect_to_mongo(app: FastAPI) -> None:
     app.state.mongo_client = AsyncIOMotorClient(settings.MONGODB_URI)
     app.state.db = app.state.mongo_client[settings.DATABASE_NAME]
+    if settings.DAILY_METRICS_LAYOUT == "timeseries":
+        try:
+            await ensure_timeseries_collections(app.state.db)
+        except Exception as exc:
+            logger.error(f"could not create time-series collections: {exc}")
+    # after the time-series collections: creating an index creates a plain collection
+    try:
+        await ensure_indexes(app.state.db)
+    except Exception as exc:
+        logger.error(f"could not apply the index registry: {exc}")
 
 
 async def close_mongo(app: FastAPI) -> None:
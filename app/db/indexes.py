@@ -0,0 +1,101 @@
+"""
+Index registry.
+
+Every index the services rely on is declared here once and created by
+`ensure_indexes`, which `connect_to_mongo` runs at startup:
+
+- ``create_index`` is a no-op for an index that already exists, so applying
+  the registry is idempotent and safe on every worker start
+- an index that exists with other options (e.g. the old non-unique
+  ``daily_metrics`` index) or a unique index blocked by duplicate documents
+  is logged and skipped; ``python -m app.jobs.dedupe_daily_metrics`` fixes
+  the daily_metrics one
+- the daily_metrics indexes come from the configured storage layout (see
+  `metrics_repository`): ``(user_id, date)`` is unique for flat documents,
+  which makes the daily upsert safe against concurrent first writes
+
+Queries are checked against this registry by ``tests/test_query_plans.py``
+(``explain()`` on a local mongod; no query may fall back to COLLSCAN).
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+INDEX_OPTIONS_CONFLICT = 85
+INDEX_KEY_SPECS_CONFLICT = 86
+
+
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: List[Tuple[str, int]]
+    options: Optional[Dict[str, Any]] = None
+
+
+INDEXES: List[IndexSpec] = [
+    # accounts and sessions
+    IndexSpec("users", [("user_id", ASCENDING)], {"unique": True, "sparse": True}),
+    IndexSpec("users", [("email", ASCENDING)], {"unique": True}),
+    IndexSpec("refresh_tokens", [("token_hash", ASCENDING)]),
+    IndexSpec("refresh_tokens", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    IndexSpec("devices", [("user_id", ASCENDING), ("fingerprint", ASCENDING)], {"unique": True}),
+    IndexSpec("device_otps", [("user_id", ASCENDING), ("device_id", ASCENDING)]),
+    IndexSpec("device_otps", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    # per-user reads
+    IndexSpec("health_profiles", [("user_id", ASCENDING)]),
+    IndexSpec("ai_insights", [("user_id", ASCENDING), ("date", DESCENDING)]),
+    IndexSpec("chat_history", [("user_id", ASCENDING), ("timestamp", ASCENDING)]),
+    IndexSpec("alerts", [("user_id", ASCENDING), ("created_at", DESCENDING)]),
+    IndexSpec("health", [("user_id", ASCENDING), ("timestamp", ASCENDING)]),
+    # background work
+    IndexSpec("health", [("user_id", ASCENDING), ("_id", ASCENDING)]),
+    IndexSpec("health_rollups", [("dirty", ASCENDING)], {"partialFilterExpression": {"dirty": True}}),
+    IndexSpec("health_profiles", [("baseline_status", ASCENDING), ("baseline_refresh_due_at", ASCENDING)],
+              {"name": "baseline_refresh_due"}),
+    IndexSpec("baseline_refresh_leases", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    IndexSpec("ai_jobs", [("status", ASCENDING), ("created_at", ASCENDING)], {"name": "ai_jobs_status"}),
+    IndexSpec("ai_jobs", [("user_id", ASCENDING), ("created_at", ASCENDING)], {"name": "ai_jobs_user"}),
+    IndexSpec("ai_jobs", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    IndexSpec("ai_job_leases", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    IndexSpec("idempotency_keys", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+]
+
+
+def registry() -> List[IndexSpec]:
+    """All declared indexes, with those of the configured daily_metrics layout."""
+    from app.services.metrics_repository import metrics_repository
+
+    return INDEXES + list(metrics_repository.layout.indexes)
+
+
+async def _create(db, spec: IndexSpec) -> Optional[str]:
+    try:
+        return await db[spec.collection].create_index(spec.keys, **(spec.options or {}))
+    except OperationFailure as exc:
+        keys = ", ".join(field for field, _ in spec.keys)
+        if exc.code in (INDEX_OPTIONS_CONFLICT, INDEX_KEY_SPECS_CONFLICT):
+            logger.warning(f"index {spec.collection}({keys}) exists with other options, drop it to apply: {exc}")
+        elif exc.code == DUPLICATE_KEY:
+            logger.error(f"unique index {spec.collection}({keys}) blocked by duplicate documents: {exc}")
+        else:
+            logger.error(f"could not create index {spec.collection}({keys}): {exc}")
+        return None
+
+
+async def ensure_indexes(db, specs: Optional[Iterable[IndexSpec]] = None,
+                         collections: Optional[Iterable[str]] = None) -> List[str]:
+    """Create `specs` (default: the whole registry), optionally only for `collections`.
+
+    Returns the names of the indexes in place; failures are logged, not raised.
+    """
+    specs = list(registry() if specs is None else specs)
+    if collections is not None:
+        wanted = set(collections)
+        specs = [spec for spec in specs if spec.collection in wanted]
+    names = await asyncio.gather(*(_create(db, spec) for spec in specs))
+    return [name for name in names if name]
@@ -0,0 +1,98 @@
+"""
+Compact refresh_tokens and device_otps.
+
+TTL indexes on ``expires_at`` (see `app.db.indexes`) delete lapsed tokens
+and OTPs in the background, and every insert path now sets ``expires_at``.
+This job covers what TTL cannot:
+
+- tokens stored before expiry was enforced get ``expires_at`` =
+  ``created_at`` + REFRESH_TOKEN_EXPIRE_DAYS; revoked ones are cut to
+  REVOKED_TOKEN_RETENTION_HOURS from now (the refresh lookups require
+  ``expires_at``, so run this once on deploy or older sessions are rejected)
+- used OTPs and OTPs without an expiry expire now
+- everything past ``expires_at`` is deleted right away, without waiting for
+  the TTL monitor (or where the TTL index is missing)
+- ``--compact`` runs MongoDB's ``compact`` on both collections afterwards to
+  give the freed space back
+
+Usage:
+    python -m app.jobs.compact_auth_tokens --dry-run
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import settings
+from app.services.auth_service import revoked_token_expiry
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS = ("refresh_tokens", "device_otps")
+
+
+async def backfill_expiry(db, now: datetime) -> Dict[str, int]:
+    """Give legacy documents an expiry. Returns the number updated per kind."""
+    lifetime_ms = int(timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS).total_seconds() * 1000)
+    tokens = await db.refresh_tokens.update_many(
+        {"expires_at": None},
+        [{"$set": {"expires_at": {"$add": [{"$ifNull": ["$created_at", now]}, lifetime_ms]}}}],
+    )
+    revoked = await db.refresh_tokens.update_many(
+        {"revoked": True, "expires_at": {"$gt": revoked_token_expiry(now)}},
+        {"$set": {"expires_at": revoked_token_expiry(now)}},
+    )
+    otps = await db.device_otps.update_many(
+        {"$or": [{"used": True, "expires_at": {"$gt": now}}, {"expires_at": None}]},
+        {"$set": {"expires_at": now}},
+    )
+    return {"tokens": tokens.modified_count, "revoked": revoked.modified_count, "otps": otps.modified_count}
+
+
+async def run_compaction(db, now: Optional[datetime] = None, dry_run: bool = False,
+                         compact: bool = False) -> Dict[str, Any]:
+    """Expire legacy documents and delete lapsed ones. Returns counts."""
+    now = now or datetime.utcnow()
+    if dry_run:
+        summary: Dict[str, Any] = {
+            "no_expiry": await db.refresh_tokens.count_documents({"expires_at": None}),
+            "revoked": await db.refresh_tokens.count_documents({"revoked": True}),
+        }
+        for name in COLLECTIONS:
+            summary[f"{name}_expired"] = await db[name].count_documents({"expires_at": {"$lte": now}})
+        logger.info(f"compact auth tokens (dry run): {summary}")
+        return summary
+
+    summary = {"backfilled": await backfill_expiry(db, now)}
+    for name in COLLECTIONS:
+        result = await db[name].delete_many({"expires_at": {"$lte": now}})
+        summary[f"{name}_deleted"] = result.deleted_count
+    if compact:
+        for name in COLLECTIONS:
+            await db.command("compact", name)
+    logger.info(f"compact auth tokens: {summary}")
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Expire and delete lapsed refresh tokens and device OTPs.")
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be expired")
+    parser.add_argument("--compact", action="store_true", help="run the compact command afterwards")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def _run():
+        client = AsyncIOMotorClient(settings.MONGODB_URI)
+        try:
+            await run_compaction(client[settings.DATABASE_NAME], dry_run=args.dry_run, compact=args.compact)
+        finally:
+            client.close()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Remove duplicate daily_metrics days and make ``(user_id, date)`` unique.
+
+Before the index registry, ``daily_metrics`` only had a plain
+``(user_id, date)`` index, so concurrent first upserts of a day could
+create two documents. This job:
+
+- groups documents by ``(user_id, date)`` and keeps the most recently
+  updated one of each duplicate group (``--dry-run`` only reports them)
+- drops the old non-unique index and creates the unique one from
+  `app.db.indexes`
+
+Run it once before (or after) deploying the registry; startup logs a
+warning while the non-unique index is still in place.
+
+Usage:
+    python -m app.jobs.dedupe_daily_metrics --dry-run
+"""
+import argparse
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import settings
+from app.db.indexes import ensure_indexes
+from app.services.metrics_repository import FlatLayout
+
+logger = logging.getLogger(__name__)
+
+KEYS = [("user_id", 1), ("date", 1)]
+
+
+async def find_duplicates(db) -> List[Dict[str, Any]]:
+    """Groups of more than one document per (user_id, date), newest first."""
+    cursor = db.daily_metrics.aggregate([
+        {"$sort": {"updated_at": -1}},
+        {"$group": {"_id": {"user_id": "$user_id", "date": "$date"}, "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    return await cursor.to_list(length=None)
+
+
+async def run_dedupe(db, dry_run: bool = False) -> Dict[str, Any]:
+    groups = await find_duplicates(db)
+    extra = [doc_id for group in groups for doc_id in group["ids"][1:]]
+    summary: Dict[str, Any] = {"groups": len(groups), "removed": 0, "unique_index": False}
+    if dry_run:
+        summary["removable"] = len(extra)
+        logger.info(f"dedupe daily_metrics (dry run): {summary}")
+        return summary
+    for i in range(0, len(extra), 1000):
+        result = await db.daily_metrics.delete_many({"_id": {"$in": extra[i:i + 1000]}})
+        summary["removed"] += result.deleted_count
+
+    indexes = await db.daily_metrics.index_information()
+    for name, info in indexes.items():
+        if [tuple(k) for k in info["key"]] == KEYS and not info.get("unique"):
+            await db.daily_metrics.drop_index(name)
+            logger.info(f"dedupe daily_metrics: dropped non-unique index {name}")
+    summary["unique_index"] = bool(await ensure_indexes(db, FlatLayout.indexes))
+    logger.info(f"dedupe daily_metrics: {summary}")
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Remove duplicate daily_metrics days and make (user_id, date) unique.")
+    parser.add_argument("--dry-run", action="store_true", help="only count duplicate groups")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def _run():
+        client = AsyncIOMotorClient(settings.MONGODB_URI)
+        try:
+            await run_dedupe(client[settings.DATABASE_NAME], dry_run=args.dry_run)
+        finally:
+            client.close()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
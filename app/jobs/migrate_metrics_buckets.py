@@ -0,0 +1,123 @@
+"""
+Migrate flat daily_metrics documents into monthly buckets.
+
+Copies every ``daily_metrics`` document into its user-month bucket in
+``daily_metrics_buckets`` (see `app.services.metrics_repository`); the flat
+collection is left untouched so the switch can be rolled back.
+
+- documents are read in ``_id`` order, `chunk_size` at a time, and written
+  with the bucket layout's unordered bulk upsert
+- each day keeps its ``_id``; re-running overwrites slots with the flat
+  values, so the migration is idempotent
+- the last migrated ``_id`` is checkpointed in `job_checkpoints`, so an
+  interrupted run resumes where it stopped
+
+Days written while the migration runs may be missed: run it once while the
+app is live, then again with ``--restart`` during a short write freeze, and
+set ``DAILY_METRICS_LAYOUT=monthly`` before starting the app again.
+
+Usage:
+    python -m app.jobs.migrate_metrics_buckets --chunk-size 5000
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import settings
+from app.services.metrics_repository import BUCKET_COLLECTION, DayWrite, MonthlyBucketLayout
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "migrate_metrics_buckets"
+CHUNK_SIZE = 5000
+
+
+def bucket_writes(docs: List[Dict[str, Any]]) -> List[DayWrite]:
+    return [
+        DayWrite(
+            doc["user_id"],
+            doc["date"],
+            {
+                "$set": {k: v for k, v in doc.items() if k not in ("_id", "user_id")},
+                "$setOnInsert": {"_id": doc["_id"]},
+            },
+            upsert=True,
+        )
+        for doc in docs
+    ]
+
+
+async def run_migration(
+    db,
+    chunk_size: int = CHUNK_SIZE,
+    job_name: str = JOB_NAME,
+    restart: bool = False,
+) -> Dict[str, Any]:
+    """Copy all flat days into buckets. Returns counts and duration."""
+    buckets = MonthlyBucketLayout()
+    await buckets.ensure_indexes(db)
+    checkpoint = None if restart else await db.job_checkpoints.find_one({"_id": job_name})
+    if checkpoint and checkpoint.get("done"):
+        checkpoint = None
+    after = checkpoint.get("last_id") if checkpoint else None
+    migrated = checkpoint.get("processed", 0) if checkpoint else 0
+    if after is not None:
+        logger.info(f"migrate buckets: resuming after {after} ({migrated} days already done)")
+
+    started = time.monotonic()
+    while True:
+        query = {"_id": {"$gt": after}} if after is not None else {}
+        docs = await db.daily_metrics.find(query).sort("_id", 1).limit(chunk_size).to_list(length=None)
+        if not docs:
+            break
+        await buckets.bulk_write(db, bucket_writes(docs))
+        after = docs[-1]["_id"]
+        migrated += len(docs)
+        await db.job_checkpoints.update_one(
+            {"_id": job_name},
+            {"$set": {"last_id": after, "processed": migrated, "done": False, "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        elapsed = time.monotonic() - started
+        logger.info(f"migrate buckets: {migrated} days ({migrated / elapsed if elapsed else 0:.0f}/s)")
+
+    await db.job_checkpoints.update_one({"_id": job_name}, {"$set": {"done": True}}, upsert=True)
+    summary = {
+        "days": migrated,
+        "buckets": await db[BUCKET_COLLECTION].count_documents({}),
+        "seconds": round(time.monotonic() - started, 2),
+    }
+    logger.info(f"migrate buckets: finished {summary}")
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Copy flat daily_metrics into monthly buckets.")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--job-name", default=JOB_NAME)
+    parser.add_argument("--restart", action="store_true", help="ignore any saved checkpoint")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def _run():
+        client = AsyncIOMotorClient(settings.MONGODB_URI)
+        try:
+            await run_migration(
+                client[settings.DATABASE_NAME],
+                chunk_size=args.chunk_size,
+                job_name=args.job_name,
+                restart=args.restart,
+            )
+        finally:
+            client.close()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
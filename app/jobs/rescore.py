@@ -0,0 +1,286 @@
+"""
+Batch rescoring job.
+
+Recomputes deviation flags, risk scores and insights for every user whose
+baseline is active (e.g. after changing thresholds or SIGNAL_WEIGHTS)
+without replaying /metrics posts.
+
+- health_profiles are streamed in user_id order, `chunk_size` at a time
+- each chunk's daily_metrics windows come from one `$in` query, plus the
+  CONSECUTIVE_DAYS_FOR_TREND stored days before the window as trend context
+- the chunk is scored with the vectorized engine in the scoring process pool
+- results are written with unordered bulk_write (daily_metrics flags,
+  one new ai_insights doc per user, health_profiles.risk_score and the
+  insight and risk of existing dashboard_snapshots)
+- the last fully processed user_id is checkpointed in `job_checkpoints`,
+  so an interrupted run resumes where it stopped
+
+Usage:
+    python -m app.jobs.rescore --workers 4 --chunk-size 500 --window-days 14
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import InsertOne, UpdateOne
+
+from app.config.settings import settings
+from app.services.ai_service import CONSECUTIVE_DAYS_FOR_TREND, build_insight
+from app.services.dashboard_service import insight_sections
+from app.services.metrics_repository import DayWrite, metrics_repository
+from app.services.scoring_executor import scoring_executor
+from app.services.vector_engine import score_pairs
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "rescore"
+PROFILE_PROJECTION = {
+    "user_id": 1,
+    "baseline_status": 1,
+    "baseline_metrics": 1,
+    "enabled_signals": 1,
+}
+
+
+async def load_checkpoint(db, job_name: str = JOB_NAME) -> Optional[Dict[str, Any]]:
+    return await db.job_checkpoints.find_one({"_id": job_name})
+
+
+async def save_checkpoint(db, job_name: str, last_user_id: str, processed: int, done: bool = False):
+    await db.job_checkpoints.update_one(
+        {"_id": job_name},
+        {"$set": {
+            "last_user_id": last_user_id,
+            "processed": processed,
+            "done": done,
+            "updated_at": datetime.utcnow(),
+        }},
+        upsert=True,
+    )
+
+
+async def iter_active_profiles(db, chunk_size: int, after: Optional[str] = None):
+    """Yield chunks of active profiles in user_id order (keyset pagination)."""
+    while True:
+        query: Dict[str, Any] = {"baseline_status": "active"}
+        if after is not None:
+            query["user_id"] = {"$gt": after}
+        cursor = db.health_profiles.find(query, PROFILE_PROJECTION).sort("user_id", 1).limit(chunk_size)
+        chunk = await cursor.to_list(length=None)
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1]["user_id"]
+
+
+async def fetch_windows(db, user_ids: List[str], since: datetime) -> Dict[str, List[Dict[str, Any]]]:
+    """Every user's window, grouped by user (date ascending).
+
+    The days from `since` come from one `$in` query. Users with days in the
+    window also get the CONSECUTIVE_DAYS_FOR_TREND stored days before it
+    (not calendar days, gaps are skipped) so the first rescored day keeps
+    the trend context the /metrics pipeline scored it with.
+    """
+    windows: Dict[str, List[Dict[str, Any]]] = {uid: [] for uid in user_ids}
+    for doc in await metrics_repository.find_users_days(db, user_ids, {"$gte": since}):
+        windows[doc["user_id"]].append(doc)
+    scored = [uid for uid in user_ids if windows[uid]]
+    contexts = await asyncio.gather(*(
+        metrics_repository.find_days(
+            db, uid, date={"$lt": since}, sort=-1, limit=CONSECUTIVE_DAYS_FOR_TREND,
+        )
+        for uid in scored
+    ))
+    for uid, context in zip(scored, contexts):
+        windows[uid] = list(reversed(context)) + windows[uid]
+    return windows
+
+
+def build_chunk_writes(
+    profiles: List[Dict[str, Any]],
+    windows: Dict[str, List[Dict[str, Any]]],
+    scores: List[List[Dict[str, Any]]],
+    since: datetime,
+) -> Dict[str, list]:
+    """Turn a scored chunk into bulk write operations per collection.
+
+    Days before `since` only provide trend context and are not rewritten.
+    """
+    now = datetime.utcnow()
+    ops: Dict[str, list] = {"daily_metrics": [], "ai_insights": [], "health_profiles": [], "dashboard_snapshots": []}
+    user_windows = [windows.get(p["user_id"], []) for p in profiles]
+    for profile, docs, results in zip(profiles, user_windows, scores):
+        if not docs:
+            continue
+        user_id = profile["user_id"]
+        latest = None
+        for doc, result in zip(docs, results):
+            if doc["date"] < since:
+                continue
+            latest = result
+            ops["daily_metrics"].append(DayWrite(
+                user_id,
+                doc["date"],
+                {"$set": {
+                    "deviation_flags": result["deviation_flags"],
+                    "risk_score": result["risk_score"],
+                    "updated_at": now,
+                }},
+            ))
+        # only context days in the window: nothing was rescored for this user
+        if latest is None:
+            continue
+        insight = build_insight(user_id, latest["deviation_flags"], latest["risk_score"])
+        ops["ai_insights"].append(InsertOne(insight))
+        ops["health_profiles"].append(UpdateOne(
+            {"user_id": user_id},
+            {"$set": {"risk_score": latest["risk_score"], "updated_at": now}},
+        ))
+        # users without a snapshot get one built on their next dashboard read
+        ops["dashboard_snapshots"].append(UpdateOne(
+            {"_id": user_id},
+            {"$set": {**insight_sections(insight), "risk_score": latest["risk_score"], "updated_at": now}},
+        ))
+    return ops
+
+
+async def rescore_chunk(db, profiles: List[Dict[str, Any]], window_days: int) -> int:
+    """Rescore one chunk of profiles. Returns the number of users written."""
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    since = today - timedelta(days=window_days - 1)
+    windows = await fetch_windows(db, [p["user_id"] for p in profiles], since)
+    # CPU-bound scoring runs in the process pool, split into parallel batches
+    pairs = [(p, windows.get(p["user_id"], [])) for p in profiles]
+    scores = await scoring_executor.map_chunks(score_pairs, pairs)
+    ops = build_chunk_writes(profiles, windows, scores, since)
+    await asyncio.gather(*(
+        metrics_repository.bulk_write(db, collection_ops) if name == "daily_metrics"
+        else getattr(db, name).bulk_write(collection_ops, ordered=False)
+        for name, collection_ops in ops.items()
+        if collection_ops
+    ))
+    return len(ops["health_profiles"])
+
+
+async def run_rescore(
+    db,
+    chunk_size: int = settings.RESCORE_CHUNK_SIZE,
+    workers: int = settings.RESCORE_WORKERS,
+    window_days: int = 14,
+    job_name: str = JOB_NAME,
+    restart: bool = False,
+) -> Dict[str, Any]:
+    """Rescore all active users with `workers` chunks in flight.
+
+    The checkpoint only advances past a chunk once it and every chunk before
+    it are written, so resuming never skips users. If a chunk fails, the
+    other workers and the producer are cancelled and the error is raised.
+    """
+    checkpoint = None if restart else await load_checkpoint(db, job_name)
+    if checkpoint and checkpoint.get("done"):
+        checkpoint = None
+    after = checkpoint.get("last_user_id") if checkpoint else None
+    processed = checkpoint.get("processed", 0) if checkpoint else 0
+
+    query: Dict[str, Any] = {"baseline_status": "active"}
+    if after is not None:
+        query["user_id"] = {"$gt": after}
+        logger.info(f"rescore: resuming after user {after} ({processed} users already done)")
+    remaining = await db.health_profiles.count_documents(query)
+    total = processed + remaining
+
+    workers = max(1, workers)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    finished: Dict[int, tuple] = {}
+    next_to_commit = 0
+    written = 0
+    started = time.monotonic()
+    lock = asyncio.Lock()
+
+    async def produce():
+        index = 0
+        async for chunk in iter_active_profiles(db, chunk_size, after):
+            await queue.put((index, chunk))
+            index += 1
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def work():
+        nonlocal next_to_commit, processed, written
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, chunk = item
+            users = await rescore_chunk(db, chunk, window_days)
+            async with lock:
+                finished[index] = (chunk[-1]["user_id"], len(chunk), users)
+                # advance the checkpoint over the contiguous finished prefix
+                while next_to_commit in finished:
+                    last_user_id, size, users_written = finished.pop(next_to_commit)
+                    processed += size
+                    written += users_written
+                    next_to_commit += 1
+                    await save_checkpoint(db, job_name, last_user_id, processed)
+                elapsed = time.monotonic() - started
+                logger.info(
+                    f"rescore: {processed}/{total} profiles "
+                    f"({written} rescored, {processed / elapsed if elapsed else 0:.0f}/s)"
+                )
+
+    # a failed worker would leave the producer blocked on a full queue
+    tasks = [asyncio.ensure_future(produce()), *(asyncio.ensure_future(work()) for _ in range(workers))]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    await db.job_checkpoints.update_one({"_id": job_name}, {"$set": {"done": True}}, upsert=True)
+
+    summary = {
+        "processed": processed,
+        "rescored": written,
+        "total": total,
+        "seconds": round(time.monotonic() - started, 2),
+    }
+    logger.info(f"rescore: finished {summary}")
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Rescore AI insights for every active user.")
+    parser.add_argument("--chunk-size", type=int, default=settings.RESCORE_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=settings.RESCORE_WORKERS)
+    parser.add_argument("--window-days", type=int, default=14)
+    parser.add_argument("--job-name", default=JOB_NAME)
+    parser.add_argument("--restart", action="store_true", help="ignore any saved checkpoint")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def _run():
+        client = AsyncIOMotorClient(settings.MONGODB_URI)
+        try:
+            await run_rescore(
+                client[settings.DATABASE_NAME],
+                chunk_size=args.chunk_size,
+                workers=args.workers,
+                window_days=args.window_days,
+                job_name=args.job_name,
+                restart=args.restart,
+            )
+        finally:
+            client.close()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,12 @@ import logging
 from app.core.config import settings
 from app.routers import router
 from app.core.database import connect_to_mongo, close_mongo
+from app.services.scoring_executor import scoring_executor
+from app.services.baseline_refresh import baseline_refresh_scheduler
+from app.services.write_buffer import metrics_write_buffer
+from app.services.ai_jobs import ai_job_queue
+from app.services.sample_rollup import sample_rollup_scheduler
+from app.services.dashboard_service import dashboard_snapshots
 from app.middleware.csrf import csrf_protect
 from app.middleware.refresh_middleware import RefreshTokenMiddleware
 from fastapi.middleware.cors import CORSMiddleware
@@ -13,10 +19,25 @@ def create_app() -> FastAPI:
     logging.basicConfig(level=logging.INFO)
     app.include_router(router)
     async def _startup() -> None:
+        # also creates the registered indexes (app.db.indexes)
         await connect_to_mongo(app)
+        metrics_write_buffer.start(app.state.db)
+        ai_job_queue.start(app.state.db)
+        sample_rollup_scheduler.start(app.state.db)
+        if settings.DASHBOARD_SNAPSHOTS_ENABLED:
+            dashboard_snapshots.start()
+        if settings.BASELINE_REFRESH_ENABLED:
+            baseline_refresh_scheduler.start(app.state.db)
 
     async def _shutdown() -> None:
+        await baseline_refresh_scheduler.stop()
+        dashboard_snapshots.stop()
+        await sample_rollup_scheduler.stop()
+        await ai_job_queue.stop()
+        # write pending daily_metrics before the client closes
+        await metrics_write_buffer.stop()
         await close_mongo(app)
+        scoring_executor.shutdown()
 
     app.add_event_handler("startup", _startup)
     app.add_event_handler("shutdown", _shutdown)
@@ -0,0 +1,153 @@
+"""
+Compact request bodies for the metrics ingest routes.
+
+Wearable syncs repeat long field names (`sleep_duration_minutes`,
+`location_diversity_score`) for every day. Routes using `DecodedBodyRoute`
+accept, besides JSON:
+
+- ``Content-Type: application/msgpack`` or ``application/cbor`` bodies
+  (needs the optional ``msgpack`` / ``cbor2`` packages; 415 otherwise)
+- ``Content-Encoding: gzip`` on any body, decompressed while it streams in;
+  buffered bodies are capped at METRICS_MAX_BODY_BYTES after decompression
+- columnar batches: an object with one array per field,
+  ``{"date": ["2026-02-20", "2026-02-21"], "steps": [5000, 6100], ...}``,
+  is turned into one row per index before validation
+
+The decoded value goes through the same `MetricsCreate` models as JSON.
+"""
+import json
+import zlib
+from typing import Any, AsyncGenerator, Callable, Dict, List
+
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.config.settings import settings
+
+try:
+    import msgpack
+except ImportError:  # optional: application/msgpack bodies are rejected with 415
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # optional: application/cbor bodies are rejected with 415
+    cbor2 = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+CBOR_TYPES = ("application/cbor",)
+GZIP_ENCODINGS = ("gzip", "x-gzip")
+# largest decompressed piece produced per step, so a tiny gzip bomb cannot
+# allocate a huge buffer in one call
+_INFLATE_CHUNK = 64 * 1024
+
+
+def _error(status_code: int, error_type: str, detail: str) -> HTTPException:
+    return HTTPException(status_code=status_code, detail={"error_type": error_type, "detail": detail})
+
+
+def expand_columns(payload: Any) -> Any:
+    """Turn ``{"field": [v0, v1, ...], ...}`` into ``[{"field": v0, ...}, ...]``.
+
+    Anything that is not an object of arrays is returned unchanged.
+    """
+    if not isinstance(payload, dict) or not payload or not all(isinstance(v, list) for v in payload.values()):
+        return payload
+    lengths = {len(v) for v in payload.values()}
+    if len(lengths) != 1:
+        raise _error(400, "invalid_columnar_batch", "All columns must have the same length")
+    fields = list(payload)
+    return [dict(zip(fields, row)) for row in zip(*payload.values())]
+
+
+def decode_payload(body: bytes, media_type: str) -> Any:
+    """Decode a JSON, MessagePack or CBOR body into Python values."""
+    if media_type in MSGPACK_TYPES:
+        try:
+            return msgpack.unpackb(body, raw=False, strict_map_key=True)
+        except Exception:
+            raise _error(400, "invalid_body", "Body is not valid MessagePack")
+    if media_type in CBOR_TYPES:
+        try:
+            return cbor2.loads(body)
+        except Exception:
+            raise _error(400, "invalid_body", "Body is not valid CBOR")
+    # JSON decode errors become FastAPI's usual 422 validation error
+    return json.loads(body)
+
+
+class DecodedBodyRequest(Request):
+    """A request whose body is gunzipped and decoded by media type."""
+
+    def __init__(self, scope, receive):
+        super().__init__(scope, receive)
+        self.body_media_type = self.headers.get("content-type", "").split(";")[0].strip().lower()
+        self.body_encoding = self.headers.get("content-encoding", "").strip().lower()
+        if self.body_media_type in MSGPACK_TYPES + CBOR_TYPES:
+            # FastAPI only hands application/json bodies to `json()`
+            headers = self.headers.mutablecopy()
+            headers["content-type"] = "application/json"
+            self._headers = headers
+
+    def check(self) -> None:
+        if self.body_encoding not in ("", "identity") + GZIP_ENCODINGS:
+            raise _error(415, "unsupported_media_type", f"Unsupported Content-Encoding {self.body_encoding!r}; use gzip")
+        if self.body_media_type in MSGPACK_TYPES and msgpack is None:
+            raise _error(415, "unsupported_media_type", "MessagePack bodies are not supported by this server")
+        if self.body_media_type in CBOR_TYPES and cbor2 is None:
+            raise _error(415, "unsupported_media_type", "CBOR bodies are not supported by this server")
+
+    async def stream(self) -> AsyncGenerator[bytes, None]:
+        if self.body_encoding not in GZIP_ENCODINGS or hasattr(self, "_body"):
+            async for chunk in super().stream():
+                yield chunk
+            return
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            async for chunk in super().stream():
+                while chunk:
+                    data = inflater.decompress(chunk, _INFLATE_CHUNK)
+                    chunk = inflater.unconsumed_tail
+                    if data:
+                        yield data
+            data = inflater.flush()
+        except zlib.error:
+            raise _error(400, "invalid_body", "Body is not valid gzip")
+        if not inflater.eof:
+            raise _error(400, "invalid_body", "Truncated gzip body")
+        if data:
+            yield data
+        yield b""
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            chunks: List[bytes] = []
+            size = 0
+            async for chunk in self.stream():
+                size += len(chunk)
+                if size > settings.METRICS_MAX_BODY_BYTES:
+                    raise _error(413, "payload_too_large", f"Decoded body exceeds {settings.METRICS_MAX_BODY_BYTES} bytes")
+                chunks.append(chunk)
+            self._body = b"".join(chunks)
+        return self._body
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = expand_columns(decode_payload(await self.body(), self.body_media_type))
+        return self._json
+
+
+class DecodedBodyRoute(APIRoute):
+    """Route class that hands endpoints a `DecodedBodyRequest`."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def decoded_handler(request: Request) -> Response:
+            request = DecodedBodyRequest(request.scope, request.receive)
+            request.check()
+            return await handler(request)
+
+        return decoded_handler
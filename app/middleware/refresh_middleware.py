@@ -1,3 +1,4 @@
+from datetime import datetime
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from starlette.responses import Response
@@ -43,7 +44,9 @@ class RefreshTokenMiddleware(BaseHTTPMiddleware):
                 if refresh:
                     db = get_database(request)
                     token_hash = hash_token(refresh)
-                    token_doc = await db.refresh_tokens.find_one({"token_hash": token_hash, "revoked": False})
+                    token_doc = await db.refresh_tokens.find_one(
+                        {"token_hash": token_hash, "revoked": False, "expires_at": {"$gt": datetime.utcnow()}}
+                    )
                     if token_doc:
                         user_id = token_doc.get("user_id")
                         dev = await db.devices.find_one({"fingerprint": device_id, "user_id": user_id})
@@ -14,3 +14,20 @@ class HealthTrendResponse(BaseModel):
     start: datetime
     end: datetime
     aggregates: Dict[str, Any]
+
+
+class HealthSample(BaseModel):
+    """One raw (typically per-minute) sample for POST /metrics/samples."""
+    type: str  # steps|sleep|sedentary|screen_time roll up into daily_metrics
+    timestamp: datetime
+    value: float  # steps, or minutes for sleep/sedentary/screen_time
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {"type": "steps", "timestamp": "2026-02-21T08:31:00Z", "value": 112}
+        }
+    }
+
+
+class HealthSamplesResponse(BaseModel):
+    stored: int
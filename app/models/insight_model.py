@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Dict, Any, Optional
 
 
@@ -15,3 +15,17 @@ class InsightDocument(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class AIJobResponse(BaseModel):
+    job_id: str
+    status: str  # "queued" | "running" | "done" | "failed"
+    date: date
+    attempts: int = 0
+    baseline_status: Optional[str] = None
+    deviation_flags: Optional[Dict[str, bool]] = None
+    risk_score: Optional[float] = None
+    insight: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
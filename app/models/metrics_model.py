@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime, date
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 
 class MetricsCreate(BaseModel):
@@ -40,6 +40,79 @@ class MetricsResponse(BaseModel):
     updated_at: datetime
     deviation_flags: Optional[Dict[str, bool]] = None
     risk_score: Optional[float] = None
+    # set when the AI steps run in the background job queue
+    ai_job_id: Optional[str] = None
 
     class Config:
         from_attributes = True
+
+
+class MetricsHistoryResponse(BaseModel):
+    days: int
+    insights: int
+    baseline_status: Optional[str] = None
+    baseline_days_collected: int = 0
+    activated_on: Optional[date] = None
+    risk_score: Optional[float] = None
+    failed: int = 0
+
+
+DateField = date  # `date` is shadowed by the field name below
+
+
+class MetricsBatchItemResult(BaseModel):
+    index: int
+    status: str  # "stored" | "invalid" | "error"
+    date: Optional[DateField] = None
+    deviation_flags: Optional[Dict[str, bool]] = None
+    risk_score: Optional[float] = None
+    errors: Optional[List[Dict[str, Any]]] = None
+
+
+class MetricsBatchResponse(BaseModel):
+    stored: int
+    invalid: int
+    failed: int
+    baseline_status: Optional[str] = None
+    risk_score: Optional[float] = None
+    items: List[MetricsBatchItemResult]
+
+
+class MetricsDelta(BaseModel):
+    """Intraday increments for one day; totals are applied with `$max`."""
+    date: date
+    steps: int = Field(default=0, ge=0)
+    active_minutes: int = Field(default=0, ge=0)
+    sedentary_minutes: int = Field(default=0, ge=0)
+    screen_time_minutes: int = Field(default=0, ge=0)
+    sleep_duration_minutes: Optional[int] = Field(default=None, ge=0)
+    location_diversity_score: Optional[float] = Field(default=None, ge=0, le=100)
+    close: bool = False
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "date": "2026-02-21",
+                "steps": 340,
+                "active_minutes": 4,
+                "sedentary_minutes": 0,
+                "screen_time_minutes": 12,
+                "location_diversity_score": 40.0,
+                "close": False
+            }
+        }
+    }
+
+
+class MetricsDeltaResponse(BaseModel):
+    date: DateField
+    steps: int = 0
+    sleep_duration_minutes: Optional[int] = None
+    sedentary_minutes: int = 0
+    location_diversity_score: Optional[float] = None
+    active_minutes: int = 0
+    screen_time_minutes: Optional[int] = None
+    closed: bool = False
+    pipeline_ran: bool = False
+    deviation_flags: Optional[Dict[str, bool]] = None
+    risk_score: Optional[float] = None
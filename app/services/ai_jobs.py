@@ -0,0 +1,352 @@
+"""
+Asynchronous AI job queue.
+
+While the queue runs, `ingest_metrics` only stores the day and enqueues a
+job; baseline collection, deviation flags, risk score and the insight are
+computed in the background and the client polls ``GET /ai/jobs/{job_id}``.
+
+- every job is a document in ``ai_jobs`` (queued -> running -> done/failed),
+  so nothing is lost if the process dies or the in-memory queue is full
+- jobs are handed to AI_JOB_WORKERS workers through an in-process queue;
+  jobs of one user run one after another in enqueue order, different users
+  run in parallel
+- a job is claimed atomically before it runs, so with several uvicorn
+  workers each job runs once; a sweeper picks up queued jobs nobody holds
+  in memory and re-queues running jobs whose lease expired
+- a worker also holds a per-user lease in ``ai_job_leases`` (``_id`` =
+  user_id) while it runs that user's jobs, so jobs of one user stay
+  sequential across processes; a heartbeat renews both leases every third
+  of AI_JOB_LEASE_SECONDS, so only dead workers lose their jobs to a sweep
+- the steps that write (counting the day, the insight) are recorded under
+  ``steps`` on the job as they finish; a retried job skips them
+- finished jobs are removed by a TTL index after AI_JOB_RETENTION_HOURS
+
+The queue is off until `start` is called; `ingest_metrics` then runs the
+AI steps inline as before.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.config.settings import settings
+from app.db.indexes import ensure_indexes
+from app.services.ai_pipeline import PipelineContext
+from app.services.daily_metrics_service import get_daily_metrics
+from app.services.health_profile_service import increment_baseline_days
+
+logger = logging.getLogger(__name__)
+
+JOB_COLLECTION = "ai_jobs"
+LEASE_COLLECTION = "ai_job_leases"
+
+
+async def ensure_job_indexes(db) -> None:
+    await ensure_indexes(db, collections=[JOB_COLLECTION, LEASE_COLLECTION])
+
+
+def _finished(now: datetime) -> Dict[str, Any]:
+    return {
+        "updated_at": now,
+        "finished_at": now,
+        "expires_at": now + timedelta(hours=settings.AI_JOB_RETENTION_HOURS),
+    }
+
+
+async def _record_step(db, job: Dict[str, Any], step: str, value: Any) -> None:
+    await db[JOB_COLLECTION].update_one({"_id": job["_id"]}, {"$set": {f"steps.{step}": value}})
+    job.setdefault("steps", {})[step] = value
+
+
+async def run_ai_job(db, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the AI steps for the job's day. Returns the job fields to store.
+
+    The same steps as `PipelineContext.process`, except that each write is
+    recorded on the job: a retry after a crash or an expired lease does not
+    count the day towards collection twice or insert a second insight.
+    """
+    user_id = job["user_id"]
+    day = job["date"].date()
+    steps = job.get("steps") or {}
+    ctx = await PipelineContext.load(db, user_id, day)
+    daily_doc = await get_daily_metrics(db, user_id, day)
+    if not ctx or not daily_doc:
+        return {"status": "failed", "error": "metrics or health profile not found"}
+    if "counted" not in steps and ctx.profile.get("baseline_status") == "collecting":
+        new_profile = await increment_baseline_days(db, user_id, profile=ctx.profile)
+        if new_profile and new_profile.get("baseline_status") == "active":
+            ctx.profile = new_profile
+            logger.info(f"Baseline activated for user {user_id} by ai job {job['_id']}")
+        await _record_step(db, job, "counted", True)
+    fields: Dict[str, Any] = {"status": "done"}
+    committed = steps.get("committed")
+    if committed is None and ctx.is_active:
+        result = await ctx.score(daily_doc)
+        insight = await ctx.commit(daily_doc, result)
+        committed = {
+            "deviation_flags": result["deviation_flags"],
+            "risk_score": result["risk_score"],
+            "insight_id": insight.get("_id"),
+        }
+        await _record_step(db, job, "committed", committed)
+    if committed is not None:
+        fields.update(committed)
+    fields["baseline_status"] = ctx.profile.get("baseline_status")
+    return fields
+
+
+class AIJobQueue:
+    def __init__(self, workers: int, max_pending: int, lease_seconds: int, sweep_seconds: float):
+        self.workers = workers
+        self.max_pending = max(1, max_pending)
+        self.lease_seconds = lease_seconds
+        self.sweep_seconds = sweep_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # per-user FIFO of job ids; a user is in `_ready` at most once
+        self._user_jobs: Dict[str, Deque[ObjectId]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._pending = 0
+        # user_id -> id of the job a worker is running for that user
+        self._running: Dict[str, ObjectId] = {}
+        self._db = None
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"enqueued": 0, "done": 0, "failed": 0, "retried": 0, "overflow": 0}
+
+    @property
+    def active(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, db) -> None:
+        if self._tasks or self.workers <= 0:
+            return
+        self._db = db
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def stop(self) -> None:
+        """Stop the workers; unfinished jobs stay queued in Mongo."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._user_jobs.clear()
+        self._running.clear()
+        self._pending = 0
+
+    async def enqueue(self, db, user_id: str, day: date) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        job = {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "date": datetime(day.year, day.month, day.day),
+            "status": "queued",
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        await db[JOB_COLLECTION].insert_one(job)
+        self.stats["enqueued"] += 1
+        if not self._submit(user_id, job["_id"]):
+            # in-memory queue full: the sweeper picks the job up from Mongo
+            self.stats["overflow"] += 1
+        return job
+
+    def _submit(self, user_id: str, job_id: ObjectId, retry: bool = False) -> bool:
+        """Queue a job behind the user's other jobs.
+
+        A `retry` goes to the head of the user's queue (even when the queue is
+        full), so an earlier day never runs after a later one.
+        """
+        if self._ready is None or (self._pending >= self.max_pending and not retry):
+            return False
+        jobs = self._user_jobs.get(user_id)
+        if jobs is None:
+            self._user_jobs[user_id] = deque([job_id])
+            self._ready.put_nowait(user_id)
+        elif job_id in jobs:
+            return True
+        elif retry:
+            jobs.appendleft(job_id)
+        else:
+            jobs.append(job_id)
+        self._pending += 1
+        return True
+
+    async def _claim_user(self, user_id: str) -> bool:
+        """Take (or renew) the lease on `user_id`'s jobs."""
+        now = datetime.utcnow()
+        try:
+            await self._db[LEASE_COLLECTION].update_one(
+                {"_id": user_id, "$or": [{"expires_at": {"$lte": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # a worker of another process is running this user's jobs
+            return False
+        return True
+
+    async def _heartbeat(self, user_id: str) -> None:
+        """Renew the user lease and the running job's lease while the worker runs."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if not await self._claim_user(user_id):
+                    logger.error(f"ai jobs: lost the lease on {user_id}")
+                job_id = self._running.get(user_id)
+                if job_id is not None:
+                    now = datetime.utcnow()
+                    await self._db[JOB_COLLECTION].update_one(
+                        {"_id": job_id, "status": "running", "owner": self.owner},
+                        {"$set": {"lease_until": now + timedelta(seconds=self.lease_seconds), "updated_at": now}},
+                    )
+            except Exception as exc:
+                logger.error(f"ai jobs: heartbeat for {user_id} failed: {exc}")
+
+    async def _worker(self) -> None:
+        while True:
+            user_id = await self._ready.get()
+            jobs = self._user_jobs[user_id]
+            while jobs:
+                if not await self._claim_user(user_id):
+                    # the jobs stay queued in Mongo; a later sweep submits them again
+                    self._pending -= len(jobs)
+                    jobs.clear()
+                    break
+                heartbeat = asyncio.create_task(self._heartbeat(user_id))
+                try:
+                    while jobs:
+                        job_id = jobs.popleft()
+                        self._pending -= 1
+                        self._running[user_id] = job_id
+                        try:
+                            await self._run(job_id)
+                        except Exception as exc:
+                            logger.error(f"ai job {job_id} crashed: {exc}")
+                finally:
+                    self._running.pop(user_id, None)
+                    heartbeat.cancel()
+                    await self._db[LEASE_COLLECTION].delete_one({"_id": user_id, "owner": self.owner})
+                # jobs submitted while the lease was released run under a new lease
+            # nothing was awaited since the loop saw the deque empty
+            del self._user_jobs[user_id]
+
+    async def _run(self, job_id: ObjectId) -> None:
+        db = self._db
+        now = datetime.utcnow()
+        job = await db[JOB_COLLECTION].find_one_and_update(
+            {"_id": job_id, "status": "queued"},
+            {
+                "$set": {
+                    "status": "running",
+                    "owner": self.owner,
+                    "lease_until": now + timedelta(seconds=self.lease_seconds),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            return  # taken by another worker
+        try:
+            fields = await run_ai_job(db, job)
+        except Exception as exc:
+            logger.error(f"ai job {job_id} for {job['user_id']} failed: {exc}", exc_info=True)
+            now = datetime.utcnow()
+            if job["attempts"] < settings.AI_JOB_MAX_ATTEMPTS:
+                self.stats["retried"] += 1
+                await db[JOB_COLLECTION].update_one(
+                    {"_id": job_id, "owner": self.owner},
+                    {"$set": {"status": "queued", "error": str(exc), "updated_at": now}},
+                )
+                self._submit(job["user_id"], job_id, retry=True)
+                return
+            fields = {"status": "failed", "error": str(exc)}
+        self.stats[fields["status"]] += 1
+        await db[JOB_COLLECTION].update_one(
+            {"_id": job_id, "owner": self.owner},
+            {"$set": {**fields, **_finished(datetime.utcnow())}},
+        )
+
+    async def _sweeper(self) -> None:
+        try:
+            await ensure_job_indexes(self._db)
+        except Exception as exc:
+            logger.error(f"ai jobs: could not create indexes: {exc}")
+        while True:
+            try:
+                await self.sweep()
+            except Exception as exc:
+                logger.error(f"ai jobs: sweep failed: {exc}")
+            await asyncio.sleep(self.sweep_seconds)
+
+    async def sweep(self) -> int:
+        """Re-queue expired leases and submit orphaned queued jobs.
+
+        Live workers keep renewing their job's lease, so only jobs of dead
+        (or stalled for a whole lease) workers are re-queued.
+        """
+        jobs = self._db[JOB_COLLECTION]
+        now = datetime.utcnow()
+        await jobs.update_many(
+            {"status": "running", "lease_until": {"$lt": now}},
+            {"$set": {"status": "queued", "updated_at": now}},
+        )
+        free = self.max_pending - self._pending
+        if free <= 0:
+            return 0
+        # recent jobs are still owned by the worker that enqueued them
+        cursor = jobs.find(
+            {"status": "queued", "updated_at": {"$lt": now - timedelta(seconds=self.sweep_seconds)}},
+            {"user_id": 1},
+        ).sort("created_at", 1).limit(free)
+        submitted = 0
+        for job in await cursor.to_list(length=None):
+            submitted += self._submit(job["user_id"], job["_id"])
+        return submitted
+
+
+async def get_job(db, user_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+    """A job of `user_id` with its insight (when done), or None."""
+    if not ObjectId.is_valid(job_id):
+        return None
+    job = await db[JOB_COLLECTION].find_one({"_id": ObjectId(job_id), "user_id": user_id})
+    if not job:
+        return None
+    insight = None
+    if job.get("insight_id") is not None:
+        insight = await db.ai_insights.find_one({"_id": job["insight_id"]})
+        if insight:
+            insight["_id"] = str(insight["_id"])
+    return {
+        "job_id": str(job["_id"]),
+        "status": job["status"],
+        "date": job["date"].date(),
+        "attempts": job.get("attempts", 0),
+        "baseline_status": job.get("baseline_status"),
+        "deviation_flags": job.get("deviation_flags"),
+        "risk_score": job.get("risk_score"),
+        "insight": insight,
+        "error": job.get("error"),
+        "created_at": job["created_at"],
+        "finished_at": job.get("finished_at"),
+    }
+
+
+# singleton instance started from the app's startup hook
+ai_job_queue = AIJobQueue(
+    settings.AI_JOB_WORKERS,
+    settings.AI_JOB_MAX_PENDING,
+    settings.AI_JOB_LEASE_SECONDS,
+    settings.AI_JOB_SWEEP_SECONDS,
+)
@@ -0,0 +1,151 @@
+"""
+Fused AI pipeline for metric ingestion.
+
+`PipelineContext` loads everything the AI steps need (health profile and the
+trailing daily_metrics window) once, runs deviation detection, risk scoring
+and insight building as one in-memory pass using the pure functions in
+`ai_service`, then writes all results in a single concurrent batch.
+
+This replaces the ~15 sequential Mongo round trips the step-by-step async
+functions make per metric post.
+"""
+import asyncio
+import logging
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+from app.services.ai_service import (
+    CONSECUTIVE_DAYS_FOR_TREND,
+    build_insight,
+    evaluate_daily_deviations,
+    score_risk,
+)
+from app.services.dashboard_cache import dashboard_cache
+from app.services.dashboard_service import snapshot_insight
+from app.services.health_profile_service import increment_baseline_days
+from app.services.metrics_repository import metrics_repository
+from app.services.scoring_executor import scoring_executor
+from app.services.window_cache import window_cache
+from app.services.write_buffer import metrics_write_buffer
+
+logger = logging.getLogger(__name__)
+
+
+def score_day(
+    user_id: str,
+    profile: Dict[str, Any],
+    daily_doc: Dict[str, Any],
+    recent_docs: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Compute deviation flags, risk score and the insight document.
+
+    Pure and picklable so it can run in the scoring process pool.
+    """
+    deviation_flags = evaluate_daily_deviations(profile, daily_doc, recent_docs)
+    risk_score = 0.0
+    if profile.get("baseline_status") == "active":
+        risk_score = score_risk(profile.get("baseline_metrics", {}), deviation_flags, daily_doc)
+    return {
+        "deviation_flags": deviation_flags,
+        "risk_score": risk_score,
+        "insight": build_insight(user_id, deviation_flags, risk_score),
+    }
+
+
+class PipelineContext:
+    """Per-ingest state shared by every AI step."""
+
+    def __init__(
+        self,
+        db,
+        user_id: str,
+        profile: Dict[str, Any],
+        recent_docs: Optional[List[Dict[str, Any]]] = None,
+    ):
+        self.db = db
+        self.user_id = user_id
+        self.profile = profile
+        # days before the ingested one, most recent first
+        self.recent_docs = recent_docs or []
+
+    @classmethod
+    async def load(cls, db, user_id: str, day: date) -> Optional["PipelineContext"]:
+        """Fetch the profile and trailing window concurrently.
+
+        The window comes from the per-user window cache; only days older
+        than the cached window (backfills) are queried directly.
+        Returns None when the user has no health profile.
+        """
+        day_dt = datetime(day.year, day.month, day.day)
+        profile, window = await asyncio.gather(
+            db.health_profiles.find_one({"user_id": user_id}),
+            window_cache.get(db, user_id),
+        )
+        if not profile:
+            return None
+        recent_docs = window.before(day_dt, CONSECUTIVE_DAYS_FOR_TREND)
+        if recent_docs is None:
+            recent_docs = await metrics_repository.find_days(
+                db, user_id, date={"$lt": day_dt}, sort=-1, limit=CONSECUTIVE_DAYS_FOR_TREND,
+            )
+        return cls(db, user_id, profile, recent_docs)
+
+    @property
+    def is_active(self) -> bool:
+        return self.profile.get("baseline_status") == "active"
+
+    def run(self, daily_doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Score the day inline. Pure: no database access."""
+        return score_day(self.user_id, self.profile, daily_doc, self.recent_docs)
+
+    async def score(self, daily_doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Score the day in the scoring process pool."""
+        return await scoring_executor.run(score_day, self.user_id, self.profile, daily_doc, self.recent_docs)
+
+    async def commit(self, daily_doc: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+        """Persist a `run` result: daily flags, new insight and profile risk."""
+        now = datetime.utcnow()
+        insight = result["insight"]
+        daily_update = {
+            "deviation_flags": result["deviation_flags"],
+            "risk_score": result["risk_score"],
+            "updated_at": now,
+        }
+        writes = [
+            self.db.ai_insights.insert_one(insight),
+            self.db.health_profiles.update_one(
+                {"user_id": self.user_id},
+                {"$set": {"risk_score": result["risk_score"], "updated_at": now}},
+            ),
+            snapshot_insight(self.db, self.user_id, insight),
+        ]
+        # a buffered day takes the flags with its next flush
+        if not metrics_write_buffer.update(daily_doc["_id"], daily_update):
+            writes.append(metrics_repository.update_day(
+                self.db, self.user_id, daily_doc["date"], {"$set": daily_update},
+            ))
+        inserted, *_ = await asyncio.gather(*writes)
+        # the snapshot write ran alongside the insert: drop responses cached meanwhile
+        dashboard_cache.invalidate(self.user_id)
+        insight["_id"] = inserted.inserted_id
+        self.profile["risk_score"] = result["risk_score"]
+        return insight
+
+    async def process(self, daily_doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Every AI step after a day was stored.
+
+        Counts the day towards baseline collection (activating the baseline
+        on the 14th day), then scores and commits it once the baseline is
+        active. Returns the score result, or None while collecting.
+        """
+        if self.profile.get("baseline_status") == "collecting":
+            new_profile = await increment_baseline_days(self.db, self.user_id, profile=self.profile)
+            # check if activation happened on this insert
+            if new_profile and new_profile.get("baseline_status") == "active":
+                self.profile = new_profile
+                logger.info(f"Baseline activated for user {self.user_id} on metric insert")
+        if not self.is_active:
+            return None
+        result = await self.score(daily_doc)
+        result["insight"] = await self.commit(daily_doc, result)
+        return result
@@ -11,8 +11,12 @@ from typing import Any, Dict, List, Optional
 import logging
 from datetime import datetime, timedelta, date
 from bson import ObjectId
-import statistics
 import logging
+from app.services.baseline_service import SIGNAL_FIELDS, resolve_baseline, running_stats
+from app.services.dashboard_service import snapshot_insight
+from app.services.metrics_repository import metrics_repository
+from app.services.window_cache import window_cache
+from app.services.write_buffer import metrics_write_buffer
 
 logger = logging.getLogger(__name__)
 
@@ -35,14 +39,23 @@ CONSECUTIVE_DAYS_FOR_TREND = 3
 # STEP 4: Baseline Activation Logic
 # ==================================================
 
-async def activate_baseline_if_ready(db, user_id: str) -> bool:
+async def activate_baseline_if_ready(
+    db,
+    user_id: str,
+    profile: Optional[Dict[str, Any]] = None
+) -> bool:
     """
     Check if user has 14+ days of data collected.
-    If yes, calculate baseline metrics and activate AI engine.
+    If yes, activate the AI engine on the running baseline.
+    
+    Baseline mean/std are maintained incrementally on every daily metrics
+    upsert (see baseline_service), so activation only has to verify enough
+    samples were folded in; no history scan is needed.
     
     Returns True if baseline was activated, False otherwise.
     """
-    profile = await db.health_profiles.find_one({"user_id": user_id})
+    if profile is None:
+        profile = await db.health_profiles.find_one({"user_id": user_id})
     if not profile:
         return False
     
@@ -54,61 +67,20 @@ async def activate_baseline_if_ready(db, user_id: str) -> bool:
     if days_collected < 14:
         return False
     
-    # Fetch last 14-21 days of metrics (use datetimes for MongoDB queries)
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=20)
-    
-    cursor = db.daily_metrics.find({
-        "user_id": user_id,
-        "date": {"$gte": start_date, "$lte": end_date}
-    }).sort("date", 1)
-    
-    metrics_docs = await cursor.to_list(length=None)
-    if len(metrics_docs) < 14:
+    baseline_metrics = profile.get("baseline_metrics") or {}
+    sample_days = max(
+        (running_stats(baseline_metrics.get(key))["count"] for key in SIGNAL_FIELDS),
+        default=0,
+    )
+    if sample_days < 14:
         # Not enough data yet
         return False
     
-    # Extract enabled signals from profile
-    enabled_signals = profile.get("enabled_signals", {})
-    
-    # Calculate baseline metrics (mean and std)
-    baseline_metrics = {}
-    
-    signal_mapping = {
-        "steps": "steps",
-        "sleep": "sleep_duration_minutes",
-        "sedentary": "sedentary_minutes",
-        "location": "location_diversity_score",
-        "active_minutes": "active_minutes",
-    }
-    
-    for signal_key, field_name in signal_mapping.items():
-        if not enabled_signals.get(signal_key, True):
-            # Signal disabled, skip
-            continue
-        
-        values = []
-        for doc in metrics_docs:
-            val = doc.get(field_name)
-            if val is not None and isinstance(val, (int, float)):
-                values.append(float(val))
-        
-        if len(values) > 0:
-            mean = statistics.mean(values)
-            std = statistics.pstdev(values) if len(values) > 1 else 0.0
-            baseline_metrics[signal_key] = {
-                "mean": round(mean, 2),
-                "std": round(std, 2),
-            }
-        else:
-            baseline_metrics[signal_key] = {"mean": 0.0, "std": 0.0}
-    
-    # Update profile: set baseline metrics and activate
+    # Update profile: activate (baseline metrics are already current)
     await db.health_profiles.update_one(
         {"user_id": user_id},
         {
             "$set": {
-                "baseline_metrics": baseline_metrics,
                 "baseline_status": "active",
                 "updated_at": datetime.utcnow(),
             }
@@ -123,41 +95,20 @@ async def activate_baseline_if_ready(db, user_id: str) -> bool:
 # STEP 5: Deviation Detection Engine
 # ==================================================
 
-async def detect_deviations(
-    db,
-    user_id: str,
+def evaluate_deviation(
+    signal_baseline: Optional[Dict[str, Any]],
     current_value: float,
-    signal_key: str,
-    recent_values: Optional[List[float]] = None
+    recent_values: Optional[List[float]] = None,
+    recent_baselines: Optional[List[Optional[Dict[str, Any]]]] = None
 ) -> Dict[str, Any]:
     """
-    Detect if a signal deviates from baseline using z-score and percent change.
-    
-    Args:
-        db: MongoDB database
-        user_id: User ID
-        current_value: Latest value for the signal
-        signal_key: Signal name (e.g., "steps", "sleep")
-        recent_values: Last N values for trend analysis (optional)
-    
-    Returns:
-        Deviation info: {
-            "is_deviated": bool,
-            "z_score": float,
-            "pct_change": float,
-            "reason": str
-        }
+    Pure deviation check of one value against a signal baseline.
+
+    Shared by `detect_deviations` and the in-memory pipeline so both produce
+    identical results. Returns the same shape as `detect_deviations`.
+    `recent_baselines` (aligned with `recent_values`) lets each trend day be
+    scored against its own weekday baseline; default is `signal_baseline`.
     """
-    profile = await db.health_profiles.find_one({"user_id": user_id})
-    if not profile:
-        return {"is_deviated": False, "z_score": 0.0, "pct_change": 0.0, "reason": "no_profile"}
-    
-    if profile.get("baseline_status") != "active":
-        return {"is_deviated": False, "z_score": 0.0, "pct_change": 0.0, "reason": "baseline_not_active"}
-    
-    baseline_metrics = profile.get("baseline_metrics", {})
-    signal_baseline = baseline_metrics.get(signal_key)
-    
     if not signal_baseline:
         return {"is_deviated": False, "z_score": 0.0, "pct_change": 0.0, "reason": "no_baseline"}
     
@@ -189,10 +140,15 @@ async def detect_deviations(
     # Trend analysis: check consecutive days (if provided)
     if recent_values and len(recent_values) >= CONSECUTIVE_DAYS_FOR_TREND:
         # Check if last 3 days all deviate in same direction
+        if recent_baselines is None:
+            recent_baselines = [signal_baseline] * len(recent_values)
         recent_z_scores = []
-        for val in recent_values[-CONSECUTIVE_DAYS_FOR_TREND:]:
-            if std > 0:
-                z = (val - mean) / std
+        for val, base in zip(recent_values[-CONSECUTIVE_DAYS_FOR_TREND:],
+                             recent_baselines[-CONSECUTIVE_DAYS_FOR_TREND:]):
+            day_mean = base.get("mean", 0.0) if base else 0.0
+            day_std = base.get("std", 0.0) if base else 0.0
+            if day_std > 0:
+                z = (val - day_mean) / day_std
             else:
                 z = 0.0
             recent_z_scores.append(z)
@@ -211,6 +167,88 @@ async def detect_deviations(
     }
 
 
+def _signal_value(doc: Dict[str, Any], field_name: str) -> float:
+    value = doc.get(field_name, 0)
+    return 0 if value is None else value
+
+
+def evaluate_daily_deviations(
+    profile: Dict[str, Any],
+    daily_doc: Dict[str, Any],
+    recent_docs: List[Dict[str, Any]]
+) -> Dict[str, bool]:
+    """
+    Pure version of `compute_daily_deviations`.
+
+    `recent_docs` are the days before `daily_doc`, most recent first (the
+    order the "last N days" query returns them in). Every day is compared
+    with the baseline of its own weekday (see `resolve_baseline`).
+    """
+    if not profile or profile.get("baseline_status") != "active":
+        return {}
+    
+    enabled_signals = profile.get("enabled_signals", {})
+    baseline_metrics = profile.get("baseline_metrics", {})
+    recent_docs = recent_docs[:CONSECUTIVE_DAYS_FOR_TREND]
+    
+    deviation_flags = {}
+    for signal_key, field_name in SIGNAL_FIELDS.items():
+        if not enabled_signals.get(signal_key, True):
+            continue
+        
+        entry = baseline_metrics.get(signal_key)
+        current_value = _signal_value(daily_doc, field_name)
+        recent_values = [_signal_value(doc, field_name) for doc in recent_docs]
+        recent_baselines = [resolve_baseline(entry, doc.get("date")) for doc in recent_docs]
+        deviation_info = evaluate_deviation(
+            resolve_baseline(entry, daily_doc.get("date")),
+            current_value,
+            recent_values,
+            recent_baselines,
+        )
+        deviation_flags[signal_key] = deviation_info["is_deviated"]
+    
+    return deviation_flags
+
+
+async def detect_deviations(
+    db,
+    user_id: str,
+    current_value: float,
+    signal_key: str,
+    recent_values: Optional[List[float]] = None,
+    day: Optional[date] = None
+) -> Dict[str, Any]:
+    """
+    Detect if a signal deviates from baseline using z-score and percent change.
+    
+    Args:
+        db: MongoDB database
+        user_id: User ID
+        current_value: Latest value for the signal
+        signal_key: Signal name (e.g., "steps", "sleep")
+        recent_values: Last N values for trend analysis (optional)
+        day: Date of `current_value`; selects the weekday baseline (optional)
+    
+    Returns:
+        Deviation info: {
+            "is_deviated": bool,
+            "z_score": float,
+            "pct_change": float,
+            "reason": str
+        }
+    """
+    profile = await db.health_profiles.find_one({"user_id": user_id})
+    if not profile:
+        return {"is_deviated": False, "z_score": 0.0, "pct_change": 0.0, "reason": "no_profile"}
+    
+    if profile.get("baseline_status") != "active":
+        return {"is_deviated": False, "z_score": 0.0, "pct_change": 0.0, "reason": "baseline_not_active"}
+    
+    baseline_metrics = profile.get("baseline_metrics", {})
+    return evaluate_deviation(resolve_baseline(baseline_metrics.get(signal_key), day), current_value, recent_values)
+
+
 async def compute_daily_deviations(
     db,
     user_id: str,
@@ -223,7 +261,9 @@ async def compute_daily_deviations(
     Returns:
         Dictionary of {signal_key: is_deviated}
     """
-    daily_doc = await db.daily_metrics.find_one({"_id": daily_doc_id})
+    daily_doc = metrics_write_buffer.get_by_id(daily_doc_id)
+    if daily_doc is None:
+        daily_doc = await metrics_repository.find_by_id(db, user_id, daily_doc_id)
     if not daily_doc:
         return {}
     
@@ -231,49 +271,20 @@ async def compute_daily_deviations(
     if not profile or profile.get("baseline_status") != "active":
         return {}
     
-    enabled_signals = profile.get("enabled_signals", {})
+    # one cached window serves the trend check of every signal
+    window = await window_cache.get(db, user_id)
+    recent_docs = window.before(daily_doc.get("date"), CONSECUTIVE_DAYS_FOR_TREND)
+    if recent_docs is None:
+        recent_docs = await metrics_repository.find_days(
+            db, user_id, date={"$lt": daily_doc.get("date")}, sort=-1, limit=CONSECUTIVE_DAYS_FOR_TREND,
+        )
     
-    deviation_flags = {}
-    
-    signal_mapping = {
-        "steps": "steps",
-        "sleep": "sleep_duration_minutes",
-        "sedentary": "sedentary_minutes",
-        "location": "location_diversity_score",
-        "active_minutes": "active_minutes",
-    }
-    
-    for signal_key, field_name in signal_mapping.items():
-        if not enabled_signals.get(signal_key, True):
-            continue
-        
-        current_value = daily_doc.get(field_name, 0)
-        if current_value is None:
-            current_value = 0
-        
-        # Optionally fetch recent values for trend analysis
-        recent_values = None
-        if field_name:
-            cursor = db.daily_metrics.find({
-                "user_id": user_id,
-                "date": {"$lt": daily_doc.get("date")}
-            }).sort("date", -1).limit(CONSECUTIVE_DAYS_FOR_TREND)
-            recent_docs = await cursor.to_list(length=None)
-            recent_values = [doc.get(field_name, 0) for doc in recent_docs]
-        
-        deviation_info = await detect_deviations(db, user_id, current_value, signal_key, recent_values)
-        deviation_flags[signal_key] = deviation_info["is_deviated"]
+    deviation_flags = evaluate_daily_deviations(profile, daily_doc, recent_docs)
     
     # Store deviation flags in daily metrics
-    await db.daily_metrics.update_one(
-        {"_id": daily_doc_id},
-        {
-            "$set": {
-                "deviation_flags": deviation_flags,
-                "updated_at": datetime.utcnow(),
-            }
-        }
-    )
+    update = {"deviation_flags": deviation_flags, "updated_at": datetime.utcnow()}
+    if not metrics_write_buffer.update(daily_doc_id, update):
+        await metrics_repository.update_day(db, user_id, daily_doc["date"], {"$set": update})
     
     return deviation_flags
 
@@ -282,53 +293,28 @@ async def compute_daily_deviations(
 # STEP 6: Risk Score Calculation
 # ==================================================
 
-async def calculate_risk_score(
-    db,
-    user_id: str,
+def score_risk(
+    baseline_metrics: Dict[str, Any],
     deviation_flags: Dict[str, bool],
     daily_doc: Dict[str, Any]
 ) -> float:
     """
-    Calculate risk score using weighted signal deviation.
-    
-    Weights:
-    - sleep: 0.35
-    - steps: 0.25
-    - sedentary: 0.20
-    - location: 0.10
-    - active_minutes: 0.10
-    
-    Returns:
-        Risk score (0-100)
+    Pure weighted risk score (0-100) for one day's deviations.
+
+    Each deviated signal contributes weight * min(3, |z|); the sum is scaled
+    by 30 and capped at 100. z uses the baseline of the doc's weekday.
     """
-    profile = await db.health_profiles.find_one({"user_id": user_id})
-    if not profile or profile.get("baseline_status") != "active":
-        return 0.0
-    
-    baseline_metrics = profile.get("baseline_metrics", {})
-    
     total_weighted_score = 0.0
     
-    signal_mapping = {
-        "steps": "steps",
-        "sleep": "sleep_duration_minutes",
-        "sedentary": "sedentary_minutes",
-        "location": "location_diversity_score",
-        "active_minutes": "active_minutes",
-    }
-    
-    for signal_key, field_name in signal_mapping.items():
+    for signal_key, field_name in SIGNAL_FIELDS.items():
         if not deviation_flags.get(signal_key, False):
             # No deviation, no contribution to risk
             continue
         
         weight = SIGNAL_WEIGHTS.get(field_name, 0.0)
+        current_value = _signal_value(daily_doc, field_name)
         
-        current_value = daily_doc.get(field_name, 0)
-        if current_value is None:
-            current_value = 0
-        
-        signal_baseline = baseline_metrics.get(signal_key)
+        signal_baseline = resolve_baseline(baseline_metrics.get(signal_key), daily_doc.get("date"))
         if not signal_baseline:
             continue
         
@@ -352,31 +338,44 @@ async def calculate_risk_score(
     return round(risk_score, 1)
 
 
+async def calculate_risk_score(
+    db,
+    user_id: str,
+    deviation_flags: Dict[str, bool],
+    daily_doc: Dict[str, Any]
+) -> float:
+    """
+    Calculate risk score using weighted signal deviation.
+    
+    Weights:
+    - sleep: 0.35
+    - steps: 0.25
+    - sedentary: 0.20
+    - location: 0.10
+    - active_minutes: 0.10
+    
+    Returns:
+        Risk score (0-100)
+    """
+    profile = await db.health_profiles.find_one({"user_id": user_id})
+    if not profile or profile.get("baseline_status") != "active":
+        return 0.0
+    
+    return score_risk(profile.get("baseline_metrics", {}), deviation_flags, daily_doc)
+
+
 # ==================================================
 # STEP 7: Insight Generator
 # ==================================================
 
-async def generate_insights(
-    db,
+def build_insight(
     user_id: str,
     deviation_flags: Dict[str, bool],
     risk_score: float,
 ) -> Dict[str, Any]:
     """
-    Generate AI insights based on deviations and risk score.
-    
-    Creates document in ai_insights collection with:
-    - risk_score
-    - summary_message
-    - recommended_actions
-    - created_at
+    Build (but do not store) the ai_insights document for a day's result.
     """
-    profile = await db.health_profiles.find_one({"user_id": user_id})
-    if not profile:
-        logging.warning(f"generate_insights: no profile for {user_id}")
-        return {}
-    logging.info(f"generate_insights: called for {user_id} with risk_score={risk_score} and flags={deviation_flags}")
-    
     # Determine risk level
     if risk_score < 30:
         risk_level = "Low"
@@ -450,19 +449,43 @@ async def generate_insights(
             "priority": "low"
         })
     
-    # Create insight document
-    insight_doc = {
+    now = datetime.utcnow()
+    return {
         "user_id": user_id,
         # store full datetime for insight date
-        "date": datetime.utcnow(),
+        "date": now,
         "risk_score": risk_score,
         "risk_level": risk_level,
         "summary_message": summary_message,
         "recommended_actions": recommended_actions,
         "deviation_flags": deviation_flags,
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow(),
+        "created_at": now,
+        "updated_at": now,
     }
+
+
+async def generate_insights(
+    db,
+    user_id: str,
+    deviation_flags: Dict[str, bool],
+    risk_score: float,
+) -> Dict[str, Any]:
+    """
+    Generate AI insights based on deviations and risk score.
+    
+    Creates document in ai_insights collection with:
+    - risk_score
+    - summary_message
+    - recommended_actions
+    - created_at
+    """
+    profile = await db.health_profiles.find_one({"user_id": user_id})
+    if not profile:
+        logging.warning(f"generate_insights: no profile for {user_id}")
+        return {}
+    logging.info(f"generate_insights: called for {user_id} with risk_score={risk_score} and flags={deviation_flags}")
+    
+    insight_doc = build_insight(user_id, deviation_flags, risk_score)
     
     # Store in ai_insights collection
     result = await db.ai_insights.insert_one(insight_doc)
@@ -473,6 +496,7 @@ async def generate_insights(
         {"user_id": user_id},
         {"$set": {"risk_score": risk_score, "updated_at": datetime.utcnow()}}
     )
+    await snapshot_insight(db, user_id, insight_doc)
     
     return insight_doc
 
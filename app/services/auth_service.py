@@ -11,6 +11,20 @@ from app.config import settings as cfg
 from app.services.health_profile_service import create_health_profile, get_health_profile
 from app.services import simulation_service
 
+# Refresh tokens and device OTPs carry `expires_at`, and TTL indexes on it
+# (app.db.indexes) delete them once they lapse. Revoked tokens and used OTPs
+# have their expiry pulled in so they go as well;
+# `python -m app.jobs.compact_auth_tokens` handles documents from before
+# expiry was enforced.
+
+
+def refresh_token_expiry(now: datetime) -> datetime:
+    return now + timedelta(days=cfg.settings.REFRESH_TOKEN_EXPIRE_DAYS)
+
+
+def revoked_token_expiry(now: datetime) -> datetime:
+    return now + timedelta(hours=cfg.settings.REVOKED_TOKEN_RETENTION_HOURS)
+
 
 async def signup_user(db, email: str, password: str, name: str) -> Dict[str, Any]:
     existing = await db.users.find_one({"email": email})
@@ -36,9 +50,8 @@ async def signup_user(db, email: str, password: str, name: str) -> Dict[str, Any
     
     access = create_access_token({"sub": user_id})
     refresh = generate_refresh_token()
-    hashed_refresh = hash_token(refresh)
     # store hashed refresh token with device=None for now
-    await db.refresh_tokens.insert_one({"user_id": user_id, "token_hash": hashed_refresh, "created_at": datetime.utcnow(), "revoked": False, "device_id": None})
+    await store_refresh_token(db, user_id, refresh)
     return {"access_token": access, "refresh_token": refresh}
 
 
@@ -50,7 +63,7 @@ async def authenticate_user(db, email: str, password: str) -> Optional[Dict[str,
     user_id = user.get("user_id") or str(user.get("_id"))
     access = create_access_token({"sub": user_id})
     refresh = generate_refresh_token()
-    await db.refresh_tokens.insert_one({"user_id": user_id, "token_hash": hash_token(refresh), "created_at": datetime.utcnow(), "revoked": False, "device_id": None})
+    await store_refresh_token(db, user_id, refresh)
     # ensure simulation running for existing user (demo mode or any)
     try:
         import asyncio
@@ -61,16 +74,34 @@ async def authenticate_user(db, email: str, password: str) -> Optional[Dict[str,
     return {"access_token": access, "refresh_token": refresh, "user_id": user_id}
 
 
-async def store_refresh_token(db, user_id: str, refresh: str, device_id: Optional[str] = None, expires_days: int = 30):
-    token_hash = hash_token(refresh)
-    expires = datetime.utcnow() + timedelta(days=expires_days)
-    await db.refresh_tokens.insert_one({"user_id": user_id, "token_hash": token_hash, "device_id": device_id, "expires_at": expires, "revoked": False, "created_at": datetime.utcnow()})
+async def store_refresh_token(db, user_id: str, refresh: str, device_id: Optional[str] = None, expires_days: Optional[int] = None):
+    """Store (or attach a device to) a hashed refresh token with its expiry.
+
+    Signup and login store the token before the controller knows the device,
+    so this upserts on the hash instead of inserting a second document.
+    """
+    now = datetime.utcnow()
+    expires = now + timedelta(days=expires_days) if expires_days is not None else refresh_token_expiry(now)
+    fields = {"expires_at": expires}
+    on_insert = {"user_id": user_id, "revoked": False, "created_at": now}
+    if device_id is not None:
+        fields["device_id"] = device_id
+    else:
+        on_insert["device_id"] = None
+    await db.refresh_tokens.update_one(
+        {"token_hash": hash_token(refresh)},
+        {"$set": fields, "$setOnInsert": on_insert},
+        upsert=True,
+    )
 
 
 async def rotate_refresh_token(db, old_refresh: str, user_id: str, device_id: str) -> str:
     old_hash = hash_token(old_refresh)
     # revoke old
-    await db.refresh_tokens.update_many({"token_hash": old_hash}, {"$set": {"revoked": True}})
+    await db.refresh_tokens.update_many(
+        {"token_hash": old_hash},
+        {"$set": {"revoked": True}, "$min": {"expires_at": revoked_token_expiry(datetime.utcnow())}},
+    )
     # create new
     new_refresh = generate_refresh_token()
     await store_refresh_token(db, user_id, new_refresh, device_id)
@@ -78,17 +109,20 @@ async def rotate_refresh_token(db, old_refresh: str, user_id: str, device_id: st
 
 
 async def revoke_refresh_token(db, refresh: str):
-    await db.refresh_tokens.update_many({"token_hash": hash_token(refresh)}, {"$set": {"revoked": True}})
+    await db.refresh_tokens.update_many(
+        {"token_hash": hash_token(refresh)},
+        {"$set": {"revoked": True}, "$min": {"expires_at": revoked_token_expiry(datetime.utcnow())}},
+    )
 
 
-async def generate_device_otp(db, user_id: str, device_id: str, ttl_minutes: int = 15) -> str:
+async def generate_device_otp(db, user_id: str, device_id: str, ttl_minutes: Optional[int] = None) -> str:
     """Generate a numeric OTP, store its hash with expiry, and return the raw OTP (for testing).
 
     In production this should be emailed to the user and the raw OTP should not be returned.
     """
     otp = f"{secrets.randbelow(1000000):06d}"
     otp_hash = hash_token(otp)
-    expires = datetime.utcnow() + timedelta(minutes=ttl_minutes)
+    expires = datetime.utcnow() + timedelta(minutes=ttl_minutes or cfg.settings.DEVICE_OTP_TTL_MINUTES)
     await db.device_otps.insert_one({"user_id": user_id, "device_id": device_id, "otp_hash": otp_hash, "expires_at": expires, "used": False})
     return otp
 
@@ -98,8 +132,8 @@ async def mark_device_trusted(db, user_id: str, device_id: str, otp: str) -> boo
     doc = await db.device_otps.find_one({"user_id": user_id, "device_id": device_id, "otp_hash": otp_hash, "used": False, "expires_at": {"$gte": datetime.utcnow()}})
     if not doc:
         return False
-    # mark used
-    await db.device_otps.update_one({"_id": doc["_id"]}, {"$set": {"used": True}})
+    # mark used; a used OTP is deleted by the TTL index right away
+    await db.device_otps.update_one({"_id": doc["_id"]}, {"$set": {"used": True, "expires_at": datetime.utcnow()}})
     # mark device trusted
     await db.devices.update_one({"user_id": user_id, "fingerprint": device_id}, {"$set": {"trusted": True, "trusted_at": datetime.utcnow()}}, upsert=True)
     # issue a refresh token for device
@@ -0,0 +1,197 @@
+"""
+Baseline refresh scheduler.
+
+Streaming baselines (see `baseline_service`) accumulate every day since
+activation. Every AI_REFRESH_INTERVAL_HOURS each active user's baseline is
+rebuilt from the trailing MAX_HISTORY_DAYS of daily_metrics so old habits
+age out.
+
+- every profile carries ``baseline_refresh_due_at`` (indexed together with
+  ``baseline_status``); due times are jittered per user so refreshes spread
+  over the interval instead of landing in one burst
+- each tick picks up to BASELINE_REFRESH_BATCH_SIZE due users and refreshes
+  them with at most BASELINE_REFRESH_CONCURRENCY in flight
+- a lease document in ``baseline_refresh_leases`` (``_id`` = user_id) makes
+  sure only one uvicorn worker refreshes a given user; leases expire on
+  their own if a worker dies
+- the rebuilt baseline is only written if the profile was not updated while
+  it was being computed, so a concurrent ingest is never overwritten
+- the profile records ``baseline_window_start``; later corrections of days
+  before it add the new value without swapping out one the rebuild dropped
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from app.config.settings import settings
+from app.db.indexes import ensure_indexes
+from app.services.baseline_service import rebuild_baseline
+from app.services.metrics_repository import metrics_repository
+
+logger = logging.getLogger(__name__)
+
+LEASE_COLLECTION = "baseline_refresh_leases"
+
+
+def next_due_at(now: datetime, rng: random.Random = random) -> datetime:
+    """Next refresh time: one interval from now plus per-user jitter."""
+    interval = timedelta(hours=settings.AI_REFRESH_INTERVAL_HOURS)
+    return now + interval + interval * rng.uniform(0, settings.BASELINE_REFRESH_JITTER)
+
+
+async def ensure_refresh_indexes(db) -> None:
+    await ensure_indexes(db, collections=["health_profiles", LEASE_COLLECTION])
+
+
+async def acquire_lease(db, user_id: str, owner: str, now: Optional[datetime] = None) -> bool:
+    """Take (or renew) the refresh lease for `user_id`."""
+    now = now or datetime.utcnow()
+    try:
+        await db[LEASE_COLLECTION].update_one(
+            {"_id": user_id, "$or": [{"expires_at": {"$lte": now}}, {"owner": owner}]},
+            {"$set": {
+                "owner": owner,
+                "expires_at": now + timedelta(seconds=settings.BASELINE_REFRESH_LEASE_SECONDS),
+            }},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # another worker holds a live lease
+        return False
+    return True
+
+
+async def release_lease(db, user_id: str, owner: str) -> None:
+    await db[LEASE_COLLECTION].delete_one({"_id": user_id, "owner": owner})
+
+
+async def find_due_profiles(db, now: datetime, limit: int) -> List[Dict[str, Any]]:
+    """Active profiles whose refresh is due (or was never scheduled)."""
+    cursor = db.health_profiles.find(
+        {
+            "baseline_status": "active",
+            "$or": [
+                {"baseline_refresh_due_at": {"$lte": now}},
+                {"baseline_refresh_due_at": None},
+            ],
+        },
+        {"user_id": 1},
+    ).sort("baseline_refresh_due_at", 1).limit(limit)
+    return await cursor.to_list(length=None)
+
+
+async def refresh_user_baseline(db, user_id: str, now: Optional[datetime] = None) -> bool:
+    """Rebuild one user's baseline from the trailing MAX_HISTORY_DAYS.
+
+    Returns False when the profile changed underneath (it stays due and is
+    retried on a later tick).
+    """
+    now = now or datetime.utcnow()
+    # read the profile first: its updated_at guards the write below
+    profile = await db.health_profiles.find_one(
+        {"user_id": user_id},
+        {"baseline_status": 1, "updated_at": 1},
+    )
+    if not profile or profile.get("baseline_status") != "active":
+        return False
+
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    since = today - timedelta(days=settings.MAX_HISTORY_DAYS - 1)
+    docs = await metrics_repository.find_days(db, user_id, date={"$gte": since})
+    if not docs:
+        # nothing recent to learn from: keep the old baseline, check again later
+        await db.health_profiles.update_one(
+            {"user_id": user_id},
+            {"$set": {"baseline_refresh_due_at": next_due_at(now)}},
+        )
+        return True
+
+    result = await db.health_profiles.update_one(
+        {"user_id": user_id, "updated_at": profile.get("updated_at")},
+        {"$set": {
+            "baseline_metrics": rebuild_baseline(docs),
+            # corrections of older days must not swap them out again
+            "baseline_window_start": since,
+            "baseline_refreshed_at": now,
+            "baseline_refresh_due_at": next_due_at(now),
+            "updated_at": now,
+        }},
+    )
+    return result.matched_count == 1
+
+
+async def run_refresh_cycle(
+    db,
+    owner: str,
+    concurrency: int = settings.BASELINE_REFRESH_CONCURRENCY,
+    limit: int = settings.BASELINE_REFRESH_BATCH_SIZE,
+) -> int:
+    """Refresh every due user in one batch. Returns the number refreshed."""
+    now = datetime.utcnow()
+    due = await find_due_profiles(db, now, limit)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def refresh(user_id: str) -> bool:
+        async with semaphore:
+            if not await acquire_lease(db, user_id, owner):
+                return False
+            try:
+                return await refresh_user_baseline(db, user_id)
+            except Exception as exc:
+                logger.error(f"baseline refresh failed for {user_id}: {exc}")
+                return False
+            finally:
+                await release_lease(db, user_id, owner)
+
+    results = await asyncio.gather(*(refresh(p["user_id"]) for p in due))
+    refreshed = sum(results)
+    if due:
+        logger.info(f"baseline refresh: {refreshed}/{len(due)} due users refreshed")
+    return refreshed
+
+
+class BaselineRefreshScheduler:
+    """Runs `run_refresh_cycle` every BASELINE_REFRESH_TICK_SECONDS."""
+
+    def __init__(self, tick_seconds: int):
+        self.tick_seconds = tick_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, db) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(db))
+
+    async def _loop(self, db) -> None:
+        try:
+            await ensure_refresh_indexes(db)
+        except Exception as exc:
+            logger.error(f"baseline refresh: could not create indexes: {exc}")
+        # stagger the first tick so workers started together do not collide
+        await asyncio.sleep(random.uniform(0, self.tick_seconds))
+        while True:
+            try:
+                await run_refresh_cycle(db, self.owner)
+            except Exception as exc:
+                logger.error(f"baseline refresh cycle failed: {exc}")
+            await asyncio.sleep(self.tick_seconds)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# singleton instance started from the app's startup hook
+baseline_refresh_scheduler = BaselineRefreshScheduler(settings.BASELINE_REFRESH_TICK_SECONDS)
@@ -0,0 +1,350 @@
+"""
+Streaming Baseline Service for Prevention AI.
+
+Maintains per-signal running statistics (count / mean / M2, Welford's
+algorithm) in ``health_profiles.baseline_metrics`` so the baseline is
+updated in O(1) on every daily metrics upsert instead of being recomputed
+from a range query.
+
+Stored shape per signal:
+    {"count": 17, "mean": 8123.4, "m2": 2.1e7, "std": 1111.6,
+     "weekday": [[3, 9120.0, 4.1e6], ...]}   # 7 x [count, mean, m2], Monday first
+
+``mean`` and ``std`` keep the meaning the deviation engine already relies on
+(population standard deviation), ``count`` and ``m2`` are the running state.
+``weekday`` holds the same running state per day of week so weekend routines
+are compared with other weekends; `resolve_baseline` falls back to the
+global entry while a bucket has fewer than WEEKDAY_MIN_SAMPLES samples.
+
+Days built from intraday deltas are folded in when their pipeline runs,
+not on every increment (see `folded_sample`).
+
+``robust`` holds the last MAX_HISTORY_DAYS samples (see `robust_baseline`).
+With ``AI_MODEL_TYPE="robust"`` days are compared against their median /
+MAD instead of the running mean / std.
+
+Each entry only carries the state its scoring mode reads: ``robust`` in
+robust mode, ``weekday`` otherwise. After switching modes the new state
+fills up as days arrive (or at once with the baseline refresh job), and
+scoring uses the global entry until then.
+"""
+import logging
+import math
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import settings
+from app.services.robust_baseline import SlidingWindow, stored_baseline
+
+logger = logging.getLogger(__name__)
+
+# compare-and-set attempts after the first, when concurrent writes keep winning
+BASELINE_UPDATE_RETRIES = 5
+BASELINE_PROJECTION = {"baseline_metrics": 1, "baseline_days_collected": 1, "baseline_window_start": 1}
+
+# signal key (as used in baseline_metrics / deviation_flags) -> daily_metrics field
+SIGNAL_FIELDS = {
+    "steps": "steps",
+    "sleep": "sleep_duration_minutes",
+    "sedentary": "sedentary_minutes",
+    "location": "location_diversity_score",
+    "active_minutes": "active_minutes",
+}
+
+# bookkeeping fields of days built from intraday deltas (see intraday_service)
+INTRADAY_FIELDS = ("intraday", "baseline_sample", "pipeline_at", "closed")
+
+# samples a weekday bucket needs before it replaces the global baseline
+WEEKDAY_MIN_SAMPLES = 3
+
+# AI_MODEL_TYPE value that switches scoring to median / MAD baselines
+ROBUST_MODEL_TYPE = "robust"
+
+
+def _numeric(value: Any) -> Optional[float]:
+    """Return value as float if it is a usable sample, else None."""
+    if value is None or isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def folded_sample(doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The values of a stored daily document that the running baseline holds.
+
+    Regular days are folded on every upsert. Intraday days are only folded
+    when their pipeline runs, as ``baseline_sample`` (None before that).
+    """
+    if not doc:
+        return None
+    if doc.get("intraday"):
+        return doc.get("baseline_sample")
+    return doc
+
+
+def held_sample(profile: Optional[Dict[str, Any]], doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """`folded_sample` of `doc`, or None when the baseline no longer holds it.
+
+    A baseline refresh rebuilds the stats from the days since
+    ``baseline_window_start``; older days are not in them any more, so a
+    correction of such a day must not swap their values out.
+    """
+    sample = folded_sample(doc)
+    start = (profile or {}).get("baseline_window_start")
+    if sample is not None and start is not None:
+        day = _as_datetime(sample.get("date"))
+        if day is not None and day < start:
+            return None
+    return sample
+
+
+def welford_add(stats: Dict[str, Any], value: float) -> Dict[str, Any]:
+    """Return new running stats with `value` added."""
+    count = stats.get("count", 0) + 1
+    mean = stats.get("mean", 0.0) if count > 1 else 0.0
+    m2 = stats.get("m2", 0.0) if count > 1 else 0.0
+    delta = value - mean
+    mean += delta / count
+    m2 += delta * (value - mean)
+    return _with_std({"count": count, "mean": mean, "m2": m2})
+
+
+def welford_remove(stats: Dict[str, Any], value: float) -> Dict[str, Any]:
+    """Return new running stats with a previously added `value` removed."""
+    count = stats.get("count", 0)
+    if count <= 1:
+        return _with_std({"count": 0, "mean": 0.0, "m2": 0.0})
+    mean = stats.get("mean", 0.0)
+    new_count = count - 1
+    new_mean = (count * mean - value) / new_count
+    m2 = stats.get("m2", 0.0) - (value - mean) * (value - new_mean)
+    return _with_std({"count": new_count, "mean": new_mean, "m2": max(0.0, m2)})
+
+
+def _with_std(stats: Dict[str, Any]) -> Dict[str, Any]:
+    count = stats["count"]
+    stats["std"] = math.sqrt(stats["m2"] / count) if count > 1 else 0.0
+    return stats
+
+
+def _weekday(day: Any) -> Optional[int]:
+    return day.weekday() if isinstance(day, date) else None
+
+
+def _as_datetime(day: Any) -> Optional[datetime]:
+    if isinstance(day, datetime):
+        return day
+    if isinstance(day, date):
+        return datetime(day.year, day.month, day.day)
+    return None
+
+
+def _weekday_buckets(entry: Optional[Dict[str, Any]]) -> List[List[float]]:
+    buckets = entry.get("weekday") if isinstance(entry, dict) else None
+    if not buckets or len(buckets) != 7:
+        return [[0, 0.0, 0.0] for _ in range(7)]
+    return [list(bucket) for bucket in buckets]
+
+
+def weekday_baseline(entry: Optional[Dict[str, Any]], weekday: int) -> Optional[Dict[str, float]]:
+    """Baseline of one weekday bucket, or None while it is too sparse."""
+    buckets = entry.get("weekday") if isinstance(entry, dict) else None
+    if not buckets:
+        return None
+    count, mean, m2 = buckets[weekday]
+    if count < WEEKDAY_MIN_SAMPLES:
+        return None
+    return {"mean": mean, "std": math.sqrt(m2 / count)}
+
+
+def robust_mode(mode: Optional[str] = None) -> bool:
+    return (mode or settings.AI_MODEL_TYPE) == ROBUST_MODEL_TYPE
+
+
+def robust_baseline(entry: Optional[Dict[str, Any]]) -> Optional[Dict[str, float]]:
+    """Median / scaled MAD of the stored window, or None while it is too small."""
+    return stored_baseline(entry)
+
+
+def resolve_baseline(
+    entry: Optional[Dict[str, Any]],
+    day: Any = None,
+    mode: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """Baseline to compare a value from `day` against.
+
+    In robust mode the window's median / MAD. Otherwise the matching weekday
+    bucket once it is dense enough. Falls back to the global entry (which is
+    also returned when `day` is unknown).
+    """
+    if entry and robust_mode(mode):
+        robust = robust_baseline(entry)
+        return robust if robust is not None else entry
+    weekday = _weekday(day)
+    if entry and weekday is not None:
+        bucket = weekday_baseline(entry, weekday)
+        if bucket is not None:
+            return bucket
+    return entry
+
+
+def running_stats(entry: Optional[Dict[str, Any]], fallback_count: int = 0) -> Dict[str, Any]:
+    """Normalize a stored baseline entry into running stats.
+
+    Profiles activated before streaming baselines only stored rounded
+    mean/std; those are seeded as if `fallback_count` samples produced them
+    so the baseline keeps its shape instead of restarting from one day.
+    """
+    if not isinstance(entry, dict):
+        return {"count": 0, "mean": 0.0, "m2": 0.0, "std": 0.0}
+    if "count" in entry:
+        return {
+            "count": int(entry.get("count", 0)),
+            "mean": float(entry.get("mean", 0.0)),
+            "m2": float(entry.get("m2", 0.0)),
+            "std": float(entry.get("std", 0.0)),
+        }
+    count = fallback_count if entry.get("mean") is not None else 0
+    std = float(entry.get("std") or 0.0)
+    return {
+        "count": count,
+        "mean": float(entry.get("mean") or 0.0),
+        "m2": std * std * count,
+        "std": std,
+    }
+
+
+def apply_metrics_change(
+    baseline_metrics: Dict[str, Any],
+    previous: Optional[Dict[str, Any]],
+    current: Dict[str, Any],
+    fallback_count: int = 0,
+    mode: Optional[str] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Fold one daily upsert into the running baseline.
+
+    `previous` is the stored daily document before the upsert (None for a new
+    day). Corrections remove the old sample and add the new one, in the
+    global stats and in the robust window (robust mode) or the day's weekday
+    bucket (otherwise). Returns only the signal entries that changed.
+    """
+    changed: Dict[str, Dict[str, Any]] = {}
+    day = _as_datetime(current.get("date"))
+    weekday = _weekday(day)
+    robust = robust_mode(mode)
+    for signal_key, field_name in SIGNAL_FIELDS.items():
+        old_val = _numeric(previous.get(field_name)) if previous else None
+        new_val = _numeric(current.get(field_name))
+        if old_val == new_val:
+            continue
+        entry = baseline_metrics.get(signal_key)
+        stats = running_stats(entry, fallback_count)
+        if old_val is not None:
+            stats = welford_remove(stats, old_val)
+        if new_val is not None:
+            stats = welford_add(stats, new_val)
+        if robust:
+            window = SlidingWindow.from_entry(entry, settings.MAX_HISTORY_DAYS)
+            if day is not None:
+                if new_val is None:
+                    window.remove(day)
+                else:
+                    window.add(day, new_val)
+            stats["robust"] = window.to_state()
+        else:
+            buckets = _weekday_buckets(entry)
+            if weekday is not None:
+                count, mean, m2 = buckets[weekday]
+                bucket = {"count": count, "mean": mean, "m2": m2}
+                if old_val is not None:
+                    bucket = welford_remove(bucket, old_val)
+                if new_val is not None:
+                    bucket = welford_add(bucket, new_val)
+                buckets[weekday] = [bucket["count"], bucket["mean"], bucket["m2"]]
+            stats["weekday"] = buckets
+        changed[signal_key] = stats
+    return changed
+
+
+def rebuild_baseline(docs: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Baseline computed from scratch over `docs` (daily documents, any order).
+
+    Folds what each day contributes to the running baseline (`folded_sample`),
+    so open intraday days keep the sample their next pipeline run swaps out.
+    """
+    baseline_metrics: Dict[str, Dict[str, Any]] = {}
+    for doc in sorted(docs, key=lambda d: d["date"]):
+        sample = folded_sample(doc)
+        if sample is not None:
+            baseline_metrics.update(apply_metrics_change(baseline_metrics, None, sample))
+    return baseline_metrics
+
+
+def _unchanged_filter(user_id: str, baseline_metrics: Dict[str, Any], keys) -> Dict[str, Any]:
+    """Match the profile only while the `keys` entries still hold the values read."""
+    query: Dict[str, Any] = {"user_id": user_id}
+    for key in keys:
+        entry = baseline_metrics.get(key)
+        path = f"baseline_metrics.{key}"
+        if entry is None:
+            query[path] = None
+        else:
+            query[f"{path}.count"] = entry.get("count")
+            query[f"{path}.mean"] = entry.get("mean")
+    return query
+
+
+async def update_running_baseline(
+    db,
+    user_id: str,
+    previous: Optional[Dict[str, Any]],
+    current: Dict[str, Any],
+    profile: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Apply a daily metrics upsert to ``health_profiles.baseline_metrics``.
+
+    Only the touched signal entries are written (``$set`` on dotted paths).
+    The write is a compare-and-set on each entry's previous count and mean:
+    if another request folded a day in since the profile was read, the
+    entries are read again and the change is reapplied on top, up to
+    BASELINE_UPDATE_RETRIES times. `profile` is updated in place.
+    A `previous` day older than the last refresh window is not swapped out
+    (see `held_sample`).
+    """
+    if profile is None:
+        profile = await db.health_profiles.find_one({"user_id": user_id}, BASELINE_PROJECTION)
+    if not profile:
+        return {}
+    if previous is not None and held_sample(profile, previous) is None:
+        previous = None
+
+    for _ in range(BASELINE_UPDATE_RETRIES + 1):
+        if profile.get("baseline_metrics") is None:
+            profile["baseline_metrics"] = {}
+        baseline_metrics = profile["baseline_metrics"]
+        changed = apply_metrics_change(
+            baseline_metrics,
+            previous,
+            current,
+            fallback_count=profile.get("baseline_days_collected", 0),
+        )
+        if not changed:
+            return {}
+
+        update = {f"baseline_metrics.{key}": stats for key, stats in changed.items()}
+        update["updated_at"] = datetime.utcnow()
+        result = await db.health_profiles.update_one(
+            _unchanged_filter(user_id, baseline_metrics, changed),
+            {"$set": update},
+        )
+        if result.matched_count:
+            baseline_metrics.update(changed)
+            return changed
+
+        fresh = await db.health_profiles.find_one({"user_id": user_id}, BASELINE_PROJECTION)
+        if not fresh:
+            return {}
+        profile["baseline_metrics"] = fresh.get("baseline_metrics") or {}
+        profile["baseline_days_collected"] = fresh.get("baseline_days_collected", 0)
+
+    logger.error(f"baseline update for {user_id} lost {BASELINE_UPDATE_RETRIES + 1} races; sample not folded in")
+    return {}
@@ -6,6 +6,12 @@ This is the data source for baseline learning.
 """
 from datetime import datetime, date
 from typing import Optional, Dict, Any, List
+from bson import ObjectId
+from app.services.baseline_service import INTRADAY_FIELDS, folded_sample, update_running_baseline
+from app.services.dashboard_service import snapshot_metrics
+from app.services.metrics_repository import metrics_repository
+from app.services.window_cache import window_cache
+from app.services.write_buffer import metrics_write_buffer
 
 
 async def store_daily_metrics(
@@ -18,11 +24,17 @@ async def store_daily_metrics(
     location_diversity_score: float,
     active_minutes: int,
     screen_time_minutes: int | None = None,
+    profile: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     """
     Store daily metrics for a user.
     
     If a record for this user+date already exists, upsert (update) it.
+    The user's running baseline in health_profiles is updated from the
+    previous/new values (corrections replace the old sample), and the
+    cached trailing window and the dashboard snapshot are updated. While the write buffer
+    runs, the upsert is queued and coalesced with later posts of the day;
+    the baseline, window and snapshot then follow when the day is flushed.
     
     Args:
         db: Motor AsyncIOMotorDatabase
@@ -33,6 +45,7 @@ async def store_daily_metrics(
         sedentary_minutes: Sedentary time in minutes
         location_diversity_score: Location diversity (0-100)
         active_minutes: Active/exercise minutes
+        profile: Already loaded health profile (saves a lookup)
     
     Returns:
         Stored metrics document
@@ -55,13 +68,38 @@ async def store_daily_metrics(
         "updated_at": now,
     }
     
-    # Upsert: if record exists for this user+date, update it; else create
-    result = await db.daily_metrics.find_one_and_update(
-        {"user_id": user_id, "date": date_dt},
-        {"$set": metrics},
-        upsert=True,
-        return_document=True
-    )
+    new_id = ObjectId()
+    if metrics_write_buffer.active:
+        previous = metrics_write_buffer.get(user_id, date_dt)
+        if previous is None:
+            previous = await metrics_repository.find_day(db, user_id, date_dt)
+            # another post of the day may have been buffered meanwhile
+            previous = metrics_write_buffer.get(user_id, date_dt) or previous
+    else:
+        # Upsert: if record exists for this user+date, update it; else create.
+        # Fetch the previous version so the running baseline can swap values.
+        # a full upsert replaces any intraday (delta) state of the day
+        previous = await metrics_repository.find_and_update_day(
+            db,
+            user_id,
+            date_dt,
+            {
+                "$set": metrics,
+                "$setOnInsert": {"_id": new_id},
+                "$unset": {field: "" for field in INTRADAY_FIELDS},
+            },
+            upsert=True,
+        )
+    result = {k: v for k, v in {**(previous or {}), **metrics}.items() if k not in INTRADAY_FIELDS}
+    result["_id"] = previous["_id"] if previous else new_id
+    if metrics_write_buffer.active:
+        # the flush folds the day in from what it actually replaced
+        metrics_write_buffer.put(result, metrics)
+        return result
+
+    await update_running_baseline(db, user_id, folded_sample(previous), result, profile=profile)
+    window_cache.apply(user_id, result)
+    await snapshot_metrics(db, user_id)
     
     return result
 
@@ -73,14 +111,18 @@ async def get_daily_metrics(
 ) -> Optional[Dict[str, Any]]:
     """Retrieve a user's metrics for a specific date."""
     date_dt = datetime(date_.year, date_.month, date_.day)
-    return await db.daily_metrics.find_one({"user_id": user_id, "date": date_dt})
+    buffered = metrics_write_buffer.get(user_id, date_dt)
+    if buffered is not None:
+        return buffered
+    return await metrics_repository.find_day(db, user_id, date_dt)
 
 
 async def get_user_metrics_range(
     db,
     user_id: str,
     start_date: date,
-    end_date: date
+    end_date: date,
+    fields: Optional[List[str]] = None,
 ) -> List[Dict[str, Any]]:
     """
     Retrieve a user's metrics for a date range.
@@ -90,6 +132,8 @@ async def get_user_metrics_range(
         user_id: User ID
         start_date: Start date (inclusive)
         end_date: End date (inclusive)
+        fields: Only these metric fields (plus date); with time-series
+            storage only these columns are decompressed
     
     Returns:
         List of metrics documents, sorted by date ascending
@@ -98,12 +142,14 @@ async def get_user_metrics_range(
     start_dt = datetime(start_date.year, start_date.month, start_date.day)
     end_dt = datetime(end_date.year, end_date.month, end_date.day)
 
-    cursor = db.daily_metrics.find({
-        "user_id": user_id,
-        "date": {"$gte": start_dt, "$lte": end_dt}
-    }).sort("date", 1)
-    
-    return await cursor.to_list(length=None)
+    projection = None
+    if fields:
+        projection = {field: 1 for field in fields}
+        projection.update({"date": 1, "user_id": 1})
+    docs = await metrics_repository.find_days(
+        db, user_id, date={"$gte": start_dt, "$lte": end_dt}, projection=projection,
+    )
+    return metrics_write_buffer.overlay(user_id, docs, start_dt, end_dt)
 
 
 async def get_user_recent_metrics(
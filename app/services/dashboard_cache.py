@@ -0,0 +1,118 @@
+"""
+In-process response cache for `get_dashboard_data`.
+
+The frontend asks for `/dashboard`, `/dashboard/report` and `/dashboard/risk`
+within milliseconds of each other, and all three render the same data.
+`DashboardCache` keeps each user's dashboard in an LRU keyed by user_id:
+
+- entries expire after DASHBOARD_CACHE_TTL_SECONDS, which bounds how stale a
+  response can be when another worker wrote the data
+- concurrent misses for one user share one load (single flight); a caller
+  that is cancelled does not cancel the load for the others
+- the dashboard write hooks in `dashboard_service` (metrics ingest, new
+  insights, profile changes, replays) call `invalidate` once their write is
+  done; a load in flight at that moment is not cached
+- the cache holds at most DASHBOARD_CACHE_MAX_USERS entries and about
+  DASHBOARD_CACHE_MAX_BYTES of serialized responses, evicting the least
+  recently used first
+- `stats` counts hits, misses, coalesced misses, invalidations and evictions
+
+Cached responses are shared between callers and must not be modified.
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from app.config.settings import settings
+
+Loader = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+def _size(value: Dict[str, Any]) -> int:
+    return len(json.dumps(value, default=str))
+
+
+class DashboardCache:
+    def __init__(self, ttl_seconds: float, max_users: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        # user_id -> (stored at, size, response)
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "invalidations": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_users > 0 and self.max_bytes > 0
+
+    async def get(self, user_id: str, load: Loader) -> Dict[str, Any]:
+        """The cached dashboard of `user_id`, calling `load` on a miss."""
+        if not self.enabled:
+            return await load()
+        entry = self._entries.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+            self._entries.move_to_end(user_id)
+            self.stats["hits"] += 1
+            return entry[2]
+        task = self._inflight.get(user_id)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._load(user_id, load))
+            self._inflight[user_id] = task
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def _load(self, user_id: str, load: Loader) -> Dict[str, Any]:
+        me = asyncio.current_task()
+        try:
+            value = await load()
+        finally:
+            current = self._inflight.get(user_id) is me
+            if current:
+                del self._inflight[user_id]
+        # invalidated while loading: the value may predate the write
+        if current:
+            self._store(user_id, value)
+        return value
+
+    def _drop(self, user_id: str) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def _store(self, user_id: str, value: Dict[str, Any]) -> None:
+        size = _size(value)
+        self._drop(user_id)
+        if size > self.max_bytes:
+            return
+        self._entries[user_id] = (time.monotonic(), size, value)
+        self.bytes += size
+        while len(self._entries) > self.max_users or self.bytes > self.max_bytes:
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.stats["evictions"] += 1
+
+    def invalidate(self, user_id: str) -> None:
+        """Forget `user_id`'s dashboard; call after the write has landed."""
+        self.stats["invalidations"] += 1
+        self._inflight.pop(user_id, None)
+        self._drop(user_id)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._inflight.clear()
+        self.bytes = 0
+        self.stats = dict.fromkeys(self.stats, 0)
+
+
+# singleton instance used by services
+dashboard_cache = DashboardCache(
+    settings.DASHBOARD_CACHE_TTL_SECONDS,
+    settings.DASHBOARD_CACHE_MAX_USERS,
+    settings.DASHBOARD_CACHE_MAX_BYTES,
+)
@@ -1,72 +1,222 @@
+"""
+Dashboard data, served from a materialized per-user snapshot.
+
+`/dashboard`, `/dashboard/report`, `/dashboard/risk` and the simulation's
+WebSocket push all read one ``dashboard_snapshots`` document per user, keyed
+by user_id, so a dashboard read is a single ``_id`` lookup. Writers keep the
+snapshot current section by section:
+
+- metrics (``latest``, ``activity``): `store_daily_metrics` and
+  `apply_metrics_delta`, from the trailing window they have just updated
+- insight and risk: `generate_insights` and `PipelineContext.commit`
+- goals and name: health profile creation/updates and user profile updates
+- replays and imports rewrite many days at once and drop the snapshot
+
+A missing snapshot, or one missing a section (e.g. only a hook has written
+so far), is built from the source collections on read. The build only fills
+the missing sections, so it never overwrites a fresher write.
+
+Responses are also kept briefly in the in-process `dashboard_cache`; every
+hook below invalidates the user's entry once its write is done.
+
+Snapshots are used once `dashboard_snapshots` is started (from `main`, with
+DASHBOARD_SNAPSHOTS_ENABLED); until then the hooks do nothing and every read
+builds the dashboard from the source collections. After running with
+snapshots disabled, drop ``dashboard_snapshots`` before enabling them again.
+"""
+import asyncio
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from app.services.dashboard_cache import dashboard_cache
+from app.services.metrics_repository import metrics_repository
+from app.services.window_cache import window_cache
 
-async def get_dashboard_data(db, user_id: str) -> Dict[str, Any]:
-    """Aggregate latest data for dashboard polling.
+SECTIONS = ("user_name", "latest", "activity", "goals", "risk_score", "insight")
+LATEST_FIELDS = ("steps", "sleep_duration_minutes", "screen_time_minutes")
+ACTIVITY_DAYS = 7
 
-    Returns a dict with keys described in architecture spec:
-    - userName
-    - steps
-    - sleep
-    - screenTime
-    - activityBars
-    - goals
-    - insight
-    """
-    # fetch user info
-    user = await db.users.find_one({"user_id": user_id})
+# fields the dashboard renders from each collection
+USER_PROJECTION = {"_id": 0, "name": 1}
+INSIGHT_PROJECTION = {"_id": 0, "summary_message": 1, "recommended_actions": 1, "risk_score": 1}
+PROFILE_PROJECTION = {"_id": 0, "goals": 1, "risk_score": 1}
+RECENT_PROJECTION = {"date": 1, "active_minutes": 1}
 
-    # latest daily metrics
-    latest_metrics = await db.daily_metrics.find_one(
-        {"user_id": user_id}, sort=[("date", -1)]
+
+class DashboardSnapshots:
+    def __init__(self):
+        self.active = False
+        self.stats = {"reads": 0, "builds": 0, "writes": 0}
+
+    def start(self) -> None:
+        self.active = True
+
+    def stop(self) -> None:
+        self.active = False
+
+
+dashboard_snapshots = DashboardSnapshots()
+
+
+def _activity_start(now: datetime) -> datetime:
+    return now - timedelta(days=ACTIVITY_DAYS - 1)
+
+
+async def _metrics_sections(db, user_id: str) -> Dict[str, Any]:
+    """Latest day and recent activity, from the cached trailing window."""
+    window = await window_cache.get(db, user_id)
+    start = _activity_start(datetime.utcnow())
+    recent = window.since(start)
+    if recent is None:
+        recent = await metrics_repository.find_days(
+            db, user_id, date={"$gte": start}, projection=RECENT_PROJECTION
+        )
+    latest = window.latest()
+    return {
+        "latest": {f: latest[f] for f in LATEST_FIELDS if latest.get(f) is not None} if latest else None,
+        "activity": [{"date": m["date"], "active_minutes": m.get("active_minutes", 0)} for m in recent],
+    }
+
+
+def insight_sections(insight: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The snapshot's insight section for an ai_insights document."""
+    if not insight:
+        return {"insight": None}
+    return {
+        "insight": {
+            "summary": insight.get("summary_message"),
+            "actions": insight.get("recommended_actions", []),
+            "risk_score": insight.get("risk_score"),
+        }
+    }
+
+
+async def build_snapshot(db, user_id: str) -> Dict[str, Any]:
+    """Every section, read from the source collections."""
+    # the four reads are independent: issue them together and fetch only the
+    # fields the dashboard renders
+    user, metrics, latest_insight, profile = await asyncio.gather(
+        db.users.find_one({"user_id": user_id}, USER_PROJECTION),
+        _metrics_sections(db, user_id),
+        db.ai_insights.find_one({"user_id": user_id}, INSIGHT_PROJECTION, sort=[("date", -1)]),
+        db.health_profiles.find_one({"user_id": user_id}, PROFILE_PROJECTION),
     )
-    # last 7 days metrics for trend/sparkline
-    end = datetime.utcnow()
-    start = end - timedelta(days=6)
-    cursor = db.daily_metrics.find({"user_id": user_id, "date": {"$gte": start}}).sort("date", 1)
-    recent_metrics = await cursor.to_list(length=None)
-
-    # latest insight
-    latest_insight = await db.ai_insights.find_one(
-        {"user_id": user_id}, sort=[("date", -1)]
+    return {
+        "user_name": user.get("name") if user else None,
+        **metrics,
+        "goals": (profile.get("goals") or {}) if profile else {},
+        "risk_score": profile.get("risk_score", 0) if profile else 0,
+        **insight_sections(latest_insight),
+    }
+
+
+async def _set_sections(db, user_id: str, sections: Dict[str, Any]) -> None:
+    dashboard_snapshots.stats["writes"] += 1
+    await db.dashboard_snapshots.update_one(
+        {"_id": user_id},
+        {"$set": {**sections, "updated_at": datetime.utcnow()}},
+        upsert=True,
     )
 
-    profile = await db.health_profiles.find_one({"user_id": user_id})
 
-    # build response
+async def get_snapshot(db, user_id: str) -> Dict[str, Any]:
+    """The user's snapshot; missing sections are built and stored first."""
+    dashboard_snapshots.stats["reads"] += 1
+    snapshot = await db.dashboard_snapshots.find_one({"_id": user_id})
+    missing = [s for s in SECTIONS if snapshot is None or s not in snapshot]
+    if missing:
+        dashboard_snapshots.stats["builds"] += 1
+        built = await build_snapshot(db, user_id)
+        fill = {s: built[s] for s in missing}
+        # a section written by a hook meanwhile is newer than this build: keep it
+        await db.dashboard_snapshots.update_one(
+            {"_id": user_id},
+            [{"$set": {s: {"$ifNull": [f"${s}", {"$literal": v}]} for s, v in fill.items()}}],
+            upsert=True,
+        )
+        snapshot = {**fill, **(snapshot or {})}
+    return snapshot
+
+
+async def snapshot_metrics(db, user_id: str) -> None:
+    """Refresh the metrics sections after a day was written."""
+    if dashboard_snapshots.active:
+        await _set_sections(db, user_id, await _metrics_sections(db, user_id))
+    dashboard_cache.invalidate(user_id)
+
+
+async def snapshot_insight(db, user_id: str, insight: Dict[str, Any]) -> None:
+    """Store a newly generated insight; its risk score is the profile's too."""
+    if dashboard_snapshots.active:
+        await _set_sections(db, user_id, {**insight_sections(insight), "risk_score": insight.get("risk_score", 0)})
+    dashboard_cache.invalidate(user_id)
+
+
+async def snapshot_profile(db, user_id: str, fields: Dict[str, Any]) -> None:
+    """Copy changed profile/user fields (goals, risk_score, name) into the snapshot."""
+    sections: Dict[str, Any] = {}
+    if "goals" in fields:
+        sections["goals"] = fields["goals"] or {}
+    if "risk_score" in fields:
+        sections["risk_score"] = fields["risk_score"]
+    if "name" in fields:
+        sections["user_name"] = fields["name"]
+    if not sections:
+        return
+    if dashboard_snapshots.active:
+        await _set_sections(db, user_id, sections)
+    dashboard_cache.invalidate(user_id)
+
+
+async def invalidate_snapshot(db, user_id: str) -> None:
+    """Drop the snapshot after bulk rewrites; the next read rebuilds it."""
+    if dashboard_snapshots.active:
+        await db.dashboard_snapshots.delete_one({"_id": user_id})
+    dashboard_cache.invalidate(user_id)
+
+
+def render(snapshot: Dict[str, Any], now: Optional[datetime] = None) -> Dict[str, Any]:
+    """The dashboard response for a snapshot."""
     data: Dict[str, Any] = {}
-    data["userName"] = user.get("name") if user else None
+    data["userName"] = snapshot.get("user_name")
 
+    latest_metrics = snapshot.get("latest")
     if latest_metrics:
         data["steps"] = latest_metrics.get("steps")
         # convert sleep minutes to hours string
         sleep_min = latest_metrics.get("sleep_duration_minutes", 0)
         data["sleep"] = f"{sleep_min//60}h {sleep_min%60}m"
         data["screenTime"] = latest_metrics.get("screen_time_minutes")
-        # activity bars could be a list of values for plotting
-        data["activityBars"] = [m.get("active_minutes", 0) for m in recent_metrics]
+        # activity bars: the last 7 days as of now, not as of the last write
+        start = _activity_start(now or datetime.utcnow())
+        activity: List[Dict[str, Any]] = snapshot.get("activity") or []
+        data["activityBars"] = [m["active_minutes"] for m in activity if m["date"] >= start]
     else:
         data["steps"] = None
         data["sleep"] = None
         data["screenTime"] = None
         data["activityBars"] = []
 
-    # goals from profile
-    if profile:
-        data["goals"] = profile.get("goals") or {}
-        data["risk_score"] = profile.get("risk_score", 0)
-    else:
-        data["goals"] = {}
-        data["risk_score"] = 0
-
-    # insight summary
-    if latest_insight:
-        data["insight"] = {
-            "summary": latest_insight.get("summary_message"),
-            "actions": latest_insight.get("recommended_actions", []),
-            "risk_score": latest_insight.get("risk_score"),
-        }
-    else:
-        data["insight"] = None
-
+    data["goals"] = snapshot.get("goals") or {}
+    data["risk_score"] = snapshot.get("risk_score", 0)
+    data["insight"] = snapshot.get("insight")
     return data
+
+
+async def get_dashboard_data(db, user_id: str) -> Dict[str, Any]:
+    """Aggregate latest data for dashboard polling.
+
+    Returns a dict with keys described in architecture spec:
+    - userName
+    - steps
+    - sleep
+    - screenTime
+    - activityBars
+    - goals
+    - insight
+    """
+    async def load() -> Dict[str, Any]:
+        if not dashboard_snapshots.active:
+            return render(await build_snapshot(db, user_id))
+        return render(await get_snapshot(db, user_id))
+
+    return await dashboard_cache.get(user_id, load)
@@ -7,6 +7,7 @@ Tracks the baseline collection phase.
 from datetime import datetime
 from typing import Optional, Dict, Any
 from app.models.health_profile import EnabledSignals, Goals, BaselineMetrics
+from app.services.dashboard_service import snapshot_profile
 
 
 async def create_health_profile(
@@ -47,6 +48,7 @@ async def create_health_profile(
     
     result = await db.health_profiles.insert_one(profile)
     profile["_id"] = result.inserted_id
+    await snapshot_profile(db, user_id, profile)
     return profile
 
 
@@ -80,17 +82,25 @@ async def update_health_profile(
         {"$set": update_data},
         return_document=True
     )
+    if result:
+        await snapshot_profile(db, user_id, result)
     return result
 
 
-async def increment_baseline_days(db, user_id: str) -> Optional[Dict[str, Any]]:
+async def increment_baseline_days(
+    db,
+    user_id: str,
+    profile: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
     """
     Increment the baseline_days_collected counter.
     
     Called after daily metrics are successfully stored.
     If baseline_days_collected reaches 14, transition to "active".
+    Pass an already loaded `profile` to skip re-reading it.
     """
-    profile = await get_health_profile(db, user_id)
+    if profile is None:
+        profile = await get_health_profile(db, user_id)
     if not profile:
         return None
     
@@ -102,7 +112,7 @@ async def increment_baseline_days(db, user_id: str) -> Optional[Dict[str, Any]]:
         # run activation logic before updating status, so baseline metrics are
         # calculated while profile.status still reads "collecting".
         from app.services.ai_service import activate_baseline_if_ready
-        activated = await activate_baseline_if_ready(db, user_id)
+        activated = await activate_baseline_if_ready(db, user_id, profile=profile)
         # regardless of whether active call succeeded, mark status active
         new_status = "active"
     
@@ -1,20 +1,69 @@
 from typing import Any, Dict, List
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+from app.config.settings import settings
 
 
 async def store_health_entry(db, user_id: str, entry: Dict[str, Any]) -> str:
     doc = {"user_id": user_id, **entry}
     if "timestamp" not in doc or doc["timestamp"] is None:
         doc["timestamp"] = datetime.utcnow()
+    elif isinstance(doc["timestamp"], str):
+        # a time-series collection only accepts BSON dates as its time field
+        doc["timestamp"] = datetime.fromisoformat(doc["timestamp"])
     result = await db.health.insert_one(doc)
     return str(result.inserted_id)
 
 
+async def store_health_samples(db, user_id: str, samples: List[Dict[str, Any]]) -> int:
+    """Insert raw samples (``type``, ``timestamp``, ``value``) in batches.
+
+    Samples are inserted unordered, HEALTH_SAMPLE_INSERT_BATCH at a time, and
+    the user is marked for the next daily rollup (see `sample_rollup`).
+    Returns the number of samples stored.
+    """
+    docs = []
+    for sample in samples:
+        timestamp = sample["timestamp"]
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        docs.append({"user_id": user_id, "type": sample["type"], "timestamp": timestamp, "value": sample["value"]})
+    batch = max(1, settings.HEALTH_SAMPLE_INSERT_BATCH)
+    for i in range(0, len(docs), batch):
+        await db.health.insert_many(docs[i:i + batch], ordered=False)
+    if docs:
+        # stamped after the inserts: every sample _id is older than this
+        await db.health_rollups.update_one(
+            {"_id": user_id},
+            {"$set": {"dirty": True}, "$max": {"last_sample_at": datetime.utcnow()}},
+            upsert=True,
+        )
+    return len(docs)
+
+
 async def query_trends(db, user_id: str, metric: str, days: int = 7) -> Dict[str, Any]:
     end = datetime.utcnow()
     start = end - timedelta(days=days)
-    cursor = db.health.find({"user_id": user_id, "type": metric, "timestamp": {"$gte": start, "$lte": end}})
-    items = await cursor.to_list(length=1000)
-    # minimal aggregation example
-    values = [it.get("value") for it in items]
-    return {"metric": metric, "start": start, "end": end, "count": len(values)}
+    # aggregate on the server: matching on user_id (meta) and timestamp (time)
+    # skips whole time-series buckets, and only the `value` column is unpacked
+    cursor = db.health.aggregate([
+        {"$match": {"user_id": user_id, "timestamp": {"$gte": start, "$lte": end}, "type": metric}},
+        {"$group": {
+            "_id": None,
+            "count": {"$sum": 1},
+            "avg": {"$avg": "$value"},
+            "min": {"$min": "$value"},
+            "max": {"$max": "$value"},
+        }},
+    ])
+    stats: List[Dict[str, Any]] = await cursor.to_list(length=1)
+    summary = stats[0] if stats else {"count": 0, "avg": None, "min": None, "max": None}
+    return {
+        "metric": metric,
+        "start": start,
+        "end": end,
+        "count": summary["count"],
+        "avg": summary["avg"],
+        "min": summary["min"],
+        "max": summary["max"],
+    }
@@ -0,0 +1,179 @@
+"""
+Idempotency keys for retried POSTs.
+
+Mobile clients retry `POST /metrics` and `POST /ai/chat` on flaky networks.
+With an ``Idempotency-Key`` header, the first request runs and its response
+is stored; a retry with the same key within IDEMPOTENCY_TTL_SECONDS gets the
+stored response back without re-running the AI pipeline or the LLM (and
+without using a chat quota slot).
+
+- responses live in ``idempotency_keys`` (TTL index on ``expires_at``) and
+  in a per-process LRU of IDEMPOTENCY_CACHE_SIZE entries in front of it
+- keys are scoped per user and endpoint; reusing a key with a different
+  body is rejected
+- a retry that arrives while the first request still runs waits for it in
+  the same process, and is rejected as in progress across processes
+- only successful responses are stored: a failed request can be retried
+  with the same key
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import DuplicateKeyError
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "idempotency_keys"
+MAX_KEY_LENGTH = 255
+# a pending key older than this belongs to a request that died
+PENDING_TIMEOUT = timedelta(minutes=2)
+
+
+class IdempotencyConflict(Exception):
+    """The key cannot be used for this request (see `error_type`)."""
+
+    def __init__(self, status_code: int, error_type: str, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.error_type = error_type
+        self.detail = detail
+
+
+def fingerprint(body: Any) -> str:
+    return hashlib.sha256(json.dumps(jsonable_encoder(body), sort_keys=True).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # doc id -> (fingerprint, response, expires_at)
+        self._entries: "OrderedDict[str, Tuple[str, Any, datetime]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, doc_id: str, digest: str, response: Any, expires_at: datetime) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[doc_id] = (digest, response, expires_at)
+        self._entries.move_to_end(doc_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _cached(self, doc_id: str, digest: str) -> Optional[Any]:
+        entry = self._entries.get(doc_id)
+        if entry is None:
+            return None
+        if entry[2] <= datetime.utcnow():
+            del self._entries[doc_id]
+            return None
+        self._entries.move_to_end(doc_id)
+        return _check(entry[0], digest, entry[1])
+
+    async def run(
+        self,
+        db,
+        user_id: str,
+        scope: str,
+        key: str,
+        body: Any,
+        call: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """Run `call` once per key. Returns (response, replayed)."""
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise IdempotencyConflict(400, "invalid_idempotency_key", f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+        doc_id = f"{user_id}:{scope}:{key}"
+        digest = fingerprint(body)
+
+        cached = self._cached(doc_id, digest)
+        if cached is not None:
+            self.hits += 1
+            return cached, True
+        inflight = self._inflight.get(doc_id)
+        if inflight is not None:
+            digest_first, response = await asyncio.shield(inflight)
+            self.hits += 1
+            return _check(digest_first, digest, response), True
+
+        self._inflight[doc_id] = future = asyncio.get_running_loop().create_future()
+        try:
+            response, replayed = await self._run_once(db, doc_id, digest, call)
+        except BaseException as exc:
+            future.set_exception(exc)
+            # nobody else may be waiting on the future
+            future.exception()
+            raise
+        else:
+            future.set_result((digest, response))
+        finally:
+            del self._inflight[doc_id]
+        if replayed:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return response, replayed
+
+    async def _run_once(self, db, doc_id: str, digest: str, call) -> Tuple[Any, bool]:
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl_seconds)
+        try:
+            await db[COLLECTION].insert_one({
+                "_id": doc_id,
+                "fingerprint": digest,
+                "status": "pending",
+                "created_at": now,
+                "expires_at": expires_at,
+            })
+        except DuplicateKeyError:
+            stored = await db[COLLECTION].find_one({"_id": doc_id})
+            if stored and stored["expires_at"] > now:
+                if stored["status"] == "done":
+                    response = _check(stored["fingerprint"], digest, stored["response"])
+                    self._remember(doc_id, stored["fingerprint"], response, stored["expires_at"])
+                    return response, True
+                if stored["created_at"] > now - PENDING_TIMEOUT:
+                    raise IdempotencyConflict(409, "idempotency_in_progress", "A request with this Idempotency-Key is still being processed")
+            # expired, or left pending by a request that died: take it over
+            result = await db[COLLECTION].replace_one(
+                {"_id": doc_id, "created_at": stored["created_at"] if stored else None},
+                {"fingerprint": digest, "status": "pending", "created_at": now, "expires_at": expires_at},
+            )
+            if result.matched_count != 1:
+                raise IdempotencyConflict(409, "idempotency_in_progress", "A request with this Idempotency-Key is still being processed")
+
+        try:
+            response = jsonable_encoder(await call(), custom_encoder={ObjectId: str})
+        except BaseException:
+            # let the client retry with the same key
+            await db[COLLECTION].delete_one({"_id": doc_id, "status": "pending"})
+            raise
+        await db[COLLECTION].update_one(
+            {"_id": doc_id},
+            {"$set": {"status": "done", "response": response}},
+        )
+        self._remember(doc_id, digest, response, expires_at)
+        return response, False
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+
+def _check(stored_digest: str, digest: str, response: Any) -> Any:
+    if stored_digest != digest:
+        raise IdempotencyConflict(422, "idempotency_key_reused", "Idempotency-Key was already used with a different request body")
+    return response
+
+
+# singleton instance used by the metrics and chat routes
+idempotency_store = IdempotencyStore(settings.IDEMPOTENCY_TTL_SECONDS, settings.IDEMPOTENCY_CACHE_SIZE)
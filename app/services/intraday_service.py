@@ -0,0 +1,200 @@
+"""
+Intraday delta ingestion.
+
+Devices report increments during the day ("steps +37, active +1") instead of
+re-posting the full day. Each delta is one atomic upsert on the day's
+daily_metrics document:
+
+- ``$inc`` for counters (steps, active, sedentary and screen minutes)
+- ``$max`` for running totals reported as-is (sleep, location diversity)
+- ``$min`` on ``created_at`` so the first tick of the day sets it and later
+  ticks never rewrite it
+
+The AI pipeline (baseline fold, collection/activation, flags, risk, insight)
+does not run on every tick. It runs when the client closes the day or when the
+first tick of a newer day arrives (earlier open days are closed). An open
+day's totals are partial: folding them would drag the baseline towards
+mornings, counting them would activate a baseline on half-empty days, and
+scoring them would flag every morning as a low-activity day. While the day is
+open, a run every INTRADAY_PIPELINE_INTERVAL_MINUTES (measured from the day's
+first tick) only does the score-free bookkeeping: it checkpoints
+``pipeline_at`` and refreshes the cached window with the stored totals.
+
+Intraday days carry ``intraday: true``. ``baseline_sample`` holds the values
+last folded into the running baseline, so a later run (or a full upsert
+through `store_daily_metrics`) swaps exactly that sample out.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+
+from app.config.settings import settings
+from app.models.metrics_model import MetricsDelta
+from app.services.ai_pipeline import PipelineContext
+from app.services.baseline_service import SIGNAL_FIELDS, update_running_baseline
+from app.services.dashboard_service import snapshot_metrics
+from app.services.health_profile_service import increment_baseline_days
+from app.services.metrics_repository import metrics_repository
+from app.services.window_cache import window_cache
+from app.services.write_buffer import metrics_write_buffer
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ("steps", "active_minutes", "sedentary_minutes", "screen_time_minutes")
+RUNNING_TOTAL_FIELDS = ("sleep_duration_minutes", "location_diversity_score")
+TYPE_MISMATCH = 14
+
+
+def _sample(doc: Dict[str, Any]) -> Dict[str, Any]:
+    sample = {field: doc.get(field) for field in SIGNAL_FIELDS.values()}
+    sample["date"] = doc["date"]
+    return sample
+
+
+def _pipeline_due(doc: Dict[str, Any], now: datetime) -> bool:
+    interval = settings.INTRADAY_PIPELINE_INTERVAL_MINUTES
+    if interval <= 0:
+        return False
+    # the cadence starts at the day's first tick, not with a run on it
+    last = doc.get("pipeline_at") or doc.get("created_at")
+    return last is not None and now - last >= timedelta(minutes=interval)
+
+
+def _applied(before: Optional[Dict[str, Any]], update: Dict[str, Any]) -> Dict[str, Any]:
+    """The document `update` turns `before` into (what Mongo stored)."""
+    doc = dict(before or update["$setOnInsert"])
+    for field, amount in update.get("$inc", {}).items():
+        doc[field] = (doc.get(field) or 0) + amount
+    for field, value in update.get("$max", {}).items():
+        doc[field] = value if doc.get(field) is None else max(doc[field], value)
+    for field, value in update["$min"].items():
+        doc[field] = value if doc.get(field) is None else min(doc[field], value)
+    doc.update(update["$set"])
+    return doc
+
+
+async def apply_metrics_delta(db, user_id: str, delta: MetricsDelta) -> Dict[str, Any]:
+    """Apply one intraday delta and run the AI pipeline when it is due.
+
+    Returns the day's document after the update, with ``pipeline_ran``.
+    """
+    now = datetime.utcnow()
+    date_dt = datetime(delta.date.year, delta.date.month, delta.date.day)
+    increments = {field: getattr(delta, field) for field in COUNTER_FIELDS if getattr(delta, field)}
+    update: Dict[str, Any] = {
+        "$min": {"created_at": now},
+        "$set": {"updated_at": now, "intraday": True},
+        "$setOnInsert": {"_id": ObjectId(), "user_id": user_id, "date": date_dt},
+    }
+    running = {
+        field: getattr(delta, field)
+        for field in RUNNING_TOTAL_FIELDS
+        if getattr(delta, field) is not None
+    }
+    if increments:
+        update["$inc"] = increments
+    if running:
+        update["$max"] = running
+    # the previous state tells a new day, and a full upload already folded
+    # into the baseline, apart from an open intraday day
+    # buffered full posts must land before the increments
+    await metrics_write_buffer.flush(user_id)
+    try:
+        before = await metrics_repository.find_and_update_day(db, user_id, date_dt, update, upsert=True)
+    except OperationFailure as exc:
+        if exc.code != TYPE_MISMATCH:
+            raise
+        # $inc cannot add to a null counter (e.g. no screen time in a full upload)
+        for field in increments:
+            await metrics_repository.update_day(db, user_id, date_dt, {"$set": {field: 0}}, where={field: None})
+        before = await metrics_repository.find_and_update_day(db, user_id, date_dt, update, upsert=True)
+    doc = _applied(before, update)
+    if before is not None and not before.get("intraday"):
+        sample = _sample(before)
+        await metrics_repository.update_day(
+            db, user_id, date_dt,
+            {"$set": {"baseline_sample": sample}},
+            where={"baseline_sample": {"$exists": False}},
+        )
+        doc["baseline_sample"] = sample
+    window_cache.apply(user_id, doc)
+    await snapshot_metrics(db, user_id)
+
+    if before is None:
+        # first tick of a new day: earlier days are over
+        await close_open_days(db, user_id, before=date_dt)
+
+    result = None
+    if delta.close or _pipeline_due(doc, now):
+        result = await run_intraday_pipeline(db, user_id, doc, close=delta.close)
+        if result is not None:
+            doc = result
+    doc["pipeline_ran"] = result is not None
+    return doc
+
+
+async def close_open_days(db, user_id: str, before: datetime) -> int:
+    """Run the final pipeline pass for intraday days before `before`."""
+    docs = await metrics_repository.find_days(
+        db, user_id,
+        date={"$lt": before},
+        where={"intraday": True, "closed": {"$ne": True}},
+    )
+    closed = 0
+    for doc in docs:
+        if await run_intraday_pipeline(db, user_id, doc, close=True) is not None:
+            closed += 1
+    return closed
+
+
+async def run_intraday_pipeline(db, user_id: str, doc: Dict[str, Any], close: bool = False) -> Optional[Dict[str, Any]]:
+    """On close, fold, count and score the day like `ingest_metrics`.
+
+    Concurrent ticks race for the run by swapping ``pipeline_at``; the loser
+    returns None. Returns the document otherwise. Runs without `close` stop
+    after the bookkeeping and return the stored, unscored day.
+    """
+    now = datetime.utcnow()
+    claim = {"$set": {"pipeline_at": now}}
+    if close:
+        claim["$set"]["closed"] = True
+    doc = await metrics_repository.find_and_update_day(
+        db, user_id, doc["date"], claim,
+        where={"pipeline_at": doc.get("pipeline_at")},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc is None:
+        return None
+    if not close:
+        window_cache.apply(user_id, doc)
+        return doc
+
+    ctx = await PipelineContext.load(db, user_id, doc["date"].date())
+    if not ctx:
+        return None
+    previous_sample = doc.get("baseline_sample")
+    sample = _sample(doc)
+    await update_running_baseline(db, user_id, previous_sample, sample, profile=ctx.profile)
+    await metrics_repository.update_day(db, user_id, doc["date"], {"$set": {"baseline_sample": sample}})
+    doc["baseline_sample"] = sample
+
+    # the day counts towards baseline collection once, on its first close
+    if previous_sample is None and ctx.profile.get("baseline_status") == "collecting":
+        new_profile = await increment_baseline_days(db, user_id, profile=ctx.profile)
+        if new_profile and new_profile.get("baseline_status") == "active":
+            ctx.profile = new_profile
+            logger.info(f"Baseline activated for user {user_id} on intraday close")
+
+    if ctx.is_active:
+        try:
+            result = await ctx.score(doc)
+            await ctx.commit(doc, result)
+            doc["deviation_flags"] = result["deviation_flags"]
+            doc["risk_score"] = result["risk_score"]
+        except Exception as e:
+            logger.error(f"Error processing intraday AI pipeline for user {user_id}: {e}", exc_info=True)
+    return doc
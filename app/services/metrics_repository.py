@@ -0,0 +1,528 @@
+"""
+Storage layout of daily metrics.
+
+Services see one flat document per user and day (``{user_id, date, steps,
+...}``) and address days by ``(user_id, date)``; the repository maps that onto
+the configured DAILY_METRICS_LAYOUT:
+
+- ``flat`` (default): one ``daily_metrics`` document per user and day
+- ``monthly``: one ``daily_metrics_buckets`` document per user and month,
+  ``{_id: "<user_id>:<YYYY-MM>", user_id, month, days: [31 slots]}``; slot
+  ``i`` holds day ``i + 1`` and an empty slot is ``{"date": None}``. A
+  90-day window is 3-4 documents instead of 90, and the index holds one key
+  per user-month instead of one per user-day.
+- ``timeseries``: ``daily_metrics`` (and the legacy ``health`` collection)
+  is a native time-series collection with ``timeField=date`` and
+  ``metaField=user_id``, created by `app.db.client.connect_to_mongo`.
+  MongoDB stores days column-compressed in internal buckets and prunes them
+  by user and date range. It needs MongoDB 7.0+ (updates of measurements).
+  Time-series collections have no upserts, findAndModify or unique
+  indexes, so those are emulated with a read plus a guarded update or an
+  insert. Two concurrent first writes of the same day can both insert; the
+  write buffer and intraday paths write each day from one place.
+
+Updates take the usual operators on day fields (``$set``, ``$unset``,
+``$inc``, ``$max``, ``$min``, ``$setOnInsert``); conditions on day fields go
+in ``where``. ``python -m app.jobs.migrate_metrics_buckets`` copies the flat
+collection into buckets.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.config.settings import settings
+from app.db.indexes import IndexSpec, ensure_indexes
+
+FLAT = "flat"
+MONTHLY = "monthly"
+TIMESERIES = "timeseries"
+BUCKET_COLLECTION = "daily_metrics_buckets"
+SLOTS = 31
+DUPLICATE_KEY = 11000
+
+
+class DayWrite(NamedTuple):
+    """One day's update for `bulk_write`."""
+    user_id: str
+    date: datetime
+    update: Dict[str, Any]
+    upsert: bool = False
+
+
+def _matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    """Evaluate a simple day-field query (equality and comparisons) in Python."""
+    for field, cond in query.items():
+        value = doc.get(field)
+        if not isinstance(cond, dict):
+            if value != cond:
+                return False
+            continue
+        for op, arg in cond.items():
+            if op == "$exists":
+                ok = (field in doc) == bool(arg)
+            elif op == "$ne":
+                ok = value != arg
+            elif value is None:
+                ok = False
+            elif op == "$lt":
+                ok = value < arg
+            elif op == "$lte":
+                ok = value <= arg
+            elif op == "$gt":
+                ok = value > arg
+            elif op == "$gte":
+                ok = value >= arg
+            else:
+                raise ValueError(f"unsupported day query operator {op}")
+            if not ok:
+                return False
+    return True
+
+
+class FlatLayout:
+    """One document per user and day in ``daily_metrics``."""
+
+    name = FLAT
+    # unique: concurrent first upserts of a day cannot create two documents
+    indexes = [IndexSpec("daily_metrics", [("user_id", ASCENDING), ("date", ASCENDING)], {"unique": True})]
+
+    async def ensure_indexes(self, db) -> None:
+        await ensure_indexes(db, self.indexes)
+
+    async def find_day(self, db, user_id: str, day: datetime) -> Optional[Dict[str, Any]]:
+        return await db.daily_metrics.find_one({"user_id": user_id, "date": day})
+
+    async def find_by_id(self, db, user_id: str, doc_id: Any) -> Optional[Dict[str, Any]]:
+        return await db.daily_metrics.find_one({"_id": doc_id})
+
+    async def find_days(
+        self,
+        db,
+        user_id: str,
+        date: Optional[Dict[str, datetime]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        sort: int = 1,
+        limit: Optional[int] = None,
+        projection: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """A user's days by date (`sort` 1 = oldest first); `date` holds $gte/$lt/..."""
+        query: Dict[str, Any] = {"user_id": user_id}
+        if date:
+            query["date"] = date
+        query.update(where or {})
+        cursor = db.daily_metrics.find(query) if projection is None else db.daily_metrics.find(query, projection)
+        cursor = cursor.sort("date", sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(length=None)
+
+    async def find_users_days(self, db, user_ids: List[str], date: Dict[str, datetime]) -> List[Dict[str, Any]]:
+        """Days of many users in one query, ordered by user then date."""
+        cursor = db.daily_metrics.find({
+            "user_id": {"$in": user_ids},
+            "date": date,
+        }).sort([("user_id", 1), ("date", 1)])
+        return await cursor.to_list(length=None)
+
+    async def update_day(self, db, user_id: str, day: datetime, update: Dict[str, Any],
+                         where: Optional[Dict[str, Any]] = None, upsert: bool = False) -> None:
+        query = {"user_id": user_id, "date": day, **(where or {})}
+        if upsert:
+            await db.daily_metrics.update_one(query, update, upsert=True)
+        else:
+            await db.daily_metrics.update_one(query, update)
+
+    async def find_and_update_day(self, db, user_id: str, day: datetime, update: Dict[str, Any],
+                                  where: Optional[Dict[str, Any]] = None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE) -> Optional[Dict[str, Any]]:
+        """`find_one_and_update` on one day; BEFORE returns None for a new day."""
+        return await db.daily_metrics.find_one_and_update(
+            {"user_id": user_id, "date": day, **(where or {})},
+            update,
+            upsert=upsert,
+            return_document=return_document,
+        )
+
+    async def bulk_write(self, db, writes: List[DayWrite]) -> None:
+        """Unordered bulk update; a BulkWriteError indexes into `writes`."""
+        await db.daily_metrics.bulk_write([
+            UpdateOne({"user_id": w.user_id, "date": w.date}, w.update, upsert=w.upsert)
+            for w in writes
+        ], ordered=False)
+
+
+def bucket_id(user_id: str, day: datetime) -> str:
+    return f"{user_id}:{day.year:04d}-{day.month:02d}"
+
+
+def _month(day: datetime) -> datetime:
+    return datetime(day.year, day.month, 1)
+
+
+def _slot(day: datetime) -> str:
+    return f"days.{day.day - 1}"
+
+
+def _empty_days() -> List[Dict[str, Any]]:
+    return [{"date": None} for _ in range(SLOTS)]
+
+
+def _in_slot(update: Dict[str, Any], day: datetime) -> Dict[str, Any]:
+    """Day-level update operators -> operators on the day's slot."""
+    path = _slot(day)
+    ops = {
+        op: {f"{path}.{field}": value for field, value in fields.items()}
+        for op, fields in update.items()
+        if op != "$setOnInsert" and fields
+    }
+    for fields in ops.values():
+        fields.pop(f"{path}.user_id", None)  # stored once per bucket
+    ops = {op: fields for op, fields in ops.items() if fields}
+    # an update of insert-only fields has nothing left for an existing day
+    return ops or {"$set": {f"{path}.date": day}}
+
+
+def _new_slot(update: Dict[str, Any], day: datetime) -> Dict[str, Any]:
+    slot = {k: v for k, v in update.get("$setOnInsert", {}).items() if k != "user_id"}
+    slot.setdefault("_id", ObjectId())
+    slot["date"] = day
+    return slot
+
+
+def _month_bounds(date: Optional[Dict[str, datetime]]) -> Dict[str, datetime]:
+    bounds = {}
+    for op, value in (date or {}).items():
+        bounds["$gte" if op in ("$gt", "$gte") else "$lte"] = _month(value)
+    return bounds
+
+
+class MonthlyBucketLayout:
+    """One document per user and month with a fixed 31-slot `days` array."""
+
+    name = MONTHLY
+    indexes = [IndexSpec(BUCKET_COLLECTION, [("user_id", ASCENDING), ("month", ASCENDING)])]
+
+    def _collection(self, db):
+        return db[BUCKET_COLLECTION]
+
+    async def ensure_indexes(self, db) -> None:
+        await ensure_indexes(db, self.indexes)
+
+    @staticmethod
+    def _days(bucket: Dict[str, Any], reverse: bool = False) -> List[Dict[str, Any]]:
+        days = [
+            {**slot, "user_id": bucket["user_id"]}
+            for slot in bucket.get("days", [])
+            if slot and slot.get("date") is not None
+        ]
+        return days[::-1] if reverse else days
+
+    def _one(self, bucket: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if bucket is None:
+            return None
+        days = self._days(bucket)
+        return days[0] if days else None
+
+    async def find_day(self, db, user_id: str, day: datetime) -> Optional[Dict[str, Any]]:
+        bucket = await self._collection(db).find_one(
+            {"_id": bucket_id(user_id, day)},
+            {"user_id": 1, "days": {"$slice": [day.day - 1, 1]}},
+        )
+        return self._one(bucket)
+
+    async def find_by_id(self, db, user_id: str, doc_id: Any) -> Optional[Dict[str, Any]]:
+        # served by the (user_id, month) index: no per-day index needed
+        bucket = await self._collection(db).find_one({"user_id": user_id, "days._id": doc_id})
+        if bucket is None:
+            return None
+        return next((d for d in self._days(bucket) if d.get("_id") == doc_id), None)
+
+    async def find_days(
+        self,
+        db,
+        user_id: str,
+        date: Optional[Dict[str, datetime]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        sort: int = 1,
+        limit: Optional[int] = None,
+        projection: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Same as `FlatLayout.find_days`; `projection` applies to each day."""
+        query: Dict[str, Any] = {"user_id": user_id}
+        months = _month_bounds(date)
+        if months:
+            query["month"] = months
+        day_query = {"date": date, **(where or {})} if date else dict(where or {})
+        fields = _bucket_projection(projection, day_query) if projection else None
+        # a month holds at least 28 days: fetch just enough buckets for `limit`
+        batch = (limit // 28 + 2) if limit else 0
+        docs: List[Dict[str, Any]] = []
+        while True:
+            cursor = self._collection(db).find(query, fields) if fields else self._collection(db).find(query)
+            cursor = cursor.sort("month", sort)
+            if batch:
+                cursor = cursor.limit(batch)
+            buckets = await cursor.to_list(length=None)
+            for bucket in buckets:
+                for doc in self._days(bucket, reverse=sort == -1):
+                    if _matches(doc, day_query):
+                        docs.append(_project_day(doc, projection) if projection else doc)
+                        if limit and len(docs) >= limit:
+                            return docs
+            if not batch or len(buckets) < batch:
+                return docs
+            # sparse months: continue after the last bucket read
+            query["month"] = {**query.get("month", {}), "$lt" if sort == -1 else "$gt": buckets[-1]["month"]}
+
+    async def find_users_days(self, db, user_ids: List[str], date: Dict[str, datetime]) -> List[Dict[str, Any]]:
+        cursor = self._collection(db).find({
+            "user_id": {"$in": user_ids},
+            "month": _month_bounds(date),
+        }).sort([("user_id", 1), ("month", 1)])
+        return [
+            doc
+            for bucket in await cursor.to_list(length=None)
+            for doc in self._days(bucket)
+            if _matches(doc, {"date": date})
+        ]
+
+    async def _claim(self, db, user_id: str, day: datetime, update: Dict[str, Any]) -> bool:
+        """Fill the day's empty slot (creating the bucket). False if it was taken."""
+        buckets = self._collection(db)
+        path = _slot(day)
+        slot = _new_slot(update, day)
+        for _ in range(2):
+            res = await buckets.update_one(
+                {"_id": bucket_id(user_id, day), f"{path}.date": None},
+                {"$set": {path: slot}},
+            )
+            if res.matched_count:
+                return True
+            days = _empty_days()
+            days[day.day - 1] = slot
+            try:
+                res = await buckets.update_one(
+                    {"_id": bucket_id(user_id, day)},
+                    {"$setOnInsert": {"user_id": user_id, "month": _month(day), "days": days}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                continue  # created concurrently: claim the slot in it
+            return res.upserted_id is not None
+        return False
+
+    async def update_day(self, db, user_id: str, day: datetime, update: Dict[str, Any],
+                         where: Optional[Dict[str, Any]] = None, upsert: bool = False) -> None:
+        await self.find_and_update_day(db, user_id, day, update, where=where, upsert=upsert)
+
+    async def find_and_update_day(self, db, user_id: str, day: datetime, update: Dict[str, Any],
+                                  where: Optional[Dict[str, Any]] = None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE) -> Optional[Dict[str, Any]]:
+        path = _slot(day)
+        query = {"_id": bucket_id(user_id, day), f"{path}.date": day}
+        query.update({f"{path}.{field}": cond for field, cond in (where or {}).items()})
+        projection = {"user_id": 1, "days": {"$slice": [day.day - 1, 1]}}
+        ops = _in_slot(update, day)
+        bucket = await self._collection(db).find_one_and_update(
+            query, ops, projection=projection, return_document=return_document,
+        )
+        if bucket is not None or not upsert:
+            return self._one(bucket)
+        claimed = await self._claim(db, user_id, day, update)
+        bucket = await self._collection(db).find_one_and_update(
+            query, ops, projection=projection, return_document=return_document,
+        )
+        if claimed and return_document == ReturnDocument.BEFORE:
+            return None  # a new day, like a flat upsert
+        return self._one(bucket)
+
+    async def bulk_write(self, db, writes: List[DayWrite]) -> None:
+        """Create missing buckets and slots, then update every day unordered.
+
+        Every phase runs even if an earlier one had write errors; they are
+        raised together at the end as one BulkWriteError indexing into `writes`.
+        """
+        buckets = self._collection(db)
+        errors: List[Dict[str, Any]] = []
+        inserts = [i for i, w in enumerate(writes) if w.upsert]
+        if inserts:
+            created: Dict[str, UpdateOne] = {}
+            bucket_writes: Dict[str, List[int]] = {}
+            for i in inserts:
+                w = writes[i]
+                bid = bucket_id(w.user_id, w.date)
+                bucket_writes.setdefault(bid, []).append(i)
+                if bid not in created:
+                    created[bid] = UpdateOne(
+                        {"_id": bid},
+                        {"$setOnInsert": {"user_id": w.user_id, "month": _month(w.date), "days": _empty_days()}},
+                        upsert=True,
+                    )
+            # concurrent bucket creation: the other writer's bucket is as good
+            failed = await _phase_errors(buckets.bulk_write(list(created.values()), ordered=False))
+            bids = list(created)
+            errors.extend(
+                {**error, "index": i}
+                for error in failed if error.get("code") != DUPLICATE_KEY
+                for i in bucket_writes[bids[error["index"]]]
+            )
+            failed = await _phase_errors(buckets.bulk_write([
+                UpdateOne(
+                    {"_id": bucket_id(writes[i].user_id, writes[i].date), f"{_slot(writes[i].date)}.date": None},
+                    {"$set": {_slot(writes[i].date): _new_slot(writes[i].update, writes[i].date)}},
+                )
+                for i in inserts
+            ], ordered=False))
+            errors.extend({**error, "index": inserts[error["index"]]} for error in failed)
+        errors.extend(await _phase_errors(buckets.bulk_write([
+            UpdateOne(
+                {"_id": bucket_id(w.user_id, w.date), f"{_slot(w.date)}.date": w.date},
+                _in_slot(w.update, w.date),
+            )
+            for w in writes
+        ], ordered=False)))
+        if errors:
+            first: Dict[int, Dict[str, Any]] = {}
+            for error in errors:
+                first.setdefault(error["index"], error)
+            raise BulkWriteError({"writeErrors": [first[i] for i in sorted(first)], "writeConcernErrors": []})
+
+
+def _bucket_projection(projection: Dict[str, Any], day_query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Slot fields to fetch for an inclusion projection (None: fetch whole buckets)."""
+    fields = {f for f, v in projection.items() if v and f != "_id"}
+    if not fields:
+        return None
+    # the slot date and the `where` fields are needed to filter days
+    fields |= {"date", *day_query}
+    if projection.get("_id", 1):
+        fields.add("_id")
+    return {"user_id": 1, "month": 1, **{f"days.{f}": 1 for f in sorted(fields)}}
+
+
+def _project_day(doc: Dict[str, Any], projection: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply a find projection (inclusion or exclusion of top-level fields) to a day."""
+    fields = {f for f, v in projection.items() if v and f != "_id"}
+    if fields:
+        kept = {f: doc[f] for f in fields if f in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            kept["_id"] = doc["_id"]
+        return kept
+    return {k: v for k, v in doc.items() if projection.get(k, 1)}
+
+
+def _measurement_update(update: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop what a time-series update must not carry: upsert-only and meta/time fields."""
+    ops = {}
+    for op, fields in update.items():
+        if op == "$setOnInsert":
+            continue
+        fields = {k: v for k, v in fields.items() if k not in ("user_id", "date")}
+        if fields:
+            ops[op] = fields
+    return ops
+
+
+def _inserted_day(user_id: str, day: datetime, update: Dict[str, Any]) -> Dict[str, Any]:
+    """The document an upsert of `update` would create for a new day."""
+    doc: Dict[str, Any] = dict(update.get("$setOnInsert", {}))
+    for op in ("$set", "$inc", "$max", "$min"):
+        doc.update(update.get(op, {}))
+    for field in update.get("$unset", {}):
+        doc.pop(field, None)
+    doc.setdefault("_id", ObjectId())
+    doc["user_id"] = user_id
+    doc["date"] = day
+    return doc
+
+
+class TimeSeriesLayout(FlatLayout):
+    """`daily_metrics` as a native time-series collection (meta user_id, time date)."""
+
+    name = TIMESERIES
+    # time-series collections cannot have unique indexes
+    indexes = [IndexSpec("daily_metrics", [("user_id", ASCENDING), ("date", ASCENDING)])]
+
+    async def find_by_id(self, db, user_id: str, doc_id: Any) -> Optional[Dict[str, Any]]:
+        # time-series collections have no _id index: prune buckets by user
+        return await db.daily_metrics.find_one({"user_id": user_id, "_id": doc_id})
+
+    async def update_day(self, db, user_id: str, day: datetime, update: Dict[str, Any],
+                         where: Optional[Dict[str, Any]] = None, upsert: bool = False) -> None:
+        await self.find_and_update_day(db, user_id, day, update, where=where, upsert=upsert)
+
+    async def find_and_update_day(self, db, user_id: str, day: datetime, update: Dict[str, Any],
+                                  where: Optional[Dict[str, Any]] = None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE) -> Optional[Dict[str, Any]]:
+        """Read, then update the same day guarded by `where`; insert a new day on upsert."""
+        query = {"user_id": user_id, "date": day, **(where or {})}
+        before = await db.daily_metrics.find_one(query)
+        if before is None:
+            if not upsert:
+                return None
+            doc = _inserted_day(user_id, day, update)
+            await db.daily_metrics.insert_one(doc)
+            return doc if return_document == ReturnDocument.AFTER else None
+        guarded = {**query, "_id": before["_id"]}
+        ops = _measurement_update(update)
+        if ops:
+            res = await db.daily_metrics.update_one(guarded, ops)
+            if not res.matched_count:
+                return None  # changed concurrently so that `where` no longer holds
+        if return_document == ReturnDocument.AFTER:
+            return await db.daily_metrics.find_one(guarded)
+        return before
+
+    async def bulk_write(self, db, writes: List[DayWrite]) -> None:
+        """Unordered updates of existing days and inserts of new ones, one op per write."""
+        existing = set()
+        upserts = [w for w in writes if w.upsert]
+        if upserts:
+            cursor = db.daily_metrics.find(
+                {"$or": [{"user_id": w.user_id, "date": w.date} for w in upserts]},
+                {"_id": 0, "user_id": 1, "date": 1},
+            )
+            existing = {(d["user_id"], d["date"]) for d in await cursor.to_list(length=None)}
+        ops = []
+        for w in writes:
+            if w.upsert and (w.user_id, w.date) not in existing:
+                existing.add((w.user_id, w.date))
+                ops.append(InsertOne(_inserted_day(w.user_id, w.date, w.update)))
+            else:
+                ops.append(UpdateOne({"user_id": w.user_id, "date": w.date},
+                                     _measurement_update(w.update) or {"$set": {}}))
+        await db.daily_metrics.bulk_write(ops, ordered=False)
+
+
+async def _phase_errors(write) -> List[Dict[str, Any]]:
+    """Await one unordered bulk write; its write errors instead of raising them."""
+    try:
+        await write
+    except BulkWriteError as exc:
+        return exc.details["writeErrors"]
+    return []
+
+
+LAYOUTS = {FLAT: FlatLayout, MONTHLY: MonthlyBucketLayout, TIMESERIES: TimeSeriesLayout}
+
+
+class MetricsRepository:
+    """The configured layout; `use` switches it (migrations, tests)."""
+
+    def __init__(self, layout: str):
+        self.use(layout)
+
+    def use(self, layout: str) -> None:
+        if layout not in LAYOUTS:
+            raise ValueError(f"DAILY_METRICS_LAYOUT must be one of {sorted(LAYOUTS)}, not {layout!r}")
+        self.layout = LAYOUTS[layout]()
+
+    def __getattr__(self, name: str):
+        return getattr(self.layout, name)
+
+
+# singleton instance used by the metrics services
+metrics_repository = MetricsRepository(settings.DAILY_METRICS_LAYOUT)
@@ -1,27 +1,30 @@
 from datetime import datetime
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from pydantic import ValidationError
 from app.models.metrics_model import MetricsCreate
 from app.services.daily_metrics_service import store_daily_metrics, get_daily_metrics
-from app.services.health_profile_service import get_health_profile, increment_baseline_days
-from app.services.ai_service import (
-    activate_baseline_if_ready,
-    compute_daily_deviations,
-    calculate_risk_score,
-    generate_insights,
-)
-import logging
+from app.services.ai_pipeline import PipelineContext
+from app.services.ai_jobs import ai_job_queue
+from app.services.replay_service import replay_history
 
 logger = logging.getLogger(__name__)
 
 
 async def ingest_metrics(db, user_id: str, payload: MetricsCreate) -> Dict[str, Any]:
-    """Store incoming metrics and run AI pipeline if baseline is active."""
+    """Store incoming metrics and run AI pipeline if baseline is active.
+
+    The profile and trailing window are loaded once into a `PipelineContext`
+    and reused by every step; AI results are written in one batch. While the
+    AI job queue runs, only the upsert happens here and the AI steps are
+    enqueued (the result carries ``ai_job_id``).
+    """
     logging.info(f"ingest_metrics: user={user_id}, payload={payload}")
-    profile = await get_health_profile(db, user_id)
-    logging.info(f"ingest_metrics: current profile status={profile.get('baseline_status') if profile else None}")
-    if not profile:
+    ctx = await PipelineContext.load(db, user_id, payload.date)
+    logging.info(f"ingest_metrics: current profile status={ctx.profile.get('baseline_status') if ctx else None}")
+    if not ctx:
         return {}
+    profile = ctx.profile
 
     metrics = await store_daily_metrics(
         db,
@@ -33,30 +36,73 @@ async def ingest_metrics(db, user_id: str, payload: MetricsCreate) -> Dict[str,
         payload.location_diversity_score,
         payload.active_minutes,
         payload.screen_time_minutes if hasattr(payload, 'screen_time_minutes') else None,
+        profile=profile,
     )
 
-    # increment baseline counter if collecting
-    activated = False
-    if profile.get("baseline_status") == "collecting":
-        new_profile = await increment_baseline_days(db, user_id)
-        # check if activation happened on this insert
-        if new_profile and new_profile.get("baseline_status") == "active":
-            activated = True
-            logger.info(f"Baseline activated for user {user_id} on metric insert")
-
-    # if baseline already active or just activated, run AI pipeline
-    if profile.get("baseline_status") == "active" or activated:
-        try:
-            deviation_flags = await compute_daily_deviations(db, user_id, metrics["_id"])
-            risk_score = await calculate_risk_score(db, user_id, deviation_flags, metrics)
-            await generate_insights(db, user_id, deviation_flags, risk_score)
-            metrics["deviation_flags"] = deviation_flags
-            metrics["risk_score"] = risk_score
-            logger.info(f"AI engine processed metrics for user {user_id}. Risk score: {risk_score}")
-        except Exception as e:
-            logger.error(f"Error processing AI pipeline for user {user_id}: {e}", exc_info=True)
+    if ai_job_queue.active:
+        # the AI steps run in the background; the client polls the job
+        job = await ai_job_queue.enqueue(db, user_id, payload.date)
+        metrics["ai_job_id"] = str(job["_id"])
+        return metrics
+
+    # count the day while collecting; score it once the baseline is active
+    try:
+        result = await ctx.process(metrics)
+        if result is not None:
+            metrics["deviation_flags"] = result["deviation_flags"]
+            metrics["risk_score"] = result["risk_score"]
+            logger.info(f"AI engine processed metrics for user {user_id}. Risk score: {result['risk_score']}")
+    except Exception as e:
+        logger.error(f"Error processing AI pipeline for user {user_id}: {e}", exc_info=True)
     return metrics
 
 
+async def ingest_metrics_batch(db, user_id: str, items: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Validate and store many days at once, with per-item status.
+
+    Valid items are replayed in date order through the AI pipeline and
+    upserted with one unordered bulk_write (see `replay_service`); invalid
+    items are reported and skipped. Returns None when the user has no
+    health profile.
+    """
+    valid: List[MetricsCreate] = []
+    results: List[Dict[str, Any]] = []
+    for index, item in enumerate(items):
+        try:
+            payload = MetricsCreate.model_validate(item)
+        except ValidationError as exc:
+            errors = [{"loc": list(e["loc"]), "msg": e["msg"], "type": e["type"]} for e in exc.errors()]
+            results.append({"index": index, "status": "invalid", "errors": errors})
+            continue
+        valid.append(payload)
+        results.append({"index": index, "status": "stored", "date": payload.date})
+
+    summary = await replay_history(db, user_id, valid)
+    if summary is None:
+        return None
+
+    docs = {doc["date"].date(): doc for doc in summary["docs"]}
+    failed_dates = {day.date() for day in summary["failed_dates"]}
+    for result in results:
+        if result["status"] != "stored":
+            continue
+        if result["date"] in failed_dates:
+            result["status"] = "error"
+            continue
+        doc = docs[result["date"]]
+        result["deviation_flags"] = doc.get("deviation_flags")
+        result["risk_score"] = doc.get("risk_score")
+
+    statuses = [r["status"] for r in results]
+    return {
+        "stored": statuses.count("stored"),
+        "invalid": statuses.count("invalid"),
+        "failed": statuses.count("error"),
+        "baseline_status": summary.get("baseline_status"),
+        "risk_score": summary.get("risk_score"),
+        "items": results,
+    }
+
+
 async def get_metrics_for_date(db, user_id: str, date_obj) -> Dict[str, Any]:
     return await get_daily_metrics(db, user_id, date_obj)
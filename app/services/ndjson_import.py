@@ -0,0 +1,229 @@
+"""
+Streaming NDJSON import of daily metrics for many users.
+
+The request body is read chunk by chunk and split into lines; each line is
+one JSON object with a ``user_id`` plus the `MetricsCreate` fields. Nothing
+is ever held for the whole upload:
+
+- valid rows go into a per-user buffer; a buffer is flushed when it reaches
+  IMPORT_USER_BUFFER_ROWS, and every buffer is flushed once all buffers
+  together hold IMPORT_MAX_BUFFERED_ROWS rows
+- at most IMPORT_MAX_INFLIGHT_FLUSHES flushes run at once; when all slots are
+  busy the reader stops pulling the body (backpressure reaches the client
+  through TCP)
+- flushes of one user run one after another, in upload order
+- a flush replays the rows through the AI pipeline (`replay_history`:
+  baseline, activation, flags, insights, one bulk_write) or, with
+  ``replay=False``, only bulk upserts them into daily_metrics (baselines of
+  active users then catch up at the next baseline refresh; the refresh skips
+  users still collecting, so their rows are always replayed and count
+  towards activation)
+
+Lines that are not valid JSON or fail validation are counted and skipped;
+the first IMPORT_ERROR_SAMPLES errors are returned with their line numbers.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from bson import ObjectId
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from app.config.settings import settings
+from app.models.metrics_model import MetricsCreate
+from app.services.dashboard_service import invalidate_snapshot
+from app.services.baseline_service import INTRADAY_FIELDS
+from app.services.metrics_repository import DayWrite, metrics_repository
+from app.services.replay_service import metrics_doc, replay_history
+from app.services.window_cache import window_cache
+from app.services.write_buffer import metrics_write_buffer
+
+logger = logging.getLogger(__name__)
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Optional[bytes]]:
+    """Split a byte stream into lines.
+
+    Yields None in place of a line longer than `max_line_bytes`; its bytes
+    are dropped as they arrive so memory stays bounded.
+    """
+    pending = b""
+    skipping = False
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if skipping:
+                skipping = False
+                yield None
+            elif len(line) > max_line_bytes:
+                yield None
+            else:
+                yield line
+        if len(pending) > max_line_bytes:
+            pending = b""
+            skipping = True
+    if skipping:
+        yield None
+    elif pending.strip():
+        yield pending
+
+
+class NdjsonImporter:
+    def __init__(
+        self,
+        db,
+        replay: bool = True,
+        user_buffer_rows: int = settings.IMPORT_USER_BUFFER_ROWS,
+        max_buffered_rows: int = settings.IMPORT_MAX_BUFFERED_ROWS,
+        max_inflight: int = settings.IMPORT_MAX_INFLIGHT_FLUSHES,
+    ):
+        self.db = db
+        self.replay = replay
+        self.user_buffer_rows = max(1, user_buffer_rows)
+        self.max_buffered_rows = max(1, max_buffered_rows)
+        self._slots = asyncio.Semaphore(max(1, max_inflight))
+        self._buffers: Dict[str, List[MetricsCreate]] = {}
+        self._buffered = 0
+        self._user_tasks: Dict[str, asyncio.Task] = {}
+        self._tasks: set = set()
+        self.stats = {"lines": 0, "stored": 0, "invalid": 0, "failed": 0, "flushes": 0}
+        self.errors: List[Dict[str, Any]] = []
+
+    def _error(self, line_no: int, kind: str, detail: Any) -> None:
+        self.stats["invalid"] += 1
+        if len(self.errors) < settings.IMPORT_ERROR_SAMPLES:
+            self.errors.append({"line": line_no, "type": kind, "detail": detail})
+
+    async def add_line(self, line_no: int, line: Optional[bytes]) -> None:
+        if line is not None and not line.strip():
+            return
+        self.stats["lines"] += 1
+        if line is None:
+            self._error(line_no, "line_too_long", f"line exceeds {settings.IMPORT_MAX_LINE_BYTES} bytes")
+            return
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            self._error(line_no, "invalid_json", str(exc))
+            return
+        user_id = row.get("user_id") if isinstance(row, dict) else None
+        if not isinstance(user_id, str) or not user_id:
+            self._error(line_no, "missing_user_id", "each line needs a string user_id")
+            return
+        try:
+            payload = MetricsCreate.model_validate(row)
+        except ValidationError as exc:
+            self._error(line_no, "validation", [
+                {"loc": list(e["loc"]), "msg": e["msg"]} for e in exc.errors()
+            ])
+            return
+
+        buffer = self._buffers.setdefault(user_id, [])
+        buffer.append(payload)
+        self._buffered += 1
+        if len(buffer) >= self.user_buffer_rows:
+            await self._flush_user(user_id)
+        elif self._buffered >= self.max_buffered_rows:
+            for uid in list(self._buffers):
+                await self._flush_user(uid)
+
+    async def _flush_user(self, user_id: str) -> None:
+        rows = self._buffers.pop(user_id)
+        self._buffered -= len(rows)
+        self.stats["flushes"] += 1
+        # backpressure: wait for a free flush slot before reading on
+        await self._slots.acquire()
+        task = asyncio.create_task(self._flush(user_id, rows, self._user_tasks.get(user_id)))
+        self._user_tasks[user_id] = task
+        self._tasks.add(task)
+
+        def _done(t: asyncio.Task) -> None:
+            self._slots.release()
+            self._tasks.discard(t)
+            if self._user_tasks.get(user_id) is t:
+                del self._user_tasks[user_id]
+
+        task.add_done_callback(_done)
+
+    async def _flush(self, user_id: str, rows: List[MetricsCreate], previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            # keep one user's rows in upload order
+            await asyncio.wait([previous])
+        try:
+            if self.replay or await self._collecting(user_id):
+                summary = await replay_history(self.db, user_id, rows)
+                if summary is None:
+                    self.stats["failed"] += len(rows)
+                    if len(self.errors) < settings.IMPORT_ERROR_SAMPLES:
+                        self.errors.append({"user_id": user_id, "type": "no_profile", "detail": f"{len(rows)} rows skipped"})
+                    return
+                failed = sum(1 for row in rows if datetime(row.date.year, row.date.month, row.date.day) in summary["failed_dates"])
+            else:
+                failed = await self._bulk_upsert(user_id, rows)
+            self.stats["stored"] += len(rows) - failed
+            self.stats["failed"] += failed
+        except Exception as exc:
+            logger.error(f"ndjson import: flush for {user_id} failed: {exc}")
+            self.stats["failed"] += len(rows)
+            if len(self.errors) < settings.IMPORT_ERROR_SAMPLES:
+                self.errors.append({"user_id": user_id, "type": "write", "detail": str(exc)})
+
+    async def _collecting(self, user_id: str) -> bool:
+        profile = await self.db.health_profiles.find_one({"user_id": user_id}, {"baseline_status": 1})
+        return bool(profile) and profile.get("baseline_status") == "collecting"
+
+    async def _bulk_upsert(self, user_id: str, rows: List[MetricsCreate]) -> int:
+        now = datetime.utcnow()
+        # unordered writes have no "last one wins": keep the last row per day
+        latest = {row.date: row for row in rows}
+        ops = []
+        for row in latest.values():
+            doc = metrics_doc(user_id, row, now)
+            ops.append(DayWrite(
+                user_id,
+                doc["date"],
+                # a full day replaces any intraday (delta) state, as in store_daily_metrics
+                {"$set": doc, "$setOnInsert": {"_id": ObjectId()}, "$unset": {field: "" for field in INTRADAY_FIELDS}},
+                upsert=True,
+            ))
+        await metrics_write_buffer.flush(user_id)
+        try:
+            await metrics_repository.bulk_write(self.db, ops)
+        except BulkWriteError as exc:
+            return len(exc.details["writeErrors"])
+        finally:
+            window_cache.invalidate(user_id)
+            await invalidate_snapshot(self.db, user_id)
+        return 0
+
+    async def finish(self) -> None:
+        for user_id in list(self._buffers):
+            await self._flush_user(user_id)
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+
+async def import_ndjson(db, chunks: AsyncIterator[bytes], replay: bool = True) -> Dict[str, Any]:
+    """Stream an NDJSON body into daily_metrics; returns counts and throughput."""
+    started = time.monotonic()
+    importer = NdjsonImporter(db, replay=replay)
+    line_no = 0
+    async for line in iter_lines(chunks, settings.IMPORT_MAX_LINE_BYTES):
+        line_no += 1
+        await importer.add_line(line_no, line)
+    await importer.finish()
+
+    seconds = time.monotonic() - started
+    report = {
+        **importer.stats,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(importer.stats["stored"] / seconds, 1) if seconds else None,
+        "errors": importer.errors,
+    }
+    logger.info(f"ndjson import: {({k: v for k, v in report.items() if k != 'errors'})}")
+    return report
@@ -0,0 +1,234 @@
+"""
+Historical backfill / replay for the AI pipeline.
+
+Posting weeks of past data through `ingest_metrics` costs one upsert,
+profile update and (once active) scoring round trip per day. `replay_history`
+takes a user's history, sorts it by date and runs the same steps in one
+chronological in-memory pass:
+
+- daily upsert (corrections replace the stored day, duplicates in the
+  upload are applied in order)
+- running baseline update and baseline_days_collected / activation
+- deviation flags, risk score and insight once the baseline is active, with
+  the same trend window (the 3 stored days before each day)
+
+Results match posting the days one by one in date order. Everything is
+written at the end: one unordered `bulk_write` for daily_metrics, one
+`insert_many` for insights and one health profile update.
+"""
+import asyncio
+import bisect
+import copy
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.models.metrics_model import MetricsCreate
+from app.services.ai_pipeline import score_day
+from app.services.ai_service import CONSECUTIVE_DAYS_FOR_TREND
+from app.services.baseline_service import INTRADAY_FIELDS, apply_metrics_change, held_sample
+from app.services.dashboard_service import invalidate_snapshot
+from app.services.metrics_repository import DayWrite, metrics_repository
+from app.services.scoring_executor import scoring_executor
+from app.services.window_cache import window_cache
+from app.services.write_buffer import metrics_write_buffer
+
+logger = logging.getLogger(__name__)
+
+# same threshold `increment_baseline_days` uses
+BASELINE_DAYS_REQUIRED = 14
+
+
+def metrics_doc(user_id: str, payload: MetricsCreate, now: datetime) -> Dict[str, Any]:
+    """The fields `store_daily_metrics` sets for one payload."""
+    return {
+        "user_id": user_id,
+        "date": datetime(payload.date.year, payload.date.month, payload.date.day),
+        "steps": payload.steps,
+        "sleep_duration_minutes": payload.sleep_duration_minutes,
+        "sedentary_minutes": payload.sedentary_minutes,
+        "location_diversity_score": payload.location_diversity_score,
+        "active_minutes": payload.active_minutes,
+        "screen_time_minutes": payload.screen_time_minutes,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def replay_pass(
+    user_id: str,
+    profile: Dict[str, Any],
+    metrics: List[Dict[str, Any]],
+    stored_docs: List[Dict[str, Any]],
+    now: datetime,
+) -> Dict[str, Any]:
+    """Chronological in-memory replay. Pure: no database access.
+
+    `metrics` are `metrics_doc` dicts in date order; `stored_docs` are the
+    user's stored days in the replayed range plus the CONSECUTIVE_DAYS_FOR_TREND
+    days before it. Returns the final daily documents, insights and profile.
+    """
+    profile = copy.deepcopy(profile)
+    profile.setdefault("baseline_metrics", {})
+    by_date: Dict[datetime, Dict[str, Any]] = {doc["date"]: doc for doc in stored_docs}
+    dates = sorted(by_date)
+    touched: Dict[datetime, Dict[str, Any]] = {}
+    insights: List[Dict[str, Any]] = []
+    activated_on = None
+    collected = False
+
+    for day_metrics in metrics:
+        day = day_metrics["date"]
+        i = bisect.bisect_left(dates, day)
+        recent_docs = [by_date[d] for d in reversed(dates[max(0, i - CONSECUTIVE_DAYS_FOR_TREND):i])]
+
+        previous = by_date.get(day)
+        doc = {k: v for k, v in {**(previous or {}), **day_metrics}.items() if k not in INTRADAY_FIELDS}
+        doc["_id"] = previous["_id"] if previous else ObjectId()
+        profile["baseline_metrics"].update(apply_metrics_change(
+            profile["baseline_metrics"],
+            held_sample(profile, previous),
+            doc,
+            fallback_count=profile.get("baseline_days_collected", 0),
+        ))
+        if previous is None:
+            dates.insert(i, day)
+        by_date[day] = touched[day] = doc
+
+        if profile.get("baseline_status") == "collecting":
+            collected = True
+            profile["baseline_days_collected"] = profile.get("baseline_days_collected", 0) + 1
+            if profile["baseline_days_collected"] >= BASELINE_DAYS_REQUIRED:
+                profile["baseline_status"] = "active"
+                activated_on = day
+
+        if profile.get("baseline_status") == "active":
+            result = score_day(user_id, profile, doc, recent_docs)
+            doc["deviation_flags"] = result["deviation_flags"]
+            doc["risk_score"] = result["risk_score"]
+            profile["risk_score"] = result["risk_score"]
+            # strictly increasing timestamps (ms, Mongo precision) keep the
+            # newest insight last when sorted by date
+            stamp = now + timedelta(milliseconds=len(insights))
+            result["insight"].update({"date": stamp, "created_at": stamp, "updated_at": stamp})
+            insights.append(result["insight"])
+
+    return {
+        "docs": [touched[d] for d in sorted(touched)],
+        "insights": insights,
+        "profile": profile,
+        "collected": collected,
+        "activated_on": activated_on,
+    }
+
+
+async def replay_history(db, user_id: str, payloads: List[MetricsCreate]) -> Optional[Dict[str, Any]]:
+    """Backfill a user's history in one pass and bulk write the results.
+
+    Returns a summary (with the final daily documents under ``docs`` and the
+    dates whose upsert failed under ``failed_dates``), or None when the user
+    has no health profile. Failed dates are left out of the replay, so the
+    profile and insights only reflect stored days.
+    """
+    now = datetime.utcnow()
+    # stable sort: several uploads of one day apply in the order given
+    metrics = [metrics_doc(user_id, p, now) for p in sorted(payloads, key=lambda p: p.date)]
+    if not metrics:
+        return {"days": 0, "insights": 0, "activated_on": None, "failed": 0, "docs": [], "failed_dates": set()}
+    start, end = metrics[0]["date"], metrics[-1]["date"]
+    await metrics_write_buffer.flush(user_id)
+
+    profile, in_range, before = await asyncio.gather(
+        db.health_profiles.find_one({"user_id": user_id}),
+        metrics_repository.find_days(db, user_id, date={"$gte": start, "$lte": end}),
+        metrics_repository.find_days(
+            db, user_id, date={"$lt": start}, sort=-1, limit=CONSECUTIVE_DAYS_FOR_TREND,
+        ),
+    )
+    if not profile:
+        return None
+
+    # the days go first: the baseline and insights are built only from days
+    # that were stored, re-planning without the dates whose upsert failed
+    failed_dates: Set[datetime] = set()
+    while True:
+        plan = await scoring_executor.run(replay_pass, user_id, profile, metrics, in_range + before, now)
+        failed = await _bulk_upsert(db, _daily_ops(user_id, plan["docs"]))
+        if not failed:
+            break
+        failed_dates.update(plan["docs"][i]["date"] for i in failed)
+        metrics = [m for m in metrics if m["date"] not in failed_dates]
+    final = plan["profile"]
+
+    # only the replayed signals: the rest of baseline_metrics may have been
+    # updated by other writes since `profile` was read
+    read = profile.get("baseline_metrics")
+    if read is None:
+        # nothing to keep (and a null field cannot take dotted paths)
+        profile_update: Dict[str, Any] = {"baseline_metrics": final["baseline_metrics"]}
+    else:
+        profile_update = {
+            f"baseline_metrics.{key}": stats
+            for key, stats in final["baseline_metrics"].items()
+            if read.get(key) != stats
+        }
+    profile_update["updated_at"] = now
+    if plan["collected"]:
+        profile_update["baseline_days_collected"] = final["baseline_days_collected"]
+        profile_update["baseline_status"] = final["baseline_status"]
+        profile_update["demo_mode"] = False
+    if plan["insights"]:
+        profile_update["risk_score"] = final["risk_score"]
+
+    writes = [db.health_profiles.update_one({"user_id": user_id}, {"$set": profile_update})]
+    if plan["insights"]:
+        writes.append(db.ai_insights.insert_many(plan["insights"]))
+    await asyncio.gather(*writes)
+    window_cache.invalidate(user_id)
+    await invalidate_snapshot(db, user_id)
+
+    activated_on = plan["activated_on"]
+    summary = {
+        "days": len(plan["docs"]),
+        "insights": len(plan["insights"]),
+        "baseline_status": final.get("baseline_status"),
+        "baseline_days_collected": final.get("baseline_days_collected", 0),
+        "activated_on": activated_on.date() if activated_on else None,
+        "risk_score": final.get("risk_score"),
+        "failed": len(failed_dates),
+    }
+    logger.info(f"replay_history: user={user_id} {summary}")
+    summary["docs"] = plan["docs"]
+    summary["failed_dates"] = failed_dates
+    return summary
+
+
+def _daily_ops(user_id: str, docs: List[Dict[str, Any]]) -> List[DayWrite]:
+    return [
+        DayWrite(
+            user_id,
+            doc["date"],
+            {
+                "$set": {k: v for k, v in doc.items() if k != "_id"},
+                "$setOnInsert": {"_id": doc["_id"]},
+                "$unset": {field: "" for field in INTRADAY_FIELDS},
+            },
+            upsert=True,
+        )
+        for doc in docs
+    ]
+
+
+async def _bulk_upsert(db, ops: List[DayWrite]) -> List[int]:
+    """Unordered bulk upsert; returns the positions in `ops` that failed."""
+    if not ops:
+        return []
+    try:
+        await metrics_repository.bulk_write(db, ops)
+    except BulkWriteError as exc:
+        logger.error(f"replay_history: {len(exc.details['writeErrors'])} daily upserts failed")
+        return [error["index"] for error in exc.details["writeErrors"]]
+    return []
@@ -0,0 +1,154 @@
+"""
+Robust (median / MAD) baseline over a sliding window of days.
+
+Used when ``settings.AI_MODEL_TYPE == "robust"``: a single outlier day (a
+tracker left on the charger, a marathon) barely moves the median, while it
+can drag the Welford mean/std far enough to hide or fake deviations.
+
+`SlidingWindow` keeps the last ``MAX_HISTORY_DAYS`` samples of one signal
+twice: in date order (two deques, so appending today and evicting the
+oldest day is O(1)) and in value order (a plain list kept sorted with
+`bisect.insort`, which shifts at most MAX_HISTORY_DAYS pointers). The median is
+read straight from the value order and the MAD is the k-th smallest of two
+already-sorted distance runs (values below and above the median), found
+with O(log n) lookups, so nothing is ever re-sorted.
+
+The window lives in the profile, so every ingest loads and re-serializes
+it: an update is O(n) in the window size (at most MAX_HISTORY_DAYS values)
+plus the profile write it rides on anyway.
+
+Stored inside the signal's ``baseline_metrics`` entry as:
+    "robust": {"dates": [...], "values": [...], "sorted": [...]}
+
+`baseline` returns ``{"mean": median, "std": 1.4826 * MAD}`` so the
+deviation and risk functions work unchanged.
+"""
+import bisect
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional
+
+# MAD -> standard deviation for normally distributed data
+MAD_SCALE = 1.4826
+
+# samples needed before the robust baseline replaces the running mean/std
+ROBUST_MIN_SAMPLES = 5
+
+
+def _kth_of_two(k: int, a_len: int, a: Callable[[int], float], b_len: int, b: Callable[[int], float]) -> float:
+    """k-th (0-based) smallest element of two ascending sequences."""
+    lo, hi = max(0, k + 1 - b_len), min(a_len, k + 1)
+    while True:
+        i = (lo + hi) // 2
+        j = k + 1 - i
+        if i < a_len and j > 0 and b(j - 1) > a(i):
+            lo = i + 1
+        elif i > 0 and j < b_len and a(i - 1) > b(j):
+            hi = i - 1
+        else:
+            return max(a(i - 1) if i > 0 else float("-inf"), b(j - 1) if j > 0 else float("-inf"))
+
+
+def median(values) -> float:
+    """Median of an ascending sequence."""
+    n = len(values)
+    mid = n // 2
+    if n % 2:
+        return float(values[mid])
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def mad(values) -> float:
+    """Median absolute deviation of an ascending sequence from its median."""
+    n = len(values)
+    m = median(values)
+    split = bisect.bisect_left(values, m)
+    # distances below the median, ascending, and above it, ascending
+    below = lambda i: m - values[split - 1 - i]  # noqa: E731
+    above = lambda i: values[split + i] - m  # noqa: E731
+    mid = n // 2
+    upper = _kth_of_two(mid, split, below, n - split, above)
+    if n % 2:
+        return upper
+    return (_kth_of_two(mid - 1, split, below, n - split, above) + upper) / 2.0
+
+
+def robust_stats(values) -> Optional[Dict[str, float]]:
+    """Median / scaled MAD of an ascending sequence, or None while it is too small."""
+    if len(values) < ROBUST_MIN_SAMPLES:
+        return None
+    return {"mean": median(values), "std": MAD_SCALE * mad(values)}
+
+
+def stored_baseline(entry: Optional[Dict[str, Any]]) -> Optional[Dict[str, float]]:
+    """`robust_stats` of the window stored in a baseline entry.
+
+    Reads the stored value order in place, so scoring never builds a window.
+    """
+    state = entry.get("robust") if isinstance(entry, dict) else None
+    return robust_stats((state or {}).get("sorted") or [])
+
+
+class SlidingWindow:
+    """Last `max_days` samples of one signal, in date and in value order."""
+
+    def __init__(self, max_days: int, dates: Iterable[datetime] = (), values: Iterable[float] = (),
+                 sorted_values: Optional[Iterable[float]] = None):
+        self.max_days = max_days
+        self.dates: Deque[datetime] = deque(dates)
+        self.values: Deque[float] = deque(values)
+        self.sorted: List[float] = list(sorted_values) if sorted_values is not None else sorted(self.values)
+
+    @classmethod
+    def from_entry(cls, entry: Optional[Dict[str, Any]], max_days: int) -> "SlidingWindow":
+        """Window stored in a baseline entry."""
+        state = entry.get("robust") if isinstance(entry, dict) else None
+        if not state:
+            return cls(max_days)
+        return cls(max_days, *(state.get(key) or [] for key in ("dates", "values", "sorted")))
+
+    def to_state(self) -> Dict[str, List[Any]]:
+        return {"dates": list(self.dates), "values": list(self.values), "sorted": self.sorted}
+
+    def __len__(self) -> int:
+        return len(self.sorted)
+
+    def remove(self, day: datetime) -> None:
+        """Drop the sample for `day`, if present."""
+        i = bisect.bisect_left(self.dates, day)
+        if i < len(self.dates) and self.dates[i] == day:
+            value = self.values[i]
+            del self.dates[i]
+            del self.values[i]
+            del self.sorted[bisect.bisect_left(self.sorted, value)]
+
+    def add(self, day: datetime, value: float) -> None:
+        """Insert (or replace) the sample for `day`, then evict old days."""
+        self.remove(day)
+        if not self.dates or day > self.dates[-1]:
+            self.dates.append(day)
+            self.values.append(value)
+        else:
+            # backfilled day: the only case that shifts the deques
+            i = bisect.bisect_left(self.dates, day)
+            self.dates.insert(i, day)
+            self.values.insert(i, value)
+        bisect.insort(self.sorted, value)
+        self._evict()
+
+    def _evict(self) -> None:
+        cutoff = self.dates[-1] - timedelta(days=self.max_days - 1)
+        while self.dates and self.dates[0] < cutoff:
+            self.dates.popleft()
+            del self.sorted[bisect.bisect_left(self.sorted, self.values.popleft())]
+
+    def median(self) -> float:
+        return median(self.sorted)
+
+    def mad(self) -> float:
+        """Median absolute deviation from the median."""
+        return mad(self.sorted)
+
+    def baseline(self) -> Optional[Dict[str, float]]:
+        """Median / scaled MAD, or None while the window is too small."""
+        return robust_stats(self.sorted)
@@ -0,0 +1,216 @@
+"""
+Incremental rollup of raw health samples into daily metrics.
+
+`store_health_samples` inserts per-minute samples into ``health`` and marks
+the user dirty in ``health_rollups`` (``_id`` = user_id). Every
+HEALTH_ROLLUP_TICK_SECONDS the scheduler rolls dirty users up:
+
+- samples are selected by ``_id`` between the user's high-water mark
+  (``last_id``) and a cutoff HEALTH_ROLLUP_LAG_SECONDS in the past, so
+  inserts still in flight are left for the next pass and every sample falls
+  in exactly one range
+- one ``$group`` per range sums each type per (UTC) day; ``sleep`` is a
+  running total, so it is re-summed over the whole day and applied with
+  ``$max``
+- each day goes through `apply_metrics_delta` like a device delta
+  (baseline, flags and risk stay in step), and is checkpointed in
+  ``pending.applied`` so a pass interrupted half way resumes without
+  counting a day twice; the mark only moves once the range is done
+- a lease on the rollup document keeps workers from rolling up the same
+  user concurrently
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from app.config.settings import settings
+from app.db.indexes import ensure_indexes
+from app.models.metrics_model import MetricsDelta
+from app.services.intraday_service import apply_metrics_delta
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = "health_rollups"
+# sample type -> MetricsDelta field
+SAMPLE_FIELDS = {
+    "steps": "steps",
+    "sedentary": "sedentary_minutes",
+    "screen_time": "screen_time_minutes",
+    "sleep": "sleep_duration_minutes",
+}
+RUNNING_TOTAL_TYPES = ("sleep",)
+
+
+async def ensure_rollup_indexes(db) -> None:
+    await ensure_indexes(db, collections=["health", ROLLUP_COLLECTION])
+
+
+def _cutoff(now: datetime) -> datetime:
+    # whole seconds: ObjectIds only carry seconds
+    return (now - timedelta(seconds=settings.HEALTH_ROLLUP_LAG_SECONDS)).replace(microsecond=0)
+
+
+async def _day_totals(db, user_id: str, after: Optional[ObjectId], upto: ObjectId) -> Dict[datetime, Dict[str, float]]:
+    """Per day and type: the sum of the samples in [after, upto)."""
+    ids: Dict[str, Any] = {"$lt": upto}
+    if after is not None:
+        ids["$gte"] = after
+    cursor = db.health.aggregate([
+        {"$match": {"user_id": user_id, "_id": ids, "type": {"$in": list(SAMPLE_FIELDS)}}},
+        {"$group": {
+            "_id": {"day": {"$dateTrunc": {"date": "$timestamp", "unit": "day"}}, "type": "$type"},
+            "total": {"$sum": "$value"},
+        }},
+    ])
+    totals: Dict[datetime, Dict[str, float]] = {}
+    for row in await cursor.to_list(length=None):
+        totals.setdefault(row["_id"]["day"], {})[row["_id"]["type"]] = row["total"]
+    return totals
+
+
+async def _running_totals(db, user_id: str, days: List[datetime], upto: ObjectId) -> Dict[datetime, Dict[str, float]]:
+    """Whole-day sums of the running-total types for `days`, up to the cutoff."""
+    cursor = db.health.aggregate([
+        {"$match": {
+            "user_id": user_id,
+            "_id": {"$lt": upto},
+            "type": {"$in": list(RUNNING_TOTAL_TYPES)},
+            "$or": [{"timestamp": {"$gte": day, "$lt": day + timedelta(days=1)}} for day in days],
+        }},
+        {"$group": {
+            "_id": {"day": {"$dateTrunc": {"date": "$timestamp", "unit": "day"}}, "type": "$type"},
+            "total": {"$sum": "$value"},
+        }},
+    ])
+    totals: Dict[datetime, Dict[str, float]] = {}
+    for row in await cursor.to_list(length=None):
+        totals.setdefault(row["_id"]["day"], {})[row["_id"]["type"]] = row["total"]
+    return totals
+
+
+def _delta(day: datetime, totals: Dict[str, float]) -> MetricsDelta:
+    fields = {SAMPLE_FIELDS[t]: round(v) for t, v in totals.items() if v and v > 0}
+    return MetricsDelta(date=date(day.year, day.month, day.day), **fields)
+
+
+async def acquire_rollup_lease(db, user_id: str, owner: str, now: datetime) -> Optional[Dict[str, Any]]:
+    """Take the user's rollup lease; returns the rollup state, or None if it is held."""
+    return await db[ROLLUP_COLLECTION].find_one_and_update(
+        {"_id": user_id, "$or": [{"lease_until": {"$lte": now}}, {"lease_until": None}, {"owner": owner}]},
+        {"$set": {"owner": owner, "lease_until": now + timedelta(seconds=settings.HEALTH_ROLLUP_LEASE_SECONDS)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def rollup_user_samples(db, user_id: str, owner: str, now: Optional[datetime] = None) -> Optional[int]:
+    """Roll the user's new samples into daily_metrics.
+
+    Returns the number of days updated, or None when another worker holds
+    the user's lease.
+    """
+    now = now or datetime.utcnow()
+    rollups = db[ROLLUP_COLLECTION]
+    state = await acquire_rollup_lease(db, user_id, owner, now)
+    if state is None:
+        return None
+    try:
+        pending = state.get("pending")
+        if not pending:
+            cutoff = _cutoff(now)
+            upto = ObjectId.from_datetime(cutoff)
+            if state.get("last_id") is not None and upto < state["last_id"]:
+                upto = state["last_id"]  # a worker with a slower clock: never move the mark back
+            pending = {"upto": upto, "cutoff": cutoff, "applied": []}
+            await rollups.update_one({"_id": user_id}, {"$set": {"pending": pending}})
+
+        totals = await _day_totals(db, user_id, state.get("last_id"), pending["upto"])
+        running_days = [day for day, types in totals.items() if any(t in types for t in RUNNING_TOTAL_TYPES)]
+        if running_days:
+            for day, types in (await _running_totals(db, user_id, running_days, pending["upto"])).items():
+                totals[day].update(types)
+
+        applied = set(pending.get("applied", []))
+        updated = 0
+        for day in sorted(totals):
+            delta = _delta(day, totals[day])
+            if day in applied or not delta.model_dump(exclude={"date", "close"}, exclude_defaults=True):
+                continue
+            await apply_metrics_delta(db, user_id, delta)
+            await rollups.update_one({"_id": user_id}, {"$push": {"pending.applied": day}})
+            updated += 1
+
+        await rollups.update_one(
+            {"_id": user_id},
+            {"$set": {"last_id": pending["upto"], "rolled_up_at": now}, "$unset": {"pending": ""}},
+        )
+        # samples stored after the cutoff keep the user dirty for the next pass
+        await rollups.update_one(
+            {"_id": user_id, "last_sample_at": {"$lt": pending["cutoff"]}},
+            {"$set": {"dirty": False}},
+        )
+        return updated
+    finally:
+        await rollups.update_one({"_id": user_id, "owner": owner}, {"$set": {"lease_until": None}})
+
+
+async def run_rollup_cycle(db, owner: str, limit: int = settings.HEALTH_ROLLUP_BATCH_SIZE) -> int:
+    """Roll up a batch of dirty users. Returns the number of days updated."""
+    now = datetime.utcnow()
+    # least recently rolled up first, so busy users do not starve the rest
+    cursor = db[ROLLUP_COLLECTION].find({"dirty": True}, {"_id": 1}).sort("rolled_up_at", 1).limit(limit)
+    updated = 0
+    for state in await cursor.to_list(length=None):
+        try:
+            updated += await rollup_user_samples(db, state["_id"], owner, now) or 0
+        except Exception as exc:
+            logger.error(f"sample rollup failed for {state['_id']}: {exc}")
+    if updated:
+        logger.info(f"sample rollup: {updated} days updated")
+    return updated
+
+
+class SampleRollupScheduler:
+    """Runs `run_rollup_cycle` every HEALTH_ROLLUP_TICK_SECONDS (0 = off)."""
+
+    def __init__(self, tick_seconds: float):
+        self.tick_seconds = tick_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, db) -> None:
+        if self._task is None and self.tick_seconds > 0:
+            self._task = asyncio.create_task(self._loop(db))
+
+    async def _loop(self, db) -> None:
+        try:
+            await ensure_rollup_indexes(db)
+        except Exception as exc:
+            logger.error(f"sample rollup: could not create indexes: {exc}")
+        await asyncio.sleep(random.uniform(0, self.tick_seconds))
+        while True:
+            try:
+                await run_rollup_cycle(db, self.owner)
+            except Exception as exc:
+                logger.error(f"sample rollup cycle failed: {exc}")
+            await asyncio.sleep(self.tick_seconds)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# singleton instance started from the app's startup hook
+sample_rollup_scheduler = SampleRollupScheduler(settings.HEALTH_ROLLUP_TICK_SECONDS)
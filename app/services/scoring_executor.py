@@ -0,0 +1,71 @@
+"""
+Process-pool offload for CPU-bound AI scoring.
+
+Scoring functions (`ai_pipeline.score_day`, `vector_engine.score_pairs`) are
+pure, so they can run in worker processes while the event loop keeps serving
+WebSocket pushes, auth and dashboard requests. Only Mongo I/O stays on the
+loop.
+
+`SCORING_PROCESSES` sizes the pool; 0 runs everything inline (useful for
+tests and single-core deployments). Large inputs are split into
+`SCORING_CHUNK_SIZE` batches that are scored in parallel.
+"""
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, List, Optional, Sequence
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ScoringExecutor:
+    def __init__(self, processes: int, chunk_size: int):
+        self.processes = processes
+        self.chunk_size = max(1, chunk_size)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.processes)
+        return self._pool
+
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        """Run a pure, picklable function off the event loop."""
+        if self.processes <= 0:
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_pool(), partial(fn, *args))
+        except BrokenProcessPool:
+            # a worker died (OOM, kill); start a fresh pool next time
+            logger.error("scoring pool broken; running inline and recreating pool")
+            self._pool = None
+            return fn(*args)
+
+    async def map_chunks(
+        self,
+        fn: Callable[[Sequence[Any]], List[Any]],
+        items: Sequence[Any],
+        chunk_size: Optional[int] = None,
+    ) -> List[Any]:
+        """Apply a list -> list function to `items` in parallel batches.
+
+        Result order matches `items`.
+        """
+        size = chunk_size or self.chunk_size
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        parts = await asyncio.gather(*(self.run(fn, chunk) for chunk in chunks))
+        return [result for part in parts for result in part]
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+# singleton instance used by services/jobs
+scoring_executor = ScoringExecutor(settings.SCORING_PROCESSES, settings.SCORING_CHUNK_SIZE)
@@ -1,5 +1,6 @@
 from typing import Any, Dict
 from bson import ObjectId
+from app.services.dashboard_service import snapshot_profile
 
 async def get_profile(db, user_id: str) -> Dict[str, Any]:
     import logging
@@ -47,6 +48,7 @@ async def update_profile(db, user_id: str, patch: Dict[str, Any]) -> Dict[str, A
             logging.info(f"fallback update result matched={result.matched_count} modified={result.modified_count}")
         except Exception as e2:
             logging.error(f"fallback update failed: {e2}")
+    await snapshot_profile(db, user_id, patch)
     updated = await get_profile(db, user_id)
     logging.info(f"user_service.update_profile returning {updated}")
     return updated
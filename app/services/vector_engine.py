@@ -0,0 +1,219 @@
+"""
+Vectorized deviation / risk engine.
+
+Holds a user's trailing window as a (days x signals) float array and
+computes z-scores, percent change, same-direction trend runs and the
+weighted, capped risk score for every day in one NumPy pass. A stacked
+(users x days x signals) batch is scored the same way, which is what the
+nightly rescoring job uses.
+
+Results are identical to `ai_service.evaluate_daily_deviations` +
+`ai_service.score_risk` applied day by day, where each day's trend window is
+the CONSECUTIVE_DAYS_FOR_TREND stored days before it. Baselines are resolved
+per row, so each day uses its weekday bucket when that bucket is dense.
+"""
+from datetime import date
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from app.services.ai_service import (
+    CONSECUTIVE_DAYS_FOR_TREND,
+    PERCENT_CHANGE_THRESHOLD,
+    SIGNAL_WEIGHTS,
+    Z_SCORE_THRESHOLD,
+)
+from app.services.baseline_service import SIGNAL_FIELDS, resolve_baseline, robust_mode, weekday_baseline
+
+# column order of every signal matrix
+SIGNAL_KEYS = list(SIGNAL_FIELDS)
+FIELD_NAMES = [SIGNAL_FIELDS[key] for key in SIGNAL_KEYS]
+WEIGHTS = np.array([SIGNAL_WEIGHTS.get(field, 0.0) for field in FIELD_NAMES])
+
+
+def docs_to_matrix(docs: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """daily_metrics docs (date ascending) -> (days x signals) array.
+
+    Missing/None values count as 0, like the scalar engine.
+    """
+    matrix = np.zeros((len(docs), len(SIGNAL_KEYS)))
+    for row, doc in enumerate(docs):
+        for col, field in enumerate(FIELD_NAMES):
+            value = doc.get(field)
+            if value is not None:
+                matrix[row, col] = value
+    return matrix
+
+
+def baseline_vectors(profile: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """Per-signal baseline arrays for one profile.
+
+    - mean / std: global baseline parameters (0 when missing); median /
+      scaled MAD in robust mode
+    - weekday_mean / weekday_std: (7 x signals) bucket baselines, falling
+      back to the global values while a bucket is sparse (or in robust mode)
+    - present: signal has a baseline entry
+    - enabled: signal is evaluated (active profile and enabled by the user)
+    """
+    baseline_metrics = profile.get("baseline_metrics") or {}
+    enabled_signals = profile.get("enabled_signals", {})
+    active = profile.get("baseline_status") == "active"
+    mean = np.zeros(len(SIGNAL_KEYS))
+    std = np.zeros(len(SIGNAL_KEYS))
+    present = np.zeros(len(SIGNAL_KEYS), dtype=bool)
+    enabled = np.zeros(len(SIGNAL_KEYS), dtype=bool)
+    for col, key in enumerate(SIGNAL_KEYS):
+        entry = baseline_metrics.get(key)
+        enabled[col] = active and enabled_signals.get(key, True)
+        if entry:
+            present[col] = True
+            resolved = resolve_baseline(entry)
+            mean[col] = resolved.get("mean", 0.0)
+            std[col] = resolved.get("std", 0.0)
+    weekday_mean = np.tile(mean, (7, 1))
+    weekday_std = np.tile(std, (7, 1))
+    weekday_keys = [] if robust_mode() else SIGNAL_KEYS
+    for col, key in enumerate(weekday_keys):
+        entry = baseline_metrics.get(key)
+        for weekday in range(7):
+            bucket = weekday_baseline(entry, weekday) if entry else None
+            if bucket is not None:
+                weekday_mean[weekday, col] = bucket["mean"]
+                weekday_std[weekday, col] = bucket["std"]
+    return {
+        "mean": mean,
+        "std": std,
+        "weekday_mean": weekday_mean,
+        "weekday_std": weekday_std,
+        "present": present,
+        "enabled": enabled,
+    }
+
+
+def row_baselines(base: Dict[str, np.ndarray], docs: Sequence[Dict[str, Any]]) -> tuple:
+    """(days x signals) mean/std arrays: each row uses its date's weekday."""
+    mean = np.tile(base["mean"], (len(docs), 1))
+    std = np.tile(base["std"], (len(docs), 1))
+    for row, doc in enumerate(docs):
+        day = doc.get("date")
+        if isinstance(day, date):
+            mean[row] = base["weekday_mean"][day.weekday()]
+            std[row] = base["weekday_std"][day.weekday()]
+    return mean, std
+
+
+def score_matrix(
+    values: np.ndarray,
+    mean: np.ndarray,
+    std: np.ndarray,
+    present: np.ndarray,
+    enabled: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """Score every day of a (..., days, signals) array.
+
+    `mean` / `std` are per-row baselines (..., days, signals); `present` and
+    `enabled` have shape (..., signals). NaN rows (batch padding) are never
+    deviated and never take part in a trend run.
+
+    Returns z, pct_change, flags (..., days, signals) and the unrounded
+    risk (..., days).
+    """
+    valid = (present & enabled)[..., np.newaxis, :]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(std > 0, (values - mean) / np.where(std > 0, std, 1.0), 0.0)
+        pct = np.where(mean > 0, (values - mean) / np.where(mean > 0, mean, 1.0) * 100.0, 0.0)
+    z = np.where(np.isnan(values), np.nan, z)
+    pct = np.where(np.isnan(values), np.nan, pct)
+
+    flags = (np.abs(z) > Z_SCORE_THRESHOLD) | (np.abs(pct) > PERCENT_CHANGE_THRESHOLD)
+
+    # trend: the N stored days before each day all deviate in one direction
+    n = CONSECUTIVE_DAYS_FOR_TREND
+    flags |= _preceding_run(z > Z_SCORE_THRESHOLD, n) | _preceding_run(z < -Z_SCORE_THRESHOLD, n)
+    flags &= valid
+
+    intensity = np.where(flags, np.minimum(3.0, np.abs(np.nan_to_num(z))), 0.0)
+    # accumulate signal by signal to keep the scalar engine's float order
+    total = np.zeros(values.shape[:-1])
+    for col in range(values.shape[-1]):
+        total = total + WEIGHTS[col] * intensity[..., col]
+    risk = np.minimum(100.0, total * 30)
+
+    return {"z": z, "pct_change": pct, "flags": flags, "risk": risk}
+
+
+def _preceding_run(hits: np.ndarray, n: int) -> np.ndarray:
+    """True where the n rows before each row (days axis) are all hits."""
+    days = hits.shape[-2]
+    counts = np.cumsum(hits, axis=-2, dtype=np.int64)
+    pad = np.zeros(hits.shape[:-2] + (1,) + hits.shape[-1:], dtype=np.int64)
+    counts = np.concatenate([pad, counts], axis=-2)
+    run = np.zeros(hits.shape, dtype=bool)
+    if days > n:
+        # hits in rows [t-n, t) == counts[t] - counts[t-n]
+        run[..., n:, :] = (counts[..., n:days, :] - counts[..., : days - n, :]) == n
+    return run
+
+
+def _results(profile: Dict[str, Any], scored: Dict[str, np.ndarray], rows) -> List[Dict[str, Any]]:
+    enabled = baseline_vectors(profile)["enabled"]
+    results = []
+    for row in rows:
+        flags = {
+            key: bool(scored["flags"][row, col])
+            for col, key in enumerate(SIGNAL_KEYS)
+            if enabled[col]
+        }
+        risk = round(float(scored["risk"][row]), 1)
+        results.append({"deviation_flags": flags, "risk_score": risk})
+    return results
+
+
+def score_user_window(profile: Dict[str, Any], docs: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Score every doc of one user's window (date ascending).
+
+    Returns one {"deviation_flags", "risk_score"} per doc.
+    """
+    base = baseline_vectors(profile)
+    mean, std = row_baselines(base, docs)
+    scored = score_matrix(docs_to_matrix(docs), mean, std, base["present"], base["enabled"])
+    return _results(profile, scored, range(len(docs)))
+
+
+def score_batch(
+    profiles: Sequence[Dict[str, Any]],
+    windows: Sequence[Sequence[Dict[str, Any]]],
+) -> List[List[Dict[str, Any]]]:
+    """Score many users at once as a stacked (users x days x signals) array.
+
+    Shorter windows are front-padded with NaN. Returns per-user lists of
+    per-doc results (date ascending), aligned with `windows`.
+    """
+    if not profiles:
+        return []
+    days = max((len(w) for w in windows), default=0)
+    shape = (len(profiles), days, len(SIGNAL_KEYS))
+    values = np.full(shape, np.nan)
+    mean = np.zeros(shape)
+    std = np.zeros(shape)
+    bases = [baseline_vectors(p) for p in profiles]
+    for u, (base, docs) in enumerate(zip(bases, windows)):
+        if docs:
+            values[u, days - len(docs):, :] = docs_to_matrix(docs)
+            mean[u, days - len(docs):, :], std[u, days - len(docs):, :] = row_baselines(base, docs)
+
+    present = np.stack([b["present"] for b in bases])
+    enabled = np.stack([b["enabled"] for b in bases])
+    scored = score_matrix(values, mean, std, present, enabled)
+
+    out = []
+    for u, (profile, docs) in enumerate(zip(profiles, windows)):
+        user_scored = {"flags": scored["flags"][u], "risk": scored["risk"][u]}
+        out.append(_results(profile, user_scored, range(days - len(docs), days)))
+    return out
+
+
+def score_pairs(pairs: Sequence[tuple]) -> List[List[Dict[str, Any]]]:
+    """`score_batch` over (profile, window) pairs; the process-pool entry point."""
+    return score_batch([profile for profile, _ in pairs], [window for _, window in pairs])
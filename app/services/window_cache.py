@@ -0,0 +1,152 @@
+"""
+Per-user trailing window cache.
+
+Trend checks (last CONSECUTIVE_DAYS_FOR_TREND days), the dashboard sparkline
+(last 7 days) and the dashboard report all read the newest few daily_metrics
+documents of a user. `WindowCache` keeps the newest WINDOW_CACHE_DAYS of them
+per user as compact column arrays in an in-process LRU:
+
+- a miss loads the window with one query; entries expire after
+  WINDOW_CACHE_TTL_SECONDS so writes made by other workers show up
+- `store_daily_metrics` applies every upsert to the cached window in place
+  (no re-query), and cancels any load in flight for that user so a stale
+  read is never cached
+- readers get None when the window cannot answer (e.g. a backfill day older
+  than the cached days) and fall back to querying Mongo
+"""
+import bisect
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import settings
+from app.services.baseline_service import SIGNAL_FIELDS
+from app.services.metrics_repository import metrics_repository
+from app.services.write_buffer import metrics_write_buffer
+
+WINDOW_FIELDS = tuple(SIGNAL_FIELDS.values()) + ("screen_time_minutes",)
+
+
+class TrailingWindow:
+    """Newest `size` daily documents of one user, oldest first, by column."""
+
+    def __init__(self, size: int, docs: List[Dict[str, Any]]):
+        self.size = size
+        ordered = sorted(docs, key=lambda d: d["date"])[-size:] if size else []
+        # fewer documents than `size` means the user has no older days
+        self.complete = len(docs) < size
+        self.dates: List[datetime] = [d["date"] for d in ordered]
+        self.columns: Dict[str, List[Any]] = {
+            field: [d.get(field) for d in ordered] for field in WINDOW_FIELDS
+        }
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def _doc(self, i: int) -> Dict[str, Any]:
+        doc = {field: column[i] for field, column in self.columns.items() if column[i] is not None}
+        doc["date"] = self.dates[i]
+        return doc
+
+    def _covers(self, day: datetime) -> bool:
+        """True when every stored day on or after `day` is in the window."""
+        return self.complete or (bool(self.dates) and self.dates[0] <= day)
+
+    def upsert(self, doc: Dict[str, Any]) -> None:
+        day = doc["date"]
+        i = bisect.bisect_left(self.dates, day)
+        if i < len(self.dates) and self.dates[i] == day:
+            for field, column in self.columns.items():
+                column[i] = doc.get(field)
+            return
+        if i == 0 and not self.complete and len(self.dates) >= self.size:
+            return  # older than anything the window holds
+        self.dates.insert(i, day)
+        for field, column in self.columns.items():
+            column.insert(i, doc.get(field))
+        if len(self.dates) > self.size:
+            del self.dates[0]
+            for column in self.columns.values():
+                del column[0]
+            self.complete = False
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        return self._doc(len(self.dates) - 1) if self.dates else None
+
+    def before(self, day: datetime, n: int) -> Optional[List[Dict[str, Any]]]:
+        """Up to `n` days before `day`, most recent first (None if not covered)."""
+        i = bisect.bisect_left(self.dates, day)
+        if i < n and not self.complete:
+            return None
+        return [self._doc(j) for j in range(i - 1, max(i - n, 0) - 1, -1)]
+
+    def since(self, start: datetime) -> Optional[List[Dict[str, Any]]]:
+        """Every day from `start` on, oldest first (None if not covered)."""
+        if not self._covers(start):
+            return None
+        i = bisect.bisect_left(self.dates, start)
+        return [self._doc(j) for j in range(i, len(self.dates))]
+
+
+class WindowCache:
+    def __init__(self, days: int, ttl_seconds: float, max_users: int):
+        self.days = days
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._loading: Dict[str, object] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, db, user_id: str) -> TrailingWindow:
+        entry = self._entries.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        token = object()
+        self._loading[user_id] = token
+        projection = {field: 1 for field in WINDOW_FIELDS}
+        projection["date"] = 1
+        docs = await metrics_repository.find_days(db, user_id, sort=-1, limit=self.days, projection=projection)
+        window = TrailingWindow(self.days, docs)
+        for doc in metrics_write_buffer.pending_docs(user_id):
+            window.upsert(doc)
+        if self._loading.get(user_id) is token:
+            del self._loading[user_id]
+            self._store(user_id, window)
+        return window
+
+    def _store(self, user_id: str, window: TrailingWindow) -> None:
+        if self.ttl_seconds <= 0 or self.max_users <= 0:
+            return
+        self._entries[user_id] = (time.monotonic(), window)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def apply(self, user_id: str, doc: Dict[str, Any]) -> None:
+        """Fold an upserted daily document into the cached window."""
+        self._loading.pop(user_id, None)
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry[1].upsert(doc)
+
+    def invalidate(self, user_id: str) -> None:
+        self._loading.pop(user_id, None)
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._loading.clear()
+        self.hits = self.misses = 0
+
+
+# singleton instance used by services
+window_cache = WindowCache(
+    settings.WINDOW_CACHE_DAYS,
+    settings.WINDOW_CACHE_TTL_SECONDS,
+    settings.WINDOW_CACHE_MAX_USERS,
+)
@@ -0,0 +1,266 @@
+"""
+Write-behind buffer for daily metrics upserts.
+
+Devices and the simulator re-post the same (user_id, date) document every
+few seconds. While the buffer runs, `store_daily_metrics` does not write
+each post: it merges the new values into a pending copy of the day, and all
+pending days are upserted together every METRICS_WRITE_BUFFER_SECONDS (or
+as soon as METRICS_WRITE_BUFFER_MAX_KEYS days are pending), one concurrent
+find-and-modify per day so each write returns the stored day it replaced.
+
+- the running baseline, the cached trailing window and the dashboard
+  snapshot are updated at flush time from those pre-images, so they only
+  ever hold values that were stored, and two processes writing the same day
+  each swap out exactly the value they replaced
+
+- reads go through the buffer: `get_daily_metrics`, `get_user_metrics_range`
+  and trailing window loads see pending values
+- later flag/risk updates of a pending day are merged into the same write
+- paths that write daily_metrics directly (replays, imports, intraday
+  deltas) flush the user's pending days first so writes stay in order
+- the app's shutdown hook flushes whatever is pending
+- days the server rejects (OperationFailure) are retried in the next
+  windows; after METRICS_WRITE_BUFFER_MAX_ATTEMPTS flushes they are stored
+  in ``metrics_dead_letters`` with the error instead of being dropped (they
+  never reached the baseline)
+
+Up to one window of posts can be lost if the process dies, and other
+workers only see a day once it is flushed. The buffer is off until
+`start` is called, so jobs and tests write through.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure
+
+from app.config.settings import settings
+from app.services.baseline_service import (
+    BASELINE_PROJECTION,
+    INTRADAY_FIELDS,
+    folded_sample,
+    update_running_baseline,
+)
+from app.services.metrics_repository import metrics_repository
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[str, datetime]
+
+DEAD_LETTERS = "metrics_dead_letters"
+
+
+class MetricsWriteBuffer:
+    def __init__(self, window_seconds: float, max_keys: int, max_attempts: int = 3):
+        self.window_seconds = window_seconds
+        self.max_keys = max(1, max_keys)
+        self.max_attempts = max(1, max_attempts)
+        # key -> {"doc": full document, "fields": fields to $set, "attempts": rejected flushes}
+        self._pending: Dict[Key, Dict[str, Any]] = {}
+        self._flushing: Dict[Key, Dict[str, Any]] = {}
+        self._keys_by_id: Dict[Any, Key] = {}
+        self._lock = asyncio.Lock()
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"puts": 0, "coalesced": 0, "flushes": 0, "writes": 0, "rejected": 0, "dead_lettered": 0}
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None
+
+    def start(self, db) -> None:
+        if self._task is None and self.window_seconds > 0:
+            self._db = db
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.window_seconds)
+            try:
+                await self.flush()
+            except Exception as exc:
+                logger.error(f"metrics write buffer: flush failed: {exc}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.flush()
+
+    def _entry(self, key: Key) -> Optional[Dict[str, Any]]:
+        return self._pending.get(key) or self._flushing.get(key)
+
+    def get(self, user_id: str, date_dt: datetime) -> Optional[Dict[str, Any]]:
+        """Pending (or in flight) version of a day, if any."""
+        entry = self._entry((user_id, date_dt))
+        return dict(entry["doc"]) if entry else None
+
+    def get_by_id(self, doc_id: Any) -> Optional[Dict[str, Any]]:
+        key = self._keys_by_id.get(doc_id)
+        return self.get(*key) if key else None
+
+    def pending_docs(self, user_id: str) -> List[Dict[str, Any]]:
+        """Every pending day of `user_id`, in date order."""
+        keys = {k for k in (*self._flushing, *self._pending) if k[0] == user_id}
+        return [self.get(*key) for key in sorted(keys)]
+
+    def overlay(self, user_id: str, docs: List[Dict[str, Any]], start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        """`docs` (stored days in [start, end]) with pending days merged in."""
+        pending = [d for d in self.pending_docs(user_id) if start <= d["date"] <= end]
+        if not pending:
+            return docs
+        by_date = {d["date"]: d for d in docs}
+        by_date.update((d["date"], d) for d in pending)
+        return [by_date[day] for day in sorted(by_date)]
+
+    def put(self, doc: Dict[str, Any], fields: Iterable[str]) -> None:
+        """Queue `doc` (the full new version of a day); `fields` are $set on flush."""
+        key = (doc["user_id"], doc["date"])
+        self.stats["puts"] += 1
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {"doc": {}, "fields": set()}
+        else:
+            self.stats["coalesced"] += 1
+        entry["doc"].update(doc)
+        entry["fields"].update(f for f in fields if f != "_id")
+        self._keys_by_id[doc["_id"]] = key
+        if len(self._pending) >= self.max_keys and not self._lock.locked():
+            asyncio.create_task(self.flush())
+
+    def _requeue(self, key: Key, entry: Dict[str, Any]) -> None:
+        """Put a day that was not written back (newer pending values win)."""
+        newer = self._pending.get(key)
+        if newer is not None:
+            entry["doc"].update(newer["doc"])
+            entry["fields"].update(newer["fields"])
+        self._pending[key] = entry
+
+    async def _reject(self, rejected: List[Tuple[Key, Dict[str, Any], OperationFailure]]) -> None:
+        """Retry the rejected days next window, or dead-letter them once out of attempts."""
+        dead = []
+        for key, entry, exc in rejected:
+            entry["attempts"] = entry.get("attempts", 0) + 1
+            self.stats["rejected"] += 1
+            if entry["attempts"] < self.max_attempts:
+                self._requeue(key, entry)
+                continue
+            dead.append({
+                "user_id": key[0],
+                "date": key[1],
+                "doc": entry["doc"],
+                "fields": sorted(entry["fields"]),
+                "attempts": entry["attempts"],
+                "error": {"code": exc.code, "errmsg": str(exc)},
+                "created_at": datetime.utcnow(),
+            })
+        logger.error(f"metrics write buffer: {len(rejected)} upserts rejected, {len(dead)} moved to {DEAD_LETTERS}")
+        if dead:
+            try:
+                await self._db[DEAD_LETTERS].insert_many(dead, ordered=False)
+                self.stats["dead_lettered"] += len(dead)
+            except Exception as dead_exc:
+                logger.error(f"metrics write buffer: could not store {len(dead)} dead letters: {dead_exc}")
+
+    async def _write(self, key: Key, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Upsert one day. Returns the stored day it replaced (None for a new day)."""
+        return await metrics_repository.find_and_update_day(
+            self._db, key[0], key[1],
+            {
+                "$set": {field: entry["doc"].get(field) for field in entry["fields"]},
+                "$setOnInsert": {"_id": entry["doc"]["_id"]},
+                "$unset": {field: "" for field in INTRADAY_FIELDS},
+            },
+            upsert=True,
+        )
+
+    async def _fold(self, user_id: str, written: List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]) -> None:
+        """Swap the written days of one user into the baseline, window and snapshot.
+
+        `written` holds (stored day, pre-image) pairs in date order.
+        """
+        # window_cache and dashboard_service read through this buffer
+        from app.services.dashboard_service import snapshot_metrics
+        from app.services.window_cache import window_cache
+
+        profile = await self._db.health_profiles.find_one({"user_id": user_id}, BASELINE_PROJECTION)
+        for doc, before in written:
+            if profile:
+                await update_running_baseline(self._db, user_id, folded_sample(before), doc, profile=profile)
+            window_cache.apply(user_id, doc)
+        await snapshot_metrics(self._db, user_id)
+
+    def update(self, doc_id: Any, fields: Dict[str, Any]) -> bool:
+        """Merge a `$set` into a pending day. False when the day is not buffered."""
+        key = self._keys_by_id.get(doc_id)
+        if key is None:
+            return False
+        if key not in self._pending:
+            # the day is being written right now: queue the change for the next flush
+            self._pending[key] = {"doc": dict(self._flushing[key]["doc"]), "fields": set()}
+        entry = self._pending[key]
+        entry["doc"].update(fields)
+        entry["fields"].update(fields)
+        return True
+
+    async def flush(self, user_id: Optional[str] = None) -> int:
+        """Upsert pending days (all, or only `user_id`'s). Returns days written."""
+        async with self._lock:
+            if user_id is None:
+                batch, self._pending = self._pending, {}
+            else:
+                batch = {k: self._pending.pop(k) for k in [k for k in self._pending if k[0] == user_id]}
+            if not batch:
+                return 0
+            self._flushing = batch
+            keys = list(batch)
+            outcomes = await asyncio.gather(*(self._write(key, batch[key]) for key in keys), return_exceptions=True)
+            written: Dict[str, List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]] = {}
+            rejected = []
+            failure: Optional[BaseException] = None
+            for key, outcome in zip(keys, outcomes):
+                entry = batch[key]
+                if isinstance(outcome, OperationFailure):
+                    rejected.append((key, entry, outcome))
+                elif isinstance(outcome, BaseException):
+                    # not written (connection lost, ...): retry next window
+                    self._requeue(key, entry)
+                    failure = failure or outcome
+                else:
+                    # what Mongo now holds: the pre-image with this write applied
+                    base = entry["doc"] if outcome is None else outcome
+                    stored = {k: v for k, v in base.items() if k not in INTRADAY_FIELDS}
+                    stored.update((field, entry["doc"].get(field)) for field in entry["fields"])
+                    written.setdefault(key[0], []).append((stored, outcome))
+            self._flushing = {}
+            for key, entry in batch.items():
+                if key not in self._pending:
+                    self._keys_by_id.pop(entry["doc"]["_id"], None)
+            if rejected:
+                await self._reject(rejected)
+            results = await asyncio.gather(
+                *(self._fold(user_id, sorted(days, key=lambda d: d[0]["date"])) for user_id, days in written.items()),
+                return_exceptions=True,
+            )
+            for user_id, result in zip(written, results):
+                if isinstance(result, BaseException):
+                    logger.error(f"metrics write buffer: baseline update for {user_id} failed: {result}")
+            self.stats["flushes"] += 1
+            count = sum(len(days) for days in written.values())
+            self.stats["writes"] += count
+            if failure is not None:
+                raise failure
+            return count
+
+
+# singleton instance started from the app's startup hook
+metrics_write_buffer = MetricsWriteBuffer(
+    settings.METRICS_WRITE_BUFFER_SECONDS,
+    settings.METRICS_WRITE_BUFFER_MAX_KEYS,
+    settings.METRICS_WRITE_BUFFER_MAX_ATTEMPTS,
+)
@@ -0,0 +1,160 @@
+"""
+Benchmark: /dashboard latency while a scoring storm is running.
+
+Serves the real dashboard router in-process (ASGI, in-memory DB stub) and
+polls GET /dashboard while many users' scoring work is pushed through the
+ScoringExecutor — once inline on the event loop (SCORING_PROCESSES=0) and once
+through the process pool. Prints p50/p99 dashboard latency for both.
+
+    python -m benchmarks.bench_dashboard_scoring_storm --users 400 --days 90 --processes 4
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from app import deps
+from app.api import dashboard_routes
+from app.db.client import get_database
+from app.services.ai_pipeline import score_day
+from app.services.scoring_executor import ScoringExecutor
+from app.services.vector_engine import score_pairs
+
+
+def _profile(rng):
+    return {
+        "user_id": "u",
+        "baseline_status": "active",
+        "enabled_signals": {},
+        "baseline_metrics": {
+            "steps": {"mean": 8000.0, "std": rng.uniform(500, 2500)},
+            "sleep": {"mean": 420.0, "std": rng.uniform(20, 60)},
+            "sedentary": {"mean": 500.0, "std": rng.uniform(40, 120)},
+            "location": {"mean": 40.0, "std": rng.uniform(5, 15)},
+            "active_minutes": {"mean": 30.0, "std": rng.uniform(5, 15)},
+        },
+    }
+
+
+def _window(rng, days):
+    start = datetime(2026, 1, 1)
+    return [{
+        "date": start + timedelta(days=i),
+        "steps": rng.randint(0, 16000),
+        "sleep_duration_minutes": rng.randint(200, 600),
+        "sedentary_minutes": rng.randint(200, 900),
+        "location_diversity_score": rng.uniform(0, 100),
+        "active_minutes": rng.randint(0, 90),
+    } for i in range(days)]
+
+
+class _Collection:
+    def __init__(self, doc, docs=()):
+        self._doc = doc
+        self._docs = list(docs)
+
+    async def find_one(self, *args, **kwargs):
+        await asyncio.sleep(0)
+        return self._doc
+
+    def find(self, *args, **kwargs):
+        return self
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, *args, **kwargs):
+        return self
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(0)
+        return self._docs
+
+
+class _DB:
+    def __init__(self, rng):
+        window = _window(rng, 7)
+        self.users = _Collection({"user_id": "bench", "name": "Bench"})
+        self.daily_metrics = _Collection(window[-1], window)
+        self.ai_insights = _Collection({"summary_message": "ok", "recommended_actions": [], "risk_score": 10.0})
+        self.health_profiles = _Collection({"goals": {}, "risk_score": 10.0})
+
+
+def _build_app(db) -> FastAPI:
+    app = FastAPI()
+    app.include_router(dashboard_routes.router)
+
+    async def _user():
+        return {"user_id": "bench"}
+
+    app.dependency_overrides[deps.get_current_user] = _user
+    app.dependency_overrides[get_database] = lambda: db
+    return app
+
+
+async def _storm(executor, rng, users, days):
+    """Ingest-style single-day scoring for every user plus a rescoring batch."""
+    pairs = [(_profile(rng), _window(rng, days)) for _ in range(users)]
+    ingest = [executor.run(score_day, "u", profile, window[-1], window[-4:-1][::-1]) for profile, window in pairs]
+    await asyncio.gather(executor.map_chunks(score_pairs, pairs), *ingest)
+
+
+async def _poll(client, stop, latencies):
+    while not stop.is_set():
+        started = time.perf_counter()
+        resp = await client.get("/dashboard")
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert resp.status_code == 200
+        await asyncio.sleep(0.002)
+
+
+async def _measure(processes, users, days, rounds):
+    rng = random.Random(42)
+    executor = ScoringExecutor(processes, chunk_size=max(1, users // max(1, processes * 2)))
+    latencies = []
+    stop = asyncio.Event()
+    transport = ASGITransport(app=_build_app(_DB(rng)))
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/dashboard")  # warm up
+        if processes:
+            await executor.run(score_pairs, [])  # start the pool outside the timing
+        poller = asyncio.create_task(_poll(client, stop, latencies))
+        started = time.perf_counter()
+        for _ in range(rounds):
+            await _storm(executor, rng, users, days)
+        storm_seconds = time.perf_counter() - started
+        stop.set()
+        await poller
+    executor.shutdown()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "storm_s": storm_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    for label, processes in (("inline", 0), (f"pool x{args.processes}", args.processes)):
+        res = asyncio.run(_measure(processes, args.users, args.days, args.rounds))
+        print(
+            f"{label:>10}: {res['requests']:5d} dashboard reqs  "
+            f"p50 {res['p50_ms']:8.2f} ms  p99 {res['p99_ms']:8.2f} ms  storm {res['storm_s']:.2f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
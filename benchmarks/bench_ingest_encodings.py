@@ -0,0 +1,128 @@
+"""
+Benchmark: metrics sync payload size and parse time per body encoding.
+
+Builds one `POST /metrics/batch` body per user (90 days x 1,000 users by
+default) in every format `body_decoding` accepts: JSON, MessagePack and CBOR,
+row- or column-oriented, plain or gzipped. Prints the bytes on the wire and
+the server-side time to decode the bodies and to decode + validate them into
+`MetricsCreate` models, relative to plain JSON rows.
+
+    python -m benchmarks.bench_ingest_encodings --users 1000 --days 90
+"""
+import argparse
+import gc
+import gzip
+import json
+import random
+import time
+import zlib
+from datetime import date, timedelta
+from typing import List
+
+from pydantic import TypeAdapter
+
+from app.middleware.body_decoding import decode_payload, expand_columns
+from app.models.metrics_model import MetricsCreate
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+_batch = TypeAdapter(List[MetricsCreate])
+
+
+def _rows(rng, days):
+    start = date(2026, 1, 1)
+    return [{
+        "date": (start + timedelta(days=i)).isoformat(),
+        "steps": rng.randint(0, 16000),
+        "sleep_duration_minutes": rng.randint(200, 600),
+        "sedentary_minutes": rng.randint(200, 900),
+        "location_diversity_score": round(rng.uniform(0, 100), 1),
+        "active_minutes": rng.randint(0, 90),
+        "screen_time_minutes": rng.randint(0, 600),
+    } for i in range(days)]
+
+
+def _columns(rows):
+    return {field: [r[field] for r in rows] for field in rows[0]}
+
+
+def _formats():
+    formats = [("json", "application/json", lambda v: json.dumps(v, separators=(",", ":")).encode())]
+    if msgpack is not None:
+        formats.append(("msgpack", "application/msgpack", msgpack.packb))
+    if cbor2 is not None:
+        formats.append(("cbor", "application/cbor", cbor2.dumps))
+    return formats
+
+
+def _decode(body, media_type, gzipped):
+    if gzipped:
+        # what DecodedBodyRequest.stream does, minus the chunking
+        body = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(body)
+    return expand_columns(decode_payload(body, media_type))
+
+
+def _measure(bodies, media_type, gzipped, repeat):
+    """Best of `repeat` runs, with the GC paused so it does not skew one format."""
+    best = None
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            decoded = [_decode(body, media_type, gzipped) for body in bodies]
+            decode_s = time.perf_counter() - started
+            started = time.perf_counter()
+            for payload in decoded:
+                _batch.validate_python(payload)
+            run = (decode_s, decode_s + time.perf_counter() - started)
+            best = run if best is None or run[1] < best[1] else best
+            del decoded
+            gc.collect()
+    finally:
+        gc.enable()
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    users = [_rows(rng, args.days) for _ in range(args.users)]
+    missing = [name for name, mod in (("msgpack", msgpack), ("cbor2", cbor2)) if mod is None]
+    if missing:
+        print(f"skipping {', '.join(missing)} (not installed)")
+    print(f"{args.users} users x {args.days} days = {args.users * args.days} rows")
+
+    baseline = None
+    for name, media_type, encode in _formats():
+        for layout in ("rows", "columns"):
+            payloads = users if layout == "rows" else [_columns(rows) for rows in users]
+            plain = [encode(p) for p in payloads]
+            for gzipped in (False, True):
+                bodies = [gzip.compress(b, compresslevel=6) for b in plain] if gzipped else plain
+                size = sum(len(b) for b in bodies)
+                decode_s, total_s = _measure(bodies, media_type, gzipped, args.repeat)
+                if baseline is None:
+                    baseline = (size, total_s)
+                label = f"{name} {layout}{' +gzip' if gzipped else ''}"
+                print(
+                    f"{label:>22}: {size / 1e6:8.2f} MB ({size / baseline[0]:5.1%})  "
+                    f"decode {decode_s * 1000:8.1f} ms  decode+validate {total_s * 1000:8.1f} ms "
+                    f"({total_s / baseline[1]:5.1%})"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark: flat vs monthly-bucket daily_metrics layout on a real MongoDB.
+
+Seeds `--users` users x `--days` days into a scratch database in both layouts
+(flat documents, then `migrate_metrics_buckets` into buckets), then reads a
+random user's trailing `--window` days through `metrics_repository` the way
+`get_user_metrics_range` and the AI pipeline do. Prints p50/p99 range-read
+latency, documents per read, and data/index size of each collection.
+
+    python -m benchmarks.bench_metrics_layout --users 10000
+    python -m benchmarks.bench_metrics_layout --users 100000 --reads 2000
+
+Needs a mongod at MONGODB_URI (or --uri); the scratch database is dropped
+first and left in place afterwards for inspection.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.config.settings import settings
+from app.jobs.migrate_metrics_buckets import run_migration
+from app.services.metrics_repository import BUCKET_COLLECTION, FlatLayout, MonthlyBucketLayout
+
+START = datetime(2026, 1, 1)
+
+
+def _day_doc(rng, user_id, day):
+    return {
+        "user_id": user_id,
+        "date": START + timedelta(days=day),
+        "steps": rng.randint(0, 16000),
+        "sleep_duration_minutes": rng.randint(200, 600),
+        "sedentary_minutes": rng.randint(200, 900),
+        "location_diversity_score": rng.uniform(0, 100),
+        "active_minutes": rng.randint(0, 90),
+        "screen_time_minutes": rng.randint(0, 600),
+        "deviation_flags": {"steps": False, "sleep": False},
+        "risk_score": rng.uniform(0, 40),
+        "created_at": START,
+        "updated_at": START,
+    }
+
+
+async def _seed(db, users, days, batch=20000):
+    rng = random.Random(42)
+    await db.daily_metrics.create_index([("user_id", 1), ("date", 1)])
+    docs = []
+    for u in range(users):
+        for d in range(days):
+            docs.append(_day_doc(rng, f"user-{u:06d}", d))
+            if len(docs) >= batch:
+                await db.daily_metrics.insert_many(docs, ordered=False)
+                docs = []
+    if docs:
+        await db.daily_metrics.insert_many(docs, ordered=False)
+
+
+async def _sizes(db, name):
+    stats = await db.command("collStats", name)
+    return stats["count"], stats["size"], stats["totalIndexSize"]
+
+
+async def _reads(db, layout, users, days, window, reads):
+    rng = random.Random(7)
+    end = START + timedelta(days=days - 1)
+    start = end - timedelta(days=window - 1)
+    latencies = []
+    for _ in range(reads):
+        user_id = f"user-{rng.randrange(users):06d}"
+        started = time.perf_counter()
+        docs = await layout.find_days(db, user_id, date={"$gte": start, "$lte": end})
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert len(docs) == window
+    latencies.sort()
+    return statistics.median(latencies), latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+
+
+async def _run(args):
+    client = AsyncIOMotorClient(args.uri)
+    db = client[args.database]
+    try:
+        await client.drop_database(args.database)
+        started = time.perf_counter()
+        await _seed(db, args.users, args.days)
+        print(f"seeded {args.users * args.days} flat days in {time.perf_counter() - started:.1f} s")
+        migration = await run_migration(db, chunk_size=20000)
+        print(f"migrated into {migration['buckets']} buckets in {migration['seconds']:.1f} s")
+
+        end = START + timedelta(days=args.days - 1)
+        start = end - timedelta(days=args.window - 1)
+        months = (end.year - start.year) * 12 + end.month - start.month + 1
+        for label, layout, collection, docs_per_read in (
+            ("flat", FlatLayout(), "daily_metrics", args.window),
+            ("monthly", MonthlyBucketLayout(), BUCKET_COLLECTION, months),
+        ):
+            await _reads(db, layout, args.users, args.days, args.window, 50)  # warm the cache
+            p50, p99 = await _reads(db, layout, args.users, args.days, args.window, args.reads)
+            count, size, index_size = await _sizes(db, collection)
+            print(
+                f"{label:>8}: {count:9d} docs  data {size / 2**20:8.1f} MiB  indexes {index_size / 2**20:7.1f} MiB  "
+                f"{args.window}-day read ~{docs_per_read} docs  p50 {p50:6.2f} ms  p99 {p99:6.2f} ms"
+            )
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--window", type=int, default=90)
+    parser.add_argument("--reads", type=int, default=1000)
+    parser.add_argument("--uri", default=settings.MONGODB_URI)
+    parser.add_argument("--database", default="bench_metrics_layout")
+    args = parser.parse_args()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmark: refresh_tokens / device_otps growth over a simulated month of logins.
+
+Replays `--days` days of `--users` users logging in `--logins` times a day
+(each login rotating its token `--rotations` times and one in ten asking for
+a device OTP) on a simulated clock, in two scratch databases:
+
+- legacy: what the auth paths wrote before expiry was enforced (login and
+  the controller each insert the token, rotations only flag `revoked`, OTPs
+  are kept after use)
+- ttl: one document per token with `expires_at`, revoked tokens kept for
+  REVOKED_TOKEN_RETENTION_HOURS, used OTPs expired, and
+  `compact_auth_tokens.run_compaction` run at the end of each simulated day
+
+Prints document count, data/index size and p50/p99 of the refresh lookup
+(``token_hash`` + ``revoked: False``) for each.
+
+    python -m benchmarks.bench_token_growth --users 2000
+    python -m benchmarks.bench_token_growth --users 20000 --days 60
+
+Needs a mongod at MONGODB_URI (or --uri); the scratch databases are dropped
+first and left in place afterwards for inspection.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.config.settings import settings
+from app.db.indexes import INDEXES, ensure_indexes
+from app.jobs.compact_auth_tokens import run_compaction
+from app.services.auth_service import refresh_token_expiry, revoked_token_expiry
+from app.utils.tokens import hash_token
+
+START = datetime(2026, 1, 1)
+COLLECTIONS = ("refresh_tokens", "device_otps")
+
+
+def _token(user_id, now, device_id=None, ttl=False):
+    doc = {"user_id": user_id, "token_hash": hash_token(uuid.uuid4().hex),
+           "device_id": device_id, "revoked": False, "created_at": now}
+    if ttl:
+        doc["expires_at"] = refresh_token_expiry(now)
+    return doc
+
+
+async def _simulate_day(db, rng, users, logins, rotations, day, ttl):
+    tokens, otps, revoked = [], [], []
+    for u in range(users):
+        user_id = f"user-{u:06d}"
+        for i in range(logins):
+            now = START + timedelta(days=day, minutes=rng.randrange(24 * 60))
+            device_id = f"device-{u:06d}-{i % 2}"
+            if ttl:
+                chain = [_token(user_id, now, device_id, ttl=True)]
+            else:
+                chain = [_token(user_id, now), _token(user_id, now, device_id)]
+            for r in range(rotations):
+                chain.append(_token(user_id, now + timedelta(hours=r + 1), device_id, ttl=ttl))
+            revoked.extend(doc["token_hash"] for doc in chain[:-1])
+            tokens.extend(chain)
+            if rng.random() < 0.1:
+                otp = {"user_id": user_id, "device_id": device_id, "otp_hash": hash_token(str(rng.random())),
+                       "expires_at": now + timedelta(minutes=settings.DEVICE_OTP_TTL_MINUTES), "used": True}
+                if ttl:
+                    otp["expires_at"] = now
+                otps.append(otp)
+    await db.refresh_tokens.insert_many(tokens, ordered=False)
+    if otps:
+        await db.device_otps.insert_many(otps, ordered=False)
+    for i in range(0, len(revoked), 1000):
+        update = {"$set": {"revoked": True}}
+        if ttl:
+            # revoked around midday on the simulated clock
+            update["$min"] = {"expires_at": revoked_token_expiry(START + timedelta(days=day, hours=12))}
+        await db.refresh_tokens.update_many({"token_hash": {"$in": revoked[i:i + 1000]}}, update)
+    return tokens
+
+
+async def _sizes(db):
+    count = size = index_size = 0
+    for name in COLLECTIONS:
+        stats = await db.command("collStats", name)
+        count += stats["count"]
+        size += stats["size"]
+        index_size += stats["totalIndexSize"]
+    return count, size, index_size
+
+
+async def _lookups(db, hashes, reads):
+    rng = random.Random(7)
+    latencies = []
+    for _ in range(reads):
+        started = time.perf_counter()
+        await db.refresh_tokens.find_one({"token_hash": rng.choice(hashes), "revoked": False})
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+
+
+async def _run(args):
+    client = AsyncIOMotorClient(args.uri)
+    try:
+        for label, ttl in (("legacy", False), ("ttl", True)):
+            name = f"{args.database}_{label}"
+            await client.drop_database(name)
+            db = client[name]
+            # the legacy run gets the lookup indexes only, not the TTL ones
+            specs = [spec for spec in INDEXES if spec.collection in COLLECTIONS
+                     and (ttl or "expireAfterSeconds" not in (spec.options or {}))]
+            await ensure_indexes(db, specs)
+            rng = random.Random(42)
+            started = time.perf_counter()
+            live = []
+            for day in range(args.days):
+                live = await _simulate_day(db, rng, args.users, args.logins, args.rotations, day, ttl)
+                if ttl:
+                    await run_compaction(db, now=START + timedelta(days=day + 1))
+            elapsed = time.perf_counter() - started
+            hashes = [doc["token_hash"] for doc in live]
+            await _lookups(db, hashes, 50)  # warm the cache
+            p50, p99 = await _lookups(db, hashes, args.reads)
+            count, size, index_size = await _sizes(db)
+            print(
+                f"{label:>7}: {count:9d} docs  data {size / 2**20:8.1f} MiB  indexes {index_size / 2**20:7.1f} MiB  "
+                f"lookup p50 {p50:6.2f} ms  p99 {p99:6.2f} ms  ({elapsed:.1f} s to simulate)"
+            )
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--logins", type=int, default=2)
+    parser.add_argument("--rotations", type=int, default=3)
+    parser.add_argument("--reads", type=int, default=1000)
+    parser.add_argument("--uri", default=settings.MONGODB_URI)
+    parser.add_argument("--database", default="bench_token_growth")
+    args = parser.parse_args()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
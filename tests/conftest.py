@@ -0,0 +1,14 @@
+import pytest
+
+from app.services.dashboard_cache import dashboard_cache
+from app.services.window_cache import window_cache
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    # the caches are process-wide and keyed by user_id; tests reuse user ids
+    window_cache.clear()
+    dashboard_cache.clear()
+    yield
+    window_cache.clear()
+    dashboard_cache.clear()
@@ -0,0 +1,454 @@
+"""
+In-memory stand-ins for the Motor database and collections the services use.
+
+`FakeDB` creates a `FakeCollection` on first access (``db.name`` or
+``db["name"]``), like MongoDB. The collections implement the subset of the
+query language the app relies on: dotted paths, implicit array matching,
+``$or`` and the comparison operators, ``$set``/``$unset``/``$inc``/``$min``/
+``$max``/``$push``/``$setOnInsert`` updates, pipeline updates built from
+``$ifNull``/``$literal``/``$add``, projections (including ``$slice``),
+unique ``_id`` (and optional unique keys) and ``bulk_write`` with
+``BulkWriteError`` reporting. ``calls`` counts every public method call.
+
+Tests subclass `FakeCollection` for behaviour specific to one test (failures,
+delays, aggregation pipelines).
+"""
+import copy
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+MISSING = object()
+
+
+def get_path(doc: Any, path: str) -> Any:
+    """The value at a dotted path; a list of values when it crosses an array."""
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, list):
+            if not part.isdigit():
+                return [item.get(part, MISSING) for item in value if isinstance(item, dict)]
+            value = value[int(part)] if int(part) < len(value) else MISSING
+        elif isinstance(value, dict):
+            value = value.get(part, MISSING)
+        else:
+            return MISSING
+    return value
+
+
+def set_path(doc: Dict[str, Any], path: str, value: Any) -> None:
+    *parents, leaf = path.split(".")
+    target = doc
+    for part in parents:
+        target = target[int(part)] if isinstance(target, list) else target.setdefault(part, {})
+    if isinstance(target, list):
+        target[int(leaf)] = copy.deepcopy(value)
+    else:
+        target[leaf] = copy.deepcopy(value)
+
+
+def unset_path(doc: Dict[str, Any], path: str) -> None:
+    *parents, leaf = path.split(".")
+    target = get_path(doc, ".".join(parents)) if parents else doc
+    if isinstance(target, dict):
+        target.pop(leaf, None)
+
+
+def _sort_key(value: Any) -> Tuple:
+    # MongoDB orders missing and null before any value
+    return (0,) if value is MISSING or value is None else (1, value)
+
+
+def match_value(value: Any, cond: Any) -> bool:
+    if not isinstance(cond, dict) or not any(k.startswith("$") for k in cond):
+        if cond is None:
+            return value is MISSING or value is None
+        return value == cond or (isinstance(value, list) and cond in value)
+    present = value is not MISSING and value is not None
+    for op, arg in cond.items():
+        if op == "$in":
+            ok = value in arg or (value is MISSING and None in arg)
+        elif op == "$nin":
+            ok = value not in arg
+        elif op == "$ne":
+            ok = not match_value(value, arg)
+        elif op == "$exists":
+            ok = (value is not MISSING) == bool(arg)
+        elif op in ("$lt", "$lte", "$gt", "$gte"):
+            ok = present and arg is not None and {
+                "$lt": lambda: value < arg,
+                "$lte": lambda: value <= arg,
+                "$gt": lambda: value > arg,
+                "$gte": lambda: value >= arg,
+            }[op]()
+        else:
+            raise NotImplementedError(f"query operator {op}")
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    for path, cond in (query or {}).items():
+        if path == "$or":
+            if not any(matches(doc, sub) for sub in cond):
+                return False
+            continue
+        if path == "$and":
+            if not all(matches(doc, sub) for sub in cond):
+                return False
+            continue
+        value = get_path(doc, path)
+        # a path through an array matches when any element does
+        values = value if isinstance(value, list) and "." in path else [value]
+        if not any(match_value(v, cond) for v in values):
+            return False
+    return True
+
+
+def _evaluate(doc: Dict[str, Any], expr: Any) -> Any:
+    """The aggregation expressions used by pipeline updates."""
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = get_path(doc, expr[1:])
+        return None if value is MISSING else copy.deepcopy(value)
+    if isinstance(expr, dict):
+        if "$literal" in expr:
+            return copy.deepcopy(expr["$literal"])
+        if "$ifNull" in expr:
+            for option in expr["$ifNull"]:
+                value = _evaluate(doc, option)
+                if value is not None:
+                    return value
+            return None
+        if "$add" in expr:
+            terms = [_evaluate(doc, t) for t in expr["$add"]]
+            base = next((t for t in terms if isinstance(t, datetime)), None)
+            if base is not None:
+                ms = sum(t for t in terms if not isinstance(t, datetime))
+                return base + timedelta(milliseconds=ms)
+            return sum(terms)
+        return {k: _evaluate(doc, v) for k, v in expr.items()}
+    return copy.deepcopy(expr)
+
+
+def apply_update(doc: Dict[str, Any], update: Any) -> None:
+    if isinstance(update, list):
+        for stage in update:
+            for path, expr in stage["$set"].items():
+                set_path(doc, path, _evaluate(doc, expr))
+        return
+    for path in update.get("$inc", {}):
+        if get_path(doc, path) is None:
+            raise OperationFailure("Cannot apply $inc to a value of non-numeric type null", code=14)
+    for path, value in update.get("$set", {}).items():
+        set_path(doc, path, value)
+    for path in update.get("$unset", {}):
+        unset_path(doc, path)
+    for path, amount in update.get("$inc", {}).items():
+        current = get_path(doc, path)
+        set_path(doc, path, (0 if current is MISSING else current) + amount)
+    for op, pick in (("$max", max), ("$min", min)):
+        for path, value in update.get(op, {}).items():
+            current = get_path(doc, path)
+            set_path(doc, path, value if current in (MISSING, None) else pick(current, value))
+    for path, value in update.get("$push", {}).items():
+        current = get_path(doc, path)
+        set_path(doc, path, (current if isinstance(current, list) else []) + [value])
+
+
+def project(doc: Optional[Dict[str, Any]], projection: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if doc is None:
+        return None
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    for path, spec in projection.items():
+        if isinstance(spec, dict) and "$slice" in spec:
+            start, n = spec["$slice"]
+            set_path(doc, path, get_path(doc, path)[start:start + n])
+    fields = {k: v for k, v in projection.items() if k != "_id" and not isinstance(v, dict)}
+    if any(fields.values()):
+        kept: Dict[str, Any] = {}
+        if projection.get("_id", 1) and "_id" in doc:
+            kept["_id"] = doc["_id"]
+        for path in [*fields, *(k for k, v in projection.items() if isinstance(v, dict))]:
+            value = get_path(doc, path)
+            if isinstance(value, list) and "." in path:
+                # projecting into an array: keep the whole top-level field
+                path = path.split(".")[0]
+                value = doc.get(path, MISSING)
+            if value is not MISSING:
+                set_path(kept, path, value)
+        return kept
+    for path, spec in projection.items():
+        if not isinstance(spec, dict) and not spec:
+            unset_path(doc, path)
+    return doc
+
+
+class Result:
+    """What Motor returns from writes (the attributes the app reads)."""
+
+    def __init__(self, matched_count=0, modified_count=None, upserted_id=None, inserted_id=None,
+                 deleted_count=0, inserted_count=0, upserted_count=0):
+        self.matched_count = matched_count
+        self.modified_count = matched_count if modified_count is None else modified_count
+        self.upserted_id = upserted_id
+        self.inserted_id = inserted_id
+        self.deleted_count = deleted_count
+        self.inserted_count = inserted_count
+        self.upserted_count = upserted_count
+        self.acknowledged = True
+
+
+class FakeCursor:
+    def __init__(self, items: List[Dict[str, Any]]):
+        self._items = items
+
+    def sort(self, key, direction=None):
+        keys = key if isinstance(key, list) else [(key, direction or 1)]
+        for k, d in reversed(keys):
+            self._items.sort(key=lambda doc: _sort_key(get_path(doc, k)), reverse=d == -1)
+        return self
+
+    def skip(self, n):
+        self._items = self._items[n:]
+        return self
+
+    def limit(self, n):
+        if n:
+            self._items = self._items[:n]
+        return self
+
+    async def to_list(self, length=None):
+        return self._items if length is None else self._items[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for item in self._items:
+            yield item
+
+
+class FakeCollection:
+    def __init__(self, docs: Optional[Iterable[Dict[str, Any]]] = None, unique: Sequence[Sequence[str]] = ()):
+        self.docs: List[Dict[str, Any]] = list(docs or [])
+        for doc in self.docs:
+            doc.setdefault("_id", ObjectId())
+        # field tuples with a unique index besides _id
+        self.unique = [tuple(keys) for keys in unique]
+        self.calls: Counter = Counter()
+
+    # reads
+
+    def _first(self, q, sort=None) -> Optional[Dict[str, Any]]:
+        hits = [d for d in self.docs if matches(d, q)]
+        if sort:
+            hits = FakeCursor(hits).sort(sort)._items
+        return hits[0] if hits else None
+
+    def find(self, q=None, projection=None, sort=None, limit=0):
+        self.calls["find"] += 1
+        cursor = FakeCursor([project(d, projection) for d in self.docs if matches(d, q)])
+        if sort:
+            cursor.sort(sort)
+        return cursor.limit(limit)
+
+    async def find_one(self, q=None, projection=None, sort=None):
+        self.calls["find_one"] += 1
+        return project(self._first(q, sort), projection)
+
+    async def count_documents(self, q):
+        self.calls["count_documents"] += 1
+        return sum(1 for d in self.docs if matches(d, q))
+
+    # writes
+
+    def _check_unique(self, doc: Dict[str, Any], ignore: Optional[Dict[str, Any]] = None) -> None:
+        for other in self.docs:
+            if other is ignore:
+                continue
+            if doc.get("_id") is not None and other.get("_id") == doc["_id"]:
+                raise DuplicateKeyError(f"E11000 duplicate key _id: {doc.get('_id')!r}", code=11000)
+            for keys in self.unique:
+                if all(other.get(k) == doc.get(k) for k in keys):
+                    raise DuplicateKeyError(f"E11000 duplicate key {keys}", code=11000)
+
+    def _insert(self, doc: Dict[str, Any]) -> Any:
+        # pymongo adds the _id to the caller's document
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self.docs.append(copy.deepcopy(doc))
+        return doc["_id"]
+
+    def _upsert(self, q: Dict[str, Any], update: Any) -> Dict[str, Any]:
+        doc: Dict[str, Any] = {}
+        for path, value in q.items():
+            if not path.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value)):
+                set_path(doc, path, value)
+        if isinstance(update, dict):
+            for path, value in update.get("$setOnInsert", {}).items():
+                set_path(doc, path, value)
+        apply_update(doc, update)
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self.docs.append(doc)
+        return doc
+
+    def _update(self, q, update, upsert=False, many=False) -> Result:
+        hits = [d for d in self.docs if matches(d, q)]
+        if not many:
+            hits = hits[:1]
+        if not hits:
+            if not upsert:
+                return Result(0)
+            return Result(0, upserted_id=self._upsert(q, update)["_id"])
+        for doc in hits:
+            apply_update(doc, update)
+            self._check_unique(doc, ignore=doc)
+        return Result(len(hits))
+
+    async def insert_one(self, doc):
+        self.calls["insert_one"] += 1
+        return Result(inserted_id=self._insert(doc), inserted_count=1)
+
+    async def insert_many(self, docs, ordered=True):
+        self.calls["insert_many"] += 1
+        result = await self.bulk_write([InsertOne(doc) for doc in docs], ordered=ordered)
+        for doc, op in zip(docs, result.ops):
+            doc.setdefault("_id", op._doc.get("_id"))
+        return result
+
+    async def update_one(self, q, update, upsert=False):
+        self.calls["update_one"] += 1
+        return self._update(q, update, upsert=upsert)
+
+    async def update_many(self, q, update, upsert=False):
+        self.calls["update_many"] += 1
+        return self._update(q, update, upsert=upsert, many=True)
+
+    async def replace_one(self, q, replacement, upsert=False):
+        self.calls["replace_one"] += 1
+        doc = self._first(q)
+        if doc is None:
+            if not upsert:
+                return Result(0)
+            return Result(0, upserted_id=self._insert(dict(replacement)))
+        keep = doc.get("_id")
+        doc.clear()
+        doc.update(copy.deepcopy(replacement))
+        doc["_id"] = keep
+        return Result(1)
+
+    async def find_one_and_update(self, q, update, projection=None, upsert=False, return_document=False,
+                                  sort=None):
+        self.calls["find_one_and_update"] += 1
+        doc = self._first(q, sort)
+        before = copy.deepcopy(doc)
+        if doc is None:
+            if not upsert:
+                return None
+            doc = self._upsert(q, update)
+        else:
+            apply_update(doc, update)
+        # ReturnDocument.AFTER is True
+        return project(doc if return_document is True else before, projection)
+
+    async def delete_one(self, q):
+        self.calls["delete_one"] += 1
+        doc = self._first(q)
+        if doc is None:
+            return Result(deleted_count=0)
+        self.docs.remove(doc)
+        return Result(deleted_count=1)
+
+    async def delete_many(self, q):
+        self.calls["delete_many"] += 1
+        before = len(self.docs)
+        self.docs = [d for d in self.docs if not matches(d, q)]
+        return Result(deleted_count=before - len(self.docs))
+
+    async def bulk_write(self, ops, ordered=True):
+        self.calls["bulk_write"] += 1
+        result = Result()
+        result.ops = list(ops)
+        errors: List[Dict[str, Any]] = []
+        for index, op in enumerate(result.ops):
+            try:
+                if isinstance(op, InsertOne):
+                    self._insert(op._doc)
+                    result.inserted_count += 1
+                elif isinstance(op, (UpdateOne, UpdateMany)):
+                    outcome = self._update(op._filter, op._doc, upsert=bool(op._upsert),
+                                           many=isinstance(op, UpdateMany))
+                    result.matched_count += outcome.matched_count
+                    result.modified_count += outcome.modified_count
+                    result.upserted_count += outcome.upserted_id is not None
+                elif isinstance(op, ReplaceOne):
+                    outcome = await self.replace_one(op._filter, op._doc, upsert=bool(op._upsert))
+                    result.matched_count += outcome.matched_count
+                elif isinstance(op, (DeleteOne, DeleteMany)):
+                    outcome = await (self.delete_many if isinstance(op, DeleteMany) else self.delete_one)(op._filter)
+                    result.deleted_count += outcome.deleted_count
+                else:
+                    raise NotImplementedError(type(op).__name__)
+            except DuplicateKeyError as exc:
+                errors.append({"index": index, "code": 11000, "errmsg": str(exc), "op": op._doc})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors,
+                "writeConcernErrors": [],
+                "nInserted": result.inserted_count,
+                "nUpserted": result.upserted_count,
+                "nMatched": result.matched_count,
+                "nModified": result.modified_count,
+                "nRemoved": result.deleted_count,
+                "upserted": [],
+            })
+        return result
+
+    # admin
+
+    async def create_index(self, keys, **kwargs):
+        self.calls["create_index"] += 1
+        return kwargs.get("name") or "_".join(f"{k}_{d}" for k, d in (keys if isinstance(keys, list) else [(keys, 1)]))
+
+    async def create_indexes(self, indexes):
+        self.calls["create_indexes"] += 1
+        return [getattr(index, "document", {}).get("name") for index in indexes]
+
+
+class FakeDB:
+    """Collections are created on first use; pass some in to seed or replace them."""
+
+    def __init__(self, **collections: FakeCollection):
+        self.__dict__.update(collections)
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        collection = FakeCollection()
+        setattr(self, name, collection)
+        return collection
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        return getattr(self, name)
+
+
+def profile_doc(user_id: str = "u1", status: str = "collecting", collected: int = 0, **fields) -> Dict[str, Any]:
+    """A health profile as `create_health_profile` stores it."""
+    return {
+        "user_id": user_id,
+        "baseline_status": status,
+        "baseline_days_collected": collected,
+        "enabled_signals": {"location": False},
+        "baseline_metrics": {},
+        **fields,
+    }
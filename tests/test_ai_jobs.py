@@ -0,0 +1,246 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app.models.metrics_model import MetricsCreate
+from app.services import ai_jobs
+from app.services.ai_jobs import AIJobQueue, ai_job_queue, get_job
+from app.services.metrics_service import ingest_metrics
+
+from fakes import FakeCollection, FakeDB, profile_doc
+
+
+def _db(status="collecting", collected=0):
+    return FakeDB(health_profiles=FakeCollection([profile_doc(status=status, collected=collected)]))
+
+
+async def _drain(db, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while any(j["status"] in ("queued", "running") for j in db.ai_jobs.docs):
+        assert loop.time() < deadline, "jobs did not finish"
+        await asyncio.sleep(0.005)
+
+
+def _payload(day, steps):
+    return MetricsCreate(date=day, steps=steps, sleep_duration_minutes=420, sedentary_minutes=500,
+                         location_diversity_score=40.0, active_minutes=30, screen_time_minutes=100)
+
+
+@pytest.mark.asyncio
+async def test_ingest_enqueues_and_job_reports_insight():
+    db = _db()
+    start = date(2026, 1, 1)
+    ai_job_queue.start(db)
+    try:
+        for i in range(14):
+            result = await ingest_metrics(db, "u1", _payload(start + timedelta(days=i), 8000 + 50 * (i % 3)))
+            assert "deviation_flags" not in result and result["ai_job_id"]
+        result = await ingest_metrics(db, "u1", _payload(start + timedelta(days=14), 1500))
+        await _drain(db)
+    finally:
+        await ai_job_queue.stop()
+
+    profile = db.health_profiles.docs[0]
+    assert (profile["baseline_status"], profile["baseline_days_collected"]) == ("active", 14)
+    job = await get_job(db, "u1", result["ai_job_id"])
+    assert job["status"] == "done" and job["attempts"] == 1
+    assert job["deviation_flags"]["steps"] is True
+    assert job["insight"]["risk_score"] == job["risk_score"] > 0
+    # other users cannot read the job
+    assert await get_job(db, "u2", result["ai_job_id"]) is None
+
+
+@pytest.mark.asyncio
+async def test_jobs_of_one_user_never_overlap(monkeypatch):
+    running = {}
+    peak = {"total": 0}
+    order = []
+
+    async def fake_run(db, job):
+        user = job["user_id"]
+        running[user] = running.get(user, 0) + 1
+        assert running[user] == 1
+        peak["total"] = max(peak["total"], sum(running.values()))
+        await asyncio.sleep(0.01)
+        order.append((user, job["date"].day))
+        running[user] -= 1
+        return {"status": "done"}
+
+    monkeypatch.setattr(ai_jobs, "run_ai_job", fake_run)
+    db = _db()
+    queue = AIJobQueue(workers=4, max_pending=100, lease_seconds=60, sweep_seconds=60)
+    queue.start(db)
+    try:
+        for day in range(1, 5):
+            for user in ("u1", "u2", "u3"):
+                await queue.enqueue(db, user, date(2026, 1, day))
+        await _drain(db)
+    finally:
+        await queue.stop()
+
+    assert peak["total"] > 1
+    for user in ("u1", "u2", "u3"):
+        assert [d for u, d in order if u == user] == [1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_overflow_and_expired_leases_are_swept(monkeypatch):
+    async def fake_run(db, job):
+        return {"status": "done"}
+
+    monkeypatch.setattr(ai_jobs, "run_ai_job", fake_run)
+    db = _db()
+    # a job left running by a dead worker
+    stale = datetime.utcnow() - timedelta(minutes=10)
+    db.ai_jobs.docs.append({"_id": "dead", "user_id": "u9", "date": datetime(2026, 1, 1), "status": "running",
+                            "attempts": 1, "lease_until": stale, "created_at": stale, "updated_at": stale})
+    queue = AIJobQueue(workers=2, max_pending=1, lease_seconds=60, sweep_seconds=0)
+    # enqueued before the workers run: the jobs only exist in Mongo
+    first = await queue.enqueue(db, "u1", date(2026, 1, 2))
+    second = await queue.enqueue(db, "u2", date(2026, 1, 2))
+    assert queue.stats["overflow"] == 2
+
+    queue.start(db)
+    try:
+        await _drain(db)
+    finally:
+        await queue.stop()
+    statuses = {j["_id"]: j["status"] for j in db.ai_jobs.docs}
+    assert statuses == {"dead": "done", first["_id"]: "done", second["_id"]: "done"}
+
+
+@pytest.mark.asyncio
+async def test_failing_job_is_retried_then_failed(monkeypatch):
+    calls = []
+
+    async def fake_run(db, job):
+        calls.append(job["attempts"])
+        raise RuntimeError("scoring pool crashed")
+
+    monkeypatch.setattr(ai_jobs, "run_ai_job", fake_run)
+    db = _db()
+    queue = AIJobQueue(workers=1, max_pending=10, lease_seconds=60, sweep_seconds=60)
+    queue.start(db)
+    try:
+        job = await queue.enqueue(db, "u1", date(2026, 1, 2))
+        await _drain(db)
+    finally:
+        await queue.stop()
+    assert calls == [1, 2, 3]
+    stored = await get_job(db, "u1", str(job["_id"]))
+    assert stored["status"] == "failed" and stored["error"] == "scoring pool crashed"
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_keeps_a_long_job_from_being_swept(monkeypatch):
+    calls = []
+
+    async def slow_run(db, job):
+        calls.append(job["_id"])
+        await asyncio.sleep(0.25)
+        return {"status": "done"}
+
+    monkeypatch.setattr(ai_jobs, "run_ai_job", slow_run)
+    db = _db()
+    queue = AIJobQueue(workers=1, max_pending=10, lease_seconds=0.06, sweep_seconds=60)
+    queue.start(db)
+    try:
+        job = await queue.enqueue(db, "u1", date(2026, 1, 2))
+        for _ in range(4):
+            await asyncio.sleep(0.05)
+            await queue.sweep()
+            assert db.ai_jobs.docs[0]["status"] == "running"
+        await _drain(db)
+    finally:
+        await queue.stop()
+    assert calls == [job["_id"]] and db.ai_jobs.docs[0]["status"] == "done"
+    # the user lease is released once the user's jobs are done
+    assert not db.ai_job_leases.docs
+
+
+@pytest.mark.asyncio
+async def test_jobs_wait_while_another_process_holds_the_user(monkeypatch):
+    async def fake_run(db, job):
+        return {"status": "done"}
+
+    monkeypatch.setattr(ai_jobs, "run_ai_job", fake_run)
+    db = _db()
+    db.ai_job_leases.docs.append({"_id": "u1", "owner": "other:1",
+                                  "expires_at": datetime.utcnow() + timedelta(minutes=1)})
+    queue = AIJobQueue(workers=1, max_pending=10, lease_seconds=60, sweep_seconds=60)
+    queue.start(db)
+    try:
+        await queue.enqueue(db, "u1", date(2026, 1, 2))
+        await asyncio.sleep(0.02)
+        assert db.ai_jobs.docs[0]["status"] == "queued" and queue._pending == 0
+
+        # the other process finished and its lease ran out
+        db.ai_job_leases.docs[0]["expires_at"] = datetime.utcnow() - timedelta(seconds=1)
+        queue._submit("u1", db.ai_jobs.docs[0]["_id"])
+        await _drain(db)
+    finally:
+        await queue.stop()
+    assert db.ai_jobs.docs[0]["status"] == "done"
+
+
+@pytest.mark.asyncio
+async def test_retried_job_skips_recorded_steps(monkeypatch):
+    db = _db(status="active", collected=14)
+    start = date(2026, 1, 1)
+    for i in range(15):
+        await ingest_metrics(db, "u1", _payload(start + timedelta(days=i), 8000 if i < 14 else 1500))
+    queue = AIJobQueue(workers=1, max_pending=10, lease_seconds=60, sweep_seconds=60)
+    job = await queue.enqueue(db, "u1", start + timedelta(days=14))
+    job["attempts"] = 1
+    insights = len(db.ai_insights.docs)
+
+    first = await ai_jobs.run_ai_job(db, job)
+    assert first["deviation_flags"]["steps"] is True
+    assert len(db.ai_insights.docs) == insights + 1
+
+    # a retry (e.g. the worker died before storing the result) reuses the stored step
+    stored = await db.ai_jobs.find_one({"_id": job["_id"]})
+    again = await ai_jobs.run_ai_job(db, stored)
+    assert again == first and len(db.ai_insights.docs) == insights + 1
+
+
+@pytest.mark.asyncio
+async def test_retried_job_counts_the_day_once():
+    db = _db()
+    await ingest_metrics(db, "u1", _payload(date(2026, 1, 1), 8000))
+    before = db.health_profiles.docs[0]["baseline_days_collected"]
+    queue = AIJobQueue(workers=1, max_pending=10, lease_seconds=60, sweep_seconds=60)
+    job = await queue.enqueue(db, "u1", date(2026, 1, 1))
+
+    await ai_jobs.run_ai_job(db, job)
+    await ai_jobs.run_ai_job(db, await db.ai_jobs.find_one({"_id": job["_id"]}))
+    assert db.health_profiles.docs[0]["baseline_days_collected"] == before + 1
+
+
+@pytest.mark.asyncio
+async def test_retry_runs_before_later_jobs_of_the_user(monkeypatch):
+    order = []
+    failed = set()
+
+    async def flaky_run(db, job):
+        day = job["date"].day
+        order.append(day)
+        if day == 1 and day not in failed:
+            failed.add(day)
+            raise RuntimeError("scoring pool crashed")
+        return {"status": "done"}
+
+    monkeypatch.setattr(ai_jobs, "run_ai_job", flaky_run)
+    db = _db()
+    queue = AIJobQueue(workers=1, max_pending=10, lease_seconds=60, sweep_seconds=60)
+    queue.start(db)
+    try:
+        # the fake never yields: all three days wait in the user's queue
+        for day in (1, 2, 3):
+            await queue.enqueue(db, "u1", date(2026, 1, day))
+        await _drain(db)
+    finally:
+        await queue.stop()
+    assert order == [1, 1, 2, 3]
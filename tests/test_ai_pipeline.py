@@ -0,0 +1,62 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app.models.metrics_model import MetricsCreate
+from app.services import ai_service
+from app.services.metrics_service import ingest_metrics
+
+from fakes import FakeCollection, FakeDB, profile_doc
+
+
+def _active_profile():
+    return profile_doc(status="active", collected=20, baseline_metrics={
+        "steps": {"count": 20, "mean": 8000.0, "m2": 20 * 1000.0 ** 2, "std": 1000.0},
+        "sleep": {"count": 20, "mean": 420.0, "m2": 20 * 30.0 ** 2, "std": 30.0},
+        "sedentary": {"count": 20, "mean": 500.0, "m2": 20 * 60.0 ** 2, "std": 60.0},
+        "active_minutes": {"count": 20, "mean": 40.0, "m2": 20 * 10.0 ** 2, "std": 10.0},
+    })
+
+
+def _db(profile, history):
+    return FakeDB(health_profiles=FakeCollection([profile]), daily_metrics=FakeCollection(history))
+
+
+@pytest.mark.asyncio
+async def test_ingest_reads_profile_once_and_matches_step_functions():
+    day = date(2026, 3, 10)
+    history = [
+        {"_id": f"h{i}", "user_id": "u1", "date": datetime(2026, 3, 10) - timedelta(days=i),
+         "steps": 4000, "sleep_duration_minutes": 420, "sedentary_minutes": 500,
+         "location_diversity_score": 50.0, "active_minutes": 40}
+        for i in range(1, 4)
+    ]
+    db = _db(_active_profile(), history)
+    payload = MetricsCreate(date=day, steps=4500, sleep_duration_minutes=300, sedentary_minutes=520,
+                            location_diversity_score=10.0, active_minutes=45)
+
+    result = await ingest_metrics(db, "u1", payload)
+
+    assert db.health_profiles.calls["find_one"] == 1
+    assert db.daily_metrics.calls["find"] == 1
+    assert db.ai_insights.calls["insert_one"] == 1
+
+    # the fused pass must agree with the step-by-step functions
+    stored = next(d for d in db.daily_metrics.docs if d["date"] == datetime(2026, 3, 10))
+    flags = await ai_service.compute_daily_deviations(db, "u1", stored["_id"])
+    risk = await ai_service.calculate_risk_score(db, "u1", flags, stored)
+    assert result["deviation_flags"] == flags
+    assert result["risk_score"] == risk
+    assert flags["steps"] is True and flags["sleep"] is True
+    assert "location" not in flags
+    assert db.ai_insights.docs[0]["risk_score"] == risk
+    assert db.health_profiles.docs[0]["risk_score"] == risk
+
+
+@pytest.mark.asyncio
+async def test_ingest_without_profile_returns_empty():
+    db = _db({"user_id": "other"}, [])
+    payload = MetricsCreate(date=date(2026, 3, 10), steps=1, sleep_duration_minutes=1,
+                            sedentary_minutes=1, location_diversity_score=1.0, active_minutes=1)
+    assert await ingest_metrics(db, "u1", payload) == {}
+    assert db.daily_metrics.calls.get("find_one_and_update") is None
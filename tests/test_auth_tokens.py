@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.jobs.compact_auth_tokens import run_compaction
+from app.services import auth_service
+from app.utils.tokens import hash_token
+
+from fakes import FakeDB
+
+
+@pytest.mark.asyncio
+async def test_login_and_device_store_one_token_with_expiry():
+    db = FakeDB()
+    await auth_service.store_refresh_token(db, "u1", "r1")
+    await auth_service.store_refresh_token(db, "u1", "r1", device_id="d1")
+    assert len(db.refresh_tokens.docs) == 1
+    doc = db.refresh_tokens.docs[0]
+    assert (doc["device_id"], doc["revoked"]) == ("d1", False)
+    assert doc["expires_at"] > datetime.utcnow() + timedelta(days=29)
+
+
+@pytest.mark.asyncio
+async def test_rotate_pulls_in_the_old_token_expiry():
+    db = FakeDB()
+    await auth_service.store_refresh_token(db, "u1", "r1", device_id="d1")
+    new = await auth_service.rotate_refresh_token(db, "r1", "u1", "d1")
+    old = next(d for d in db.refresh_tokens.docs if d["token_hash"] == hash_token("r1"))
+    assert old["revoked"] and old["expires_at"] < datetime.utcnow() + timedelta(hours=25)
+    fresh = next(d for d in db.refresh_tokens.docs if d["token_hash"] == hash_token(new))
+    assert fresh["expires_at"] > datetime.utcnow() + timedelta(days=29)
+
+
+@pytest.mark.asyncio
+async def test_used_otp_expires_immediately():
+    db = FakeDB()
+    otp = await auth_service.generate_device_otp(db, "u1", "d1")
+    assert db.device_otps.docs[0]["expires_at"] > datetime.utcnow()
+    assert await auth_service.mark_device_trusted(db, "u1", "d1", otp)
+    assert db.device_otps.docs[0]["expires_at"] <= datetime.utcnow()
+
+
+@pytest.mark.asyncio
+async def test_compaction_backfills_and_deletes_lapsed_documents():
+    db = FakeDB()
+    now = datetime(2026, 3, 1)
+    db.refresh_tokens.docs = [
+        {"token_hash": "old", "created_at": now - timedelta(days=40), "revoked": False},
+        {"token_hash": "recent", "created_at": now - timedelta(days=2), "revoked": False},
+        {"token_hash": "revoked", "created_at": now - timedelta(days=2), "revoked": True},
+        {"token_hash": "live", "expires_at": now + timedelta(days=5), "revoked": False},
+    ]
+    db.device_otps.docs = [
+        {"otp_hash": "used", "used": True, "expires_at": now + timedelta(minutes=5)},
+        {"otp_hash": "pending", "used": False, "expires_at": now + timedelta(minutes=5)},
+        {"otp_hash": "legacy", "used": False},
+    ]
+
+    preview = await run_compaction(db, now=now, dry_run=True)
+    assert preview["no_expiry"] == 3 and len(db.refresh_tokens.docs) == 4
+
+    summary = await run_compaction(db, now=now)
+    assert summary["refresh_tokens_deleted"] == 1 and summary["device_otps_deleted"] == 2
+    tokens = {d["token_hash"]: d for d in db.refresh_tokens.docs}
+    assert set(tokens) == {"recent", "revoked", "live"}
+    assert tokens["recent"]["expires_at"] == now + timedelta(days=28)
+    assert tokens["revoked"]["expires_at"] == now + timedelta(hours=24)
+    assert [d["otp_hash"] for d in db.device_otps.docs] == ["pending"]
+
+    # a day later the revoked token is past its retention
+    assert (await run_compaction(db, now=now + timedelta(days=1)))["refresh_tokens_deleted"] == 1
@@ -0,0 +1,113 @@
+import copy
+import statistics
+from datetime import date
+
+import pytest
+
+from app.services.baseline_service import (
+    apply_metrics_change,
+    resolve_baseline,
+    update_running_baseline,
+    welford_add,
+    welford_remove,
+)
+from app.services.daily_metrics_service import store_daily_metrics
+
+from fakes import FakeCollection, FakeDB
+
+
+def _fold(values):
+    stats = {"count": 0, "mean": 0.0, "m2": 0.0}
+    for v in values:
+        stats = welford_add(stats, v)
+    return stats
+
+
+def test_welford_matches_statistics():
+    values = [8000, 9500, 7200, 10100, 8800, 6400]
+    stats = _fold(values)
+    assert stats["count"] == len(values)
+    assert stats["mean"] == pytest.approx(statistics.mean(values))
+    assert stats["std"] == pytest.approx(statistics.pstdev(values))
+
+
+def test_welford_remove_is_inverse_of_add():
+    values = [420, 390, 450, 480, 300]
+    stats = welford_remove(_fold(values), 300)
+    assert stats["count"] == 4
+    assert stats["mean"] == pytest.approx(statistics.mean(values[:-1]))
+    assert stats["std"] == pytest.approx(statistics.pstdev(values[:-1]))
+
+
+def test_correction_replaces_old_sample():
+    baseline = {"steps": _fold([1000, 2000, 3000])}
+    changed = apply_metrics_change(baseline, {"steps": 3000}, {"steps": 6000})
+    assert set(changed) == {"steps"}
+    assert changed["steps"]["count"] == 3
+    assert changed["steps"]["mean"] == pytest.approx(3000.0)
+    assert changed["steps"]["std"] == pytest.approx(statistics.pstdev([1000, 2000, 6000]))
+
+
+def test_legacy_baseline_is_seeded_from_mean_std():
+    baseline = {"sleep": {"mean": 420.0, "std": 30.0}}
+    changed = apply_metrics_change(baseline, None, {"sleep_duration_minutes": 420}, fallback_count=14)
+    assert changed["sleep"]["count"] == 15
+    assert changed["sleep"]["mean"] == pytest.approx(420.0)
+
+
+def test_weekday_bucket_used_once_dense():
+    baseline = {}
+    mondays = [date(2026, 3, 2), date(2026, 3, 9), date(2026, 3, 16)]
+    for day, steps in zip(mondays, [12000, 13000, 14000]):
+        baseline.update(apply_metrics_change(baseline, None, {"date": day, "steps": steps}))
+    baseline.update(apply_metrics_change(baseline, None, {"date": date(2026, 3, 3), "steps": 2000}))
+
+    entry = baseline["steps"]
+    assert entry["count"] == 4
+    assert entry["weekday"][0][0] == 3
+    monday = resolve_baseline(entry, date(2026, 3, 23))
+    assert monday["mean"] == pytest.approx(13000.0)
+    assert monday["std"] == pytest.approx(statistics.pstdev([12000, 13000, 14000]))
+    # sparse Tuesday bucket and unknown dates fall back to the global entry
+    assert resolve_baseline(entry, date(2026, 3, 24)) is entry
+    assert resolve_baseline(entry) is entry
+
+
+def test_weekday_bucket_correction():
+    day = date(2026, 3, 2)
+    baseline = apply_metrics_change({}, None, {"date": day, "steps": 1000})
+    baseline.update(apply_metrics_change(baseline, {"date": day, "steps": 1000}, {"date": day, "steps": 5000}))
+    assert baseline["steps"]["weekday"][0][:2] == [1, pytest.approx(5000.0)]
+
+
+@pytest.mark.asyncio
+async def test_store_daily_metrics_streams_baseline():
+    db = FakeDB(health_profiles=FakeCollection([{"user_id": "u1", "baseline_metrics": {}}]))
+    first = await store_daily_metrics(db, "u1", date(2026, 3, 1), 1000, 400, 500, 50.0, 20)
+    await store_daily_metrics(db, "u1", date(2026, 3, 2), 3000, 440, 500, 50.0, 40)
+    # correction of day 1 must not double count
+    again = await store_daily_metrics(db, "u1", date(2026, 3, 1), 2000, 400, 500, 50.0, 20)
+    assert again["_id"] == first["_id"]
+
+    steps = db.health_profiles.docs[0]["baseline_metrics"]["steps"]
+    assert steps["count"] == 2
+    assert steps["mean"] == pytest.approx(2500.0)
+    # unchanged signals are left alone on a correction
+    assert db.health_profiles.docs[0]["baseline_metrics"]["sedentary"]["count"] == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_baseline_updates_are_not_lost():
+    db = FakeDB(health_profiles=FakeCollection([{"user_id": "u1"}]))
+    stale = copy.deepcopy(db.health_profiles.docs[0])
+    # another request folds day 1 in after `stale` was read
+    await update_running_baseline(db, "u1", None, {"date": date(2026, 3, 1), "steps": 1000})
+    changed = await update_running_baseline(db, "u1", None, {"date": date(2026, 3, 2), "steps": 3000},
+                                            profile=stale)
+
+    stored = db.health_profiles.docs[0]["baseline_metrics"]["steps"]
+    assert (stored["count"], stored["mean"]) == (2, pytest.approx(2000.0))
+    assert changed["steps"] == stored
+    # the caller's profile holds what was written
+    assert stale["baseline_metrics"]["steps"] == stored
+    assert db.health_profiles.calls["update_one"] == 3
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.config.settings import settings
+from app.services import baseline_refresh
+from app.services.baseline_service import rebuild_baseline, update_running_baseline
+
+from fakes import FakeCollection, FakeDB
+
+
+def _setup(now):
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    profiles = [
+        {"user_id": "due", "baseline_status": "active", "baseline_metrics": {}, "updated_at": now - timedelta(days=3)},
+        {"user_id": "later", "baseline_status": "active", "baseline_refresh_due_at": now + timedelta(hours=2)},
+        {"user_id": "collecting", "baseline_status": "collecting"},
+    ]
+    metrics = [
+        {"user_id": "due", "date": today - timedelta(days=d), "steps": 1000 * d}
+        for d in range(settings.MAX_HISTORY_DAYS + 30)
+    ]
+    return FakeDB(health_profiles=FakeCollection(profiles), daily_metrics=FakeCollection(metrics))
+
+
+@pytest.mark.asyncio
+async def test_refresh_rebuilds_due_users_over_history_window():
+    now = datetime.utcnow()
+    db = _setup(now)
+    refreshed = await baseline_refresh.run_refresh_cycle(db, "worker-a")
+
+    assert refreshed == 1
+    profile = db.health_profiles.docs[0]
+    recent = [d for d in db.daily_metrics.docs if d["steps"] < 1000 * settings.MAX_HISTORY_DAYS]
+    assert profile["baseline_metrics"] == rebuild_baseline(recent)
+    assert profile["baseline_metrics"]["steps"]["count"] == settings.MAX_HISTORY_DAYS
+    interval = timedelta(hours=settings.AI_REFRESH_INTERVAL_HOURS)
+    due_in = profile["baseline_refresh_due_at"] - now
+    assert interval <= due_in <= interval * (1 + settings.BASELINE_REFRESH_JITTER) + timedelta(seconds=5)
+    assert db.baseline_refresh_leases.docs == []
+    # nothing is due on the next tick
+    assert await baseline_refresh.run_refresh_cycle(db, "worker-a") == 0
+
+
+@pytest.mark.asyncio
+async def test_live_lease_blocks_other_workers():
+    now = datetime.utcnow()
+    db = _setup(now)
+    assert await baseline_refresh.acquire_lease(db, "due", "worker-a")
+    assert not await baseline_refresh.acquire_lease(db, "due", "worker-b")
+    assert await baseline_refresh.run_refresh_cycle(db, "worker-b") == 0
+    assert "baseline_refresh_due_at" not in db.health_profiles.docs[0]
+    # an expired lease can be taken over
+    later = now + timedelta(seconds=settings.BASELINE_REFRESH_LEASE_SECONDS + 1)
+    assert await baseline_refresh.acquire_lease(db, "due", "worker-b", now=later)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_profile_update_is_not_overwritten(monkeypatch):
+    now = datetime.utcnow()
+    db = _setup(now)
+    real_find = db.daily_metrics.find
+
+    def find_during_ingest(q, projection=None):
+        # an ingest lands between the profile read and the write
+        db.health_profiles.docs[0]["updated_at"] = datetime.utcnow()
+        db.health_profiles.docs[0]["baseline_metrics"] = {"steps": {"count": 1}}
+        return real_find(q, projection)
+
+    monkeypatch.setattr(db.daily_metrics, "find", find_during_ingest)
+    assert await baseline_refresh.refresh_user_baseline(db, "due", now) is False
+    assert db.health_profiles.docs[0]["baseline_metrics"] == {"steps": {"count": 1}}
+
+
+def test_rebuild_folds_what_intraday_days_contribute():
+    day = datetime(2026, 3, 2)
+    docs = [
+        {"date": day, "steps": 1000},
+        # open day: the baseline holds its last folded sample, not the live counter
+        {"date": day + timedelta(days=1), "steps": 9000, "intraday": True,
+         "baseline_sample": {"date": day + timedelta(days=1), "steps": 3000}},
+        # not folded yet
+        {"date": day + timedelta(days=2), "steps": 500, "intraday": True},
+    ]
+    steps = rebuild_baseline(docs)["steps"]
+    assert (steps["count"], steps["mean"]) == (2, 2000)
+
+
+@pytest.mark.asyncio
+async def test_corrections_older_than_the_refresh_window_add_without_swapping():
+    now = datetime.utcnow()
+    db = _setup(now)
+    assert await baseline_refresh.refresh_user_baseline(db, "due", now)
+    profile = db.health_profiles.docs[0]
+    before = dict(profile["baseline_metrics"]["steps"])
+    old = min(db.daily_metrics.docs, key=lambda d: d["date"])
+
+    await update_running_baseline(db, "due", old, {**old, "steps": 0})
+    steps = profile["baseline_metrics"]["steps"]
+    # the old value was dropped by the refresh: only the new one is added
+    assert steps["count"] == before["count"] + 1
+    assert steps["mean"] * steps["count"] == pytest.approx(before["mean"] * before["count"])
@@ -0,0 +1,123 @@
+import gzip
+import json
+from datetime import date, timedelta
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from app import deps
+from app.api import metrics_routes
+from app.config.settings import settings
+from app.db.client import get_database
+from app.middleware import body_decoding
+
+from fakes import FakeDB
+
+msgpack = pytest.importorskip("msgpack")
+cbor2 = pytest.importorskip("cbor2")
+
+
+def _rows(days):
+    return [{
+        "date": (date(2026, 1, 1) + timedelta(days=i)).isoformat(),
+        "steps": 5000 + i,
+        "sleep_duration_minutes": 420,
+        "sedentary_minutes": 600,
+        "location_diversity_score": 50.5,
+        "active_minutes": 30,
+        "screen_time_minutes": None if i % 2 else 120,
+    } for i in range(days)]
+
+
+def _columns(rows):
+    return {field: [r[field] for r in rows] for field in rows[0]}
+
+
+def _client(db=None):
+    app = FastAPI()
+    app.include_router(metrics_routes.router)
+
+    async def _user():
+        return {"user_id": "u1"}
+
+    app.dependency_overrides[deps.get_current_user] = _user
+    app.dependency_overrides[get_database] = lambda: db or FakeDB()
+    return AsyncClient(transport=ASGITransport(app=app), base_url="http://test")
+
+
+@pytest.mark.asyncio
+async def test_history_accepts_every_encoding(monkeypatch):
+    seen = []
+
+    async def fake_replay(db, user_id, payload):
+        seen.append([item.model_dump() for item in payload])
+        return {"days": len(payload), "insights": 0}
+
+    monkeypatch.setattr(metrics_routes, "replay_history", fake_replay)
+    rows = _rows(5)
+    bodies = [
+        ("application/json", None, json.dumps(rows).encode()),
+        ("application/json", "gzip", gzip.compress(json.dumps(_columns(rows)).encode())),
+        ("application/msgpack", None, msgpack.packb(_columns(rows))),
+        ("application/msgpack", "gzip", gzip.compress(msgpack.packb(rows))),
+        ("application/cbor", None, cbor2.dumps(_columns(rows))),
+    ]
+    async with _client() as client:
+        for content_type, encoding, body in bodies:
+            headers = {"content-type": content_type}
+            if encoding:
+                headers["content-encoding"] = encoding
+            resp = await client.post("/metrics/history", content=body, headers=headers)
+            assert resp.status_code == 200, (content_type, encoding, resp.text)
+
+    assert len(seen) == len(bodies)
+    assert all(payload == seen[0] for payload in seen)
+    assert seen[0][1]["screen_time_minutes"] is None and seen[0][4]["steps"] == 5004
+
+
+@pytest.mark.asyncio
+async def test_bad_bodies_are_rejected(monkeypatch):
+    columns = _columns(_rows(3))
+    columns["steps"].pop()
+    async with _client() as client:
+        ragged = await client.post("/metrics/batch", json=columns)
+        not_gzip = await client.post("/metrics/batch", content=b"[]",
+                                     headers={"content-type": "application/json", "content-encoding": "gzip"})
+        truncated = await client.post("/metrics/batch", content=gzip.compress(b"[]")[:-6],
+                                      headers={"content-type": "application/json", "content-encoding": "gzip"})
+        brotli = await client.post("/metrics/batch", content=b"[]",
+                                   headers={"content-type": "application/json", "content-encoding": "br"})
+        bad_msgpack = await client.post("/metrics/batch", content=b"\xc1",
+                                        headers={"content-type": "application/msgpack"})
+        # a small gzip body that inflates past the limit
+        monkeypatch.setattr(settings, "METRICS_MAX_BODY_BYTES", 1024)
+        bomb = await client.post("/metrics/batch", content=gzip.compress(b"[" + b" " * 100000 + b"]"),
+                                 headers={"content-type": "application/json", "content-encoding": "gzip"})
+        monkeypatch.setattr(body_decoding, "cbor2", None)
+        no_cbor = await client.post("/metrics/batch", content=cbor2.dumps([]),
+                                    headers={"content-type": "application/cbor"})
+
+    assert ragged.status_code == 400 and ragged.json()["detail"]["error_type"] == "invalid_columnar_batch"
+    assert not_gzip.status_code == truncated.status_code == bad_msgpack.status_code == 400
+    assert brotli.status_code == no_cbor.status_code == 415
+    assert bomb.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_import_stream_is_gunzipped_on_the_fly(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_IMPORT_KEY", "secret")
+    # larger than the decoded-body cap: the import never buffers the body
+    monkeypatch.setattr(settings, "METRICS_MAX_BODY_BYTES", 1024)
+    rows = [{**row, "user_id": f"user-{u}"} for u in range(20) for row in _rows(30)]
+    body = gzip.compress(b"".join(json.dumps(r).encode() + b"\n" for r in rows))
+    db = FakeDB()
+    async with _client(db) as client:
+        resp = await client.post("/metrics/import?replay=false", content=body, headers={
+            "content-type": "application/x-ndjson",
+            "content-encoding": "gzip",
+            "x-import-key": "secret",
+        })
+
+    assert resp.status_code == 200 and resp.json()["stored"] == 600
+    assert len(db.daily_metrics.docs) == 600
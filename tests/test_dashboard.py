@@ -0,0 +1,124 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services import dashboard_service
+from app.services.dashboard_cache import dashboard_cache
+from app.services.dashboard_service import dashboard_snapshots, render, snapshot_insight, snapshot_profile
+from app.services.window_cache import WindowCache
+
+from fakes import FakeCollection, FakeDB
+
+
+class GatedCollection(FakeCollection):
+    """Answers find_one only once every collection of the dashboard has been queried."""
+
+    def __init__(self, docs, started, expected=4):
+        super().__init__(docs)
+        self.started = started
+        self.expected = expected
+        self.projections = []
+
+    async def find_one(self, q=None, projection=None, sort=None):
+        self.projections.append(projection)
+        self.started.append(self)
+        while len(self.started) < self.expected:
+            await asyncio.sleep(0)
+        return await super().find_one(q, projection, sort)
+
+    def find(self, q=None, projection=None, sort=None, limit=0):
+        self.projections.append(projection)
+        self.started.append(self)
+        return super().find(q, projection, sort, limit)
+
+
+def _db():
+    started = []
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return FakeDB(
+        users=GatedCollection([{"user_id": "u1", "name": "Ada", "email": "ada@example.com", "password": "x"}],
+                              started),
+        ai_insights=GatedCollection([{"user_id": "u1", "date": today, "summary_message": "ok",
+                                      "recommended_actions": ["walk"], "risk_score": 12, "raw": "x" * 100}],
+                                    started),
+        health_profiles=GatedCollection([{"user_id": "u1", "goals": {"steps": 9000}, "risk_score": 20,
+                                          "baseline": {}}], started),
+        daily_metrics=GatedCollection([
+            {"user_id": "u1", "date": today - timedelta(days=i), "steps": 1000 * i,
+             "sleep_duration_minutes": 430, "active_minutes": 10 * i, "screen_time_minutes": 90}
+            for i in range(3)
+        ], started),
+    )
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(dashboard_service, "window_cache", WindowCache(days=30, ttl_seconds=60, max_users=10))
+
+
+@pytest.fixture
+def snapshots(monkeypatch):
+    monkeypatch.setattr(dashboard_snapshots, "active", True)
+
+
+def _source_calls(db):
+    return sum(len(c.projections) for c in (db.users, db.ai_insights, db.health_profiles, db.daily_metrics))
+
+
+@pytest.mark.asyncio
+async def test_dashboard_reads_run_together_with_projections(cache):
+    db = _db()
+    # the fake find_one calls would wait forever if they were awaited one by one
+    data = await asyncio.wait_for(dashboard_service.get_dashboard_data(db, "u1"), timeout=1)
+
+    assert data["userName"] == "Ada" and data["steps"] == 0 and data["sleep"] == "7h 10m"
+    assert data["activityBars"] == [20, 10, 0]
+    assert data["goals"] == {"steps": 9000} and data["risk_score"] == 20
+    assert data["insight"] == {"summary": "ok", "actions": ["walk"], "risk_score": 12}
+    for coll in (db.users, db.ai_insights, db.health_profiles, db.daily_metrics):
+        assert coll.projections and all(p for p in coll.projections)
+
+
+@pytest.mark.asyncio
+async def test_snapshot_is_built_once_then_read_by_id(cache, snapshots):
+    db = _db()
+    first = await asyncio.wait_for(dashboard_service.get_dashboard_data(db, "u1"), timeout=1)
+    calls = _source_calls(db)
+    assert set(db.dashboard_snapshots.docs[0]) >= set(dashboard_service.SECTIONS)
+
+    dashboard_cache.clear()  # as after the response cache TTL
+    second = await dashboard_service.get_dashboard_data(db, "u1")
+    assert second == first
+    assert _source_calls(db) == calls and db.dashboard_snapshots.calls["find_one"] == 2
+
+
+@pytest.mark.asyncio
+async def test_hooks_update_sections_and_build_keeps_them(cache, snapshots):
+    db = _db()
+    # only the hooks have written so far: the read fills the other sections
+    await snapshot_insight(db, "u1", {"summary_message": "new", "recommended_actions": [], "risk_score": 55})
+    await snapshot_profile(db, "u1", {"goals": {"sleep": 8}, "baseline_status": "active"})
+    data = await asyncio.wait_for(dashboard_service.get_dashboard_data(db, "u1"), timeout=1)
+
+    assert data["insight"] == {"summary": "new", "actions": [], "risk_score": 55}
+    assert data["risk_score"] == 55 and data["goals"] == {"sleep": 8}
+    assert data["userName"] == "Ada" and data["activityBars"] == [20, 10, 0]
+
+    await snapshot_profile(db, "u1", {"name": "Grace"})
+    assert (await dashboard_service.get_dashboard_data(db, "u1"))["userName"] == "Grace"
+
+
+def test_render_drops_activity_older_than_a_week():
+    now = datetime(2026, 3, 10, 12)
+    snapshot = {
+        "user_name": "Ada",
+        "latest": {"steps": 5000, "sleep_duration_minutes": 61},
+        "activity": [{"date": datetime(2026, 3, d), "active_minutes": d} for d in (2, 5, 9, 10)],
+        "goals": None,
+        "risk_score": 3,
+        "insight": None,
+    }
+    data = render(snapshot, now)
+    assert data["activityBars"] == [5, 9, 10]
+    assert (data["steps"], data["sleep"], data["screenTime"], data["goals"]) == (5000, "1h 1m", None, {})
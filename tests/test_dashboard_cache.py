@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from app.services import dashboard_service
+from app.services.dashboard_cache import DashboardCache, dashboard_cache
+
+
+class Loader:
+    def __init__(self, gate=None):
+        self.calls = 0
+        self.gate = gate
+
+    def __call__(self, user_id="u1", value=None):
+        async def load():
+            self.calls += 1
+            if self.gate is not None:
+                await self.gate.wait()
+            return value or {"userName": user_id, "calls": self.calls}
+        return load
+
+
+@pytest.mark.asyncio
+async def test_hits_lru_and_ttl():
+    cache = DashboardCache(ttl_seconds=60, max_users=1, max_bytes=1 << 20)
+    loader = Loader()
+    first = await cache.get("u1", loader())
+    assert await cache.get("u1", loader()) is first
+    assert loader.calls == 1 and (cache.stats["hits"], cache.stats["misses"]) == (1, 1)
+
+    await cache.get("u2", loader("u2"))  # evicts u1
+    await cache.get("u1", loader())
+    assert loader.calls == 3 and cache.stats["evictions"] == 2
+
+    expired = DashboardCache(ttl_seconds=0, max_users=10, max_bytes=1 << 20)
+    await expired.get("u1", loader())
+    await expired.get("u1", loader())
+    assert loader.calls == 5 and not expired._entries
+
+
+@pytest.mark.asyncio
+async def test_byte_limit_evicts_and_skips_oversized():
+    cache = DashboardCache(ttl_seconds=60, max_users=10, max_bytes=100)
+    loader = Loader()
+    await cache.get("u1", loader(value={"pad": "x" * 40}))
+    await cache.get("u2", loader(value={"pad": "y" * 40}))
+    assert list(cache._entries) == ["u2"] and cache.bytes <= 100
+    await cache.get("u3", loader(value={"pad": "z" * 200}))
+    assert list(cache._entries) == ["u2"]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load():
+    gate = asyncio.Event()
+    loader = Loader(gate)
+    cache = DashboardCache(ttl_seconds=60, max_users=10, max_bytes=1 << 20)
+    callers = [asyncio.create_task(cache.get("u1", loader())) for _ in range(5)]
+    await asyncio.sleep(0)
+    # the first caller goes away; the others still get the result
+    callers[0].cancel()
+    gate.set()
+    results = await asyncio.gather(*callers[1:])
+    assert loader.calls == 1 and all(r is results[0] for r in results)
+    assert cache.stats["coalesced"] == 4 and "u1" in cache._entries
+
+
+@pytest.mark.asyncio
+async def test_invalidate_during_load_is_not_cached():
+    gate = asyncio.Event()
+    loader = Loader(gate)
+    cache = DashboardCache(ttl_seconds=60, max_users=10, max_bytes=1 << 20)
+    stale = asyncio.create_task(cache.get("u1", loader()))
+    await asyncio.sleep(0)
+    cache.invalidate("u1")
+    gate.set()
+    await stale
+    assert "u1" not in cache._entries
+    fresh = await cache.get("u1", loader())
+    assert fresh["calls"] == 2 and "u1" in cache._entries
+
+
+@pytest.mark.asyncio
+async def test_failed_load_is_not_cached():
+    cache = DashboardCache(ttl_seconds=60, max_users=10, max_bytes=1 << 20)
+
+    async def boom():
+        raise RuntimeError("mongo down")
+
+    with pytest.raises(RuntimeError):
+        await cache.get("u1", boom)
+    assert not cache._entries and not cache._inflight
+
+
+@pytest.mark.asyncio
+async def test_dashboard_writes_invalidate(monkeypatch):
+    loads = []
+
+    async def build(db, user_id):
+        loads.append(user_id)
+        return {"user_name": "Ada", "latest": None, "goals": {}, "risk_score": len(loads), "insight": None}
+
+    monkeypatch.setattr(dashboard_service, "build_snapshot", build)
+    assert (await dashboard_service.get_dashboard_data(None, "u1"))["risk_score"] == 1
+    assert (await dashboard_service.get_dashboard_data(None, "u1"))["risk_score"] == 1
+
+    # snapshots are off here: the hook only drops the cached response
+    await dashboard_service.snapshot_insight(None, "u1", {"summary_message": "new", "risk_score": 70})
+    assert (await dashboard_service.get_dashboard_data(None, "u1"))["risk_score"] == 2
+    assert dashboard_cache.stats["invalidations"] == 1 and loads == ["u1", "u1"]
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from app import deps
+from app.api import metrics_routes
+from app.db.client import get_database
+from app.services.idempotency import IdempotencyConflict, IdempotencyStore, idempotency_store
+
+from fakes import FakeCollection, FakeDB, profile_doc
+
+
+def _db():
+    return FakeDB(health_profiles=FakeCollection([profile_doc()]))
+
+
+@pytest.fixture(autouse=True)
+def _clear_store():
+    idempotency_store.clear()
+    yield
+    idempotency_store.clear()
+
+
+def _client(db):
+    app = FastAPI()
+    app.include_router(metrics_routes.router)
+
+    async def _user():
+        return {"user_id": "u1"}
+
+    app.dependency_overrides[deps.get_current_user] = _user
+    app.dependency_overrides[get_database] = lambda: db
+    return AsyncClient(transport=ASGITransport(app=app), base_url="http://test")
+
+
+METRICS = {"date": "2026-02-21", "steps": 5000, "sleep_duration_minutes": 420, "sedentary_minutes": 600,
+           "location_diversity_score": 75.5, "active_minutes": 45, "screen_time_minutes": 180}
+
+
+@pytest.mark.asyncio
+async def test_metrics_retry_replays_first_response():
+    db = _db()
+    headers = {"Idempotency-Key": "sync-1"}
+    async with _client(db) as client:
+        first = await client.post("/metrics", json=METRICS, headers=headers)
+        retry = await client.post("/metrics", json=METRICS, headers=headers)
+        idempotency_store.clear()  # another worker: only Mongo knows the key
+        from_db = await client.post("/metrics", json=METRICS, headers=headers)
+        reused = await client.post("/metrics", json={**METRICS, "steps": 1}, headers=headers)
+        plain = await client.post("/metrics", json=METRICS)
+
+    assert first.status_code == retry.status_code == from_db.status_code == 200
+    assert "idempotent-replayed" not in first.headers
+    assert retry.headers["idempotent-replayed"] == from_db.headers["idempotent-replayed"] == "true"
+    assert retry.json() == from_db.json() == first.json()
+    assert reused.status_code == 422
+    assert reused.json()["detail"]["error_type"] == "idempotency_key_reused"
+    # the retries never reached the pipeline; the request without a key did
+    assert db.health_profiles.docs[0]["baseline_days_collected"] == 2
+
+
+@pytest.mark.asyncio
+async def test_overlapping_retry_waits_for_first_call():
+    calls = []
+
+    async def reply():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"role": "assistant", "content": "Keep a regular bedtime."}
+
+    store = IdempotencyStore(ttl_seconds=60, max_entries=10)
+    db = _db()
+    body = {"messages": [{"role": "user", "content": "How can I sleep better?"}]}
+    first, overlapping = await asyncio.gather(
+        store.run(db, "u1", "chat", "chat-1", body, reply),
+        store.run(db, "u1", "chat", "chat-1", body, reply),
+    )
+    later = await store.run(db, "u1", "chat", "chat-1", body, reply)
+    # same key, other user or endpoint: independent
+    other = await store.run(db, "u2", "chat", "chat-1", body, reply)
+
+    assert first == (later[0], False)
+    assert overlapping == later == (first[0], True)
+    assert other == (first[0], False)
+    assert len(calls) == 2
+    assert (store.hits, store.misses) == (2, 2)
+
+
+@pytest.mark.asyncio
+async def test_failed_call_can_be_retried_with_same_key():
+    replies = [RuntimeError("LLM provider unreachable"), {"role": "assistant", "content": "ok"}]
+
+    async def flaky():
+        reply = replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    store = IdempotencyStore(ttl_seconds=60, max_entries=10)
+    db = _db()
+    body = {"messages": [{"role": "user", "content": "hi"}]}
+    with pytest.raises(RuntimeError):
+        await store.run(db, "u1", "chat", "chat-2", body, flaky)
+    assert db.idempotency_keys.docs == []
+    assert await store.run(db, "u1", "chat", "chat-2", body, flaky) == ({"role": "assistant", "content": "ok"}, False)
+
+    with pytest.raises(IdempotencyConflict) as exc:
+        await store.run(db, "u1", "chat", "k" * 300, body, flaky)
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_key_pending_in_another_process_is_in_progress():
+    store = IdempotencyStore(ttl_seconds=60, max_entries=10)
+    db = _db()
+
+    async def never_called():
+        raise AssertionError("ran twice")
+
+    # the first request is running in another worker
+    other_worker = IdempotencyStore(ttl_seconds=60, max_entries=10)
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow():
+        started.set()
+        await release.wait()
+        return {"ok": True}
+
+    task = asyncio.create_task(other_worker.run(db, "u1", "metrics", "k1", {"a": 1}, slow))
+    await started.wait()
+    with pytest.raises(IdempotencyConflict) as exc:
+        await store.run(db, "u1", "metrics", "k1", {"a": 1}, never_called)
+    assert exc.value.status_code == 409
+    release.set()
+    await task
+    assert await store.run(db, "u1", "metrics", "k1", {"a": 1}, never_called) == ({"ok": True}, True)
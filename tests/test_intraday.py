@@ -0,0 +1,149 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app.config.settings import settings
+from app.models.metrics_model import MetricsDelta
+from app.services.daily_metrics_service import store_daily_metrics
+from app.services.intraday_service import apply_metrics_delta
+
+from fakes import FakeCollection, FakeDB, profile_doc
+
+
+class ProfileDB(FakeDB):
+    def __init__(self, status="collecting", collected=0):
+        super().__init__(health_profiles=FakeCollection([profile_doc(status=status, collected=collected)]))
+
+    @property
+    def profile(self):
+        return self.health_profiles.docs[0]
+
+
+@pytest.fixture
+def close_only(monkeypatch):
+    monkeypatch.setattr(settings, "INTRADAY_PIPELINE_INTERVAL_MINUTES", 0)
+
+
+@pytest.mark.asyncio
+async def test_deltas_accumulate_and_fold_on_close(close_only):
+    db = ProfileDB()
+    day = date(2026, 2, 2)
+    for steps in (1000, 2500, 500):
+        doc = await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=steps, active_minutes=5))
+        assert doc["pipeline_ran"] is False
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=day, sleep_duration_minutes=400))
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=day, sleep_duration_minutes=380))
+
+    [stored] = db.daily_metrics.docs
+    assert (stored["steps"], stored["active_minutes"], stored["sleep_duration_minutes"]) == (4000, 15, 400)
+    assert db.profile["baseline_metrics"] == {}
+    assert db.profile["baseline_days_collected"] == 0
+
+    doc = await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=1000, close=True))
+    assert doc["pipeline_ran"] is True
+    assert stored["closed"] is True
+    assert stored["baseline_sample"]["steps"] == 5000
+    assert db.profile["baseline_metrics"]["steps"]["count"] == 1
+    assert db.profile["baseline_metrics"]["steps"]["mean"] == 5000
+    assert db.profile["baseline_days_collected"] == 1
+
+    # a late tick after close swaps the folded sample instead of adding one
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=1000, close=True))
+    assert db.profile["baseline_metrics"]["steps"]["count"] == 1
+    assert db.profile["baseline_metrics"]["steps"]["mean"] == 6000
+    assert db.profile["baseline_days_collected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_new_day_closes_open_days(close_only):
+    db = ProfileDB()
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=date(2026, 2, 2), steps=3000))
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=date(2026, 2, 3), steps=200))
+
+    first, second = sorted(db.daily_metrics.docs, key=lambda d: d["date"])
+    assert first["closed"] is True and first["baseline_sample"]["steps"] == 3000
+    assert "baseline_sample" not in second
+    assert db.profile["baseline_days_collected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pipeline_runs_on_cadence(monkeypatch):
+    monkeypatch.setattr(settings, "INTRADAY_PIPELINE_INTERVAL_MINUTES", 60)
+    db = ProfileDB()
+    day = date(2026, 2, 2)
+    # the cadence starts at the day's first tick instead of running on it
+    first = await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=100))
+    second = await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=100))
+    assert (first["pipeline_ran"], second["pipeline_ran"]) == (False, False)
+
+    [stored] = db.daily_metrics.docs
+    stored["created_at"] -= timedelta(minutes=61)
+    third = await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=100))
+    fourth = await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=100))
+    assert (third["pipeline_ran"], fourth["pipeline_ran"]) == (True, False)
+    # partial totals are neither folded nor counted
+    assert "baseline_sample" not in stored
+    assert db.profile["baseline_metrics"] == {}
+    assert db.profile["baseline_days_collected"] == 0
+
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=100, close=True))
+    assert db.profile["baseline_metrics"]["steps"]["mean"] == 500
+    assert db.profile["baseline_days_collected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_full_upload_replaces_intraday_sample(close_only):
+    db = ProfileDB()
+    day = date(2026, 2, 2)
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=4000, close=True))
+    await store_daily_metrics(db, "u1", day, 7000, 420, 500, 40.0, 30)
+
+    [stored] = db.daily_metrics.docs
+    assert "intraday" not in stored and "baseline_sample" not in stored
+    assert db.profile["baseline_metrics"]["steps"]["count"] == 1
+    assert db.profile["baseline_metrics"]["steps"]["mean"] == 7000
+
+    # deltas on top of a full upload start from the values already folded
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=500, screen_time_minutes=20, close=True))
+    assert stored["screen_time_minutes"] == 20
+    assert db.profile["baseline_metrics"]["steps"]["count"] == 1
+    assert db.profile["baseline_metrics"]["steps"]["mean"] == 7500
+
+
+@pytest.mark.asyncio
+async def test_active_profile_scores_on_close(close_only):
+    db = ProfileDB()
+    start = date(2026, 1, 1)
+    for i in range(14):
+        await store_daily_metrics(db, "u1", start + timedelta(days=i), 8000 + 50 * (i % 3), 420, 500, 40.0, 30)
+    db.profile["baseline_status"] = "active"
+
+    day = start + timedelta(days=14)
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=1200, active_minutes=3))
+    doc = await apply_metrics_delta(db, "u1", MetricsDelta(
+        date=day, sleep_duration_minutes=420, sedentary_minutes=500, close=True,
+    ))
+    assert doc["deviation_flags"]["steps"] is True
+    assert doc["risk_score"] > 0
+    assert len(db.ai_insights.docs) == 1
+
+
+@pytest.mark.asyncio
+async def test_cadence_runs_neither_fold_nor_score(monkeypatch):
+    monkeypatch.setattr(settings, "INTRADAY_PIPELINE_INTERVAL_MINUTES", 60)
+    db = ProfileDB(status="active", collected=14)
+    db.profile["baseline_metrics"] = {"steps": {"count": 14, "mean": 8000.0, "m2": 14 * 400.0 ** 2, "std": 400.0}}
+    day = date(2026, 2, 2)
+
+    # a morning's worth of steps is far below the baseline, but the day is open
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=1000))
+    db.daily_metrics.docs[0]["created_at"] -= timedelta(minutes=61)
+    doc = await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=200))
+    assert doc["pipeline_ran"] is True and "deviation_flags" not in doc
+    assert db.profile["baseline_metrics"]["steps"]["count"] == 14
+    assert not db.ai_insights.docs
+
+    doc = await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=300, close=True))
+    assert doc["deviation_flags"]["steps"] is True
+    assert db.profile["baseline_metrics"]["steps"]["count"] == 15
+    assert len(db.ai_insights.docs) == 1
@@ -0,0 +1,173 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.jobs.migrate_metrics_buckets import run_migration
+from app.models.metrics_model import MetricsCreate, MetricsDelta
+from app.services.daily_metrics_service import get_daily_metrics, get_user_metrics_range, store_daily_metrics
+from app.services.intraday_service import apply_metrics_delta
+from app.services.metrics_repository import BUCKET_COLLECTION, DayWrite, metrics_repository
+from app.services.metrics_service import ingest_metrics
+from app.services.replay_service import replay_history
+
+from fakes import FakeCollection, FakeDB, profile_doc
+
+
+def _db():
+    return FakeDB(health_profiles=FakeCollection([profile_doc()]))
+
+
+@pytest.fixture
+def monthly():
+    metrics_repository.use("monthly")
+    yield
+    metrics_repository.use("flat")
+
+
+def _payload(day, steps):
+    return MetricsCreate(date=day, steps=steps, sleep_duration_minutes=420, sedentary_minutes=500,
+                         location_diversity_score=40.0, active_minutes=30, screen_time_minutes=100)
+
+
+@pytest.mark.asyncio
+async def test_days_across_months_round_trip(monthly):
+    db = _db()
+    start = date(2026, 1, 30)
+    for i in range(4):
+        await store_daily_metrics(db, "u1", start + timedelta(days=i), 1000 * (i + 1), 420, 500, 40.0, 30)
+    # a correction replaces the day and its baseline sample
+    corrected = await store_daily_metrics(db, "u1", date(2026, 1, 31), 9000, 420, 500, 40.0, 30)
+
+    assert db.daily_metrics.docs == []
+    assert sorted(b["_id"] for b in db.daily_metrics_buckets.docs) == ["u1:2026-01", "u1:2026-02"]
+    assert all(len(b["days"]) == 31 for b in db.daily_metrics_buckets.docs)
+
+    days = await get_user_metrics_range(db, "u1", date(2026, 1, 1), date(2026, 2, 28))
+    assert [(d["date"].day, d["steps"]) for d in days] == [(30, 1000), (31, 9000), (1, 3000), (2, 4000)]
+    assert all(d["user_id"] == "u1" for d in days)
+    assert (await get_daily_metrics(db, "u1", date(2026, 2, 1)))["steps"] == 3000
+    assert await get_daily_metrics(db, "u1", date(2026, 2, 3)) is None
+    assert (await metrics_repository.find_by_id(db, "u1", corrected["_id"]))["steps"] == 9000
+
+    newest = await metrics_repository.find_days(db, "u1", date={"$lt": datetime(2026, 2, 2)}, sort=-1, limit=2)
+    assert [d["date"].day for d in newest] == [1, 31]
+    profile = db.health_profiles.docs[0]
+    assert profile["baseline_metrics"]["steps"]["count"] == 4
+
+
+class RejectingCollection(FakeCollection):
+    """Rejects every bulk operation on one bucket, as a schema validator would."""
+
+    def __init__(self, rejected):
+        super().__init__()
+        self.rejected = rejected
+
+    async def bulk_write(self, ops, ordered=True):
+        await super().bulk_write([op for op in ops if op._filter["_id"] != self.rejected], ordered=ordered)
+        errors = [{"index": i, "code": 121, "errmsg": "Document failed validation"}
+                  for i, op in enumerate(ops) if op._filter["_id"] == self.rejected]
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": []})
+
+
+@pytest.mark.asyncio
+async def test_bucket_bulk_write_reports_failures_by_write(monthly):
+    db = _db()
+    db.daily_metrics_buckets = RejectingCollection("u1:2026-02")
+    days = [datetime(2026, 1, 30), datetime(2026, 2, 1), datetime(2026, 1, 31), datetime(2026, 2, 2)]
+    writes = [DayWrite("u1", day, {"$set": {"steps": i}, "$setOnInsert": {"_id": ObjectId()}}, upsert=True)
+              for i, day in enumerate(days)]
+
+    with pytest.raises(BulkWriteError) as exc:
+        await metrics_repository.bulk_write(db, writes)
+
+    assert [e["index"] for e in exc.value.details["writeErrors"]] == [1, 3]
+    # the other month went through every phase
+    stored = await metrics_repository.find_days(db, "u1", projection={"_id": 0, "date": 1, "steps": 1})
+    assert stored == [{"date": days[0], "steps": 0}, {"date": days[2], "steps": 2}]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_replay_and_deltas_write_slots(monthly):
+    db = _db()
+    start = date(2026, 1, 1)
+    history = [_payload(start + timedelta(days=i), 8000 + 50 * (i % 3)) for i in range(20)]
+    summary = await replay_history(db, "u1", history)
+    assert summary["days"] == 20 and summary["baseline_status"] == "active"
+
+    result = await ingest_metrics(db, "u1", _payload(date(2026, 1, 21), 1500))
+    assert result["deviation_flags"]["steps"] is True
+    stored = await get_daily_metrics(db, "u1", date(2026, 1, 21))
+    assert stored["deviation_flags"]["steps"] is True and stored["risk_score"] > 0
+
+    day = date(2026, 2, 1)
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=300))
+    await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=200, sleep_duration_minutes=400, close=True))
+    [bucket] = [b for b in db.daily_metrics_buckets.docs if b["_id"] == "u1:2026-02"]
+    slot = bucket["days"][0]
+    assert (slot["steps"], slot["sleep_duration_minutes"], slot["closed"]) == (500, 400, True)
+    assert len(db.daily_metrics_buckets.docs) == 2 and db.daily_metrics.docs == []
+
+
+@pytest.mark.asyncio
+async def test_migration_copies_flat_days_into_buckets():
+    db = _db()
+    for user in ("a", "b"):
+        for i in range(45):
+            day = datetime(2026, 1, 1) + timedelta(days=i)
+            db.daily_metrics.docs.append({"_id": ObjectId(), "user_id": user, "date": day, "steps": i,
+                                          "deviation_flags": {"steps": i % 2 == 0}})
+    flat = {user: await metrics_repository.find_days(db, user) for user in ("a", "b")}
+
+    summary = await run_migration(db, chunk_size=20)
+    again = await run_migration(db, chunk_size=20, restart=True)
+
+    assert summary["days"] == again["days"] == 90
+    assert summary["buckets"] == again["buckets"] == 4
+    metrics_repository.use("monthly")
+    try:
+        for user in ("a", "b"):
+            assert await metrics_repository.find_days(db, user) == flat[user]
+    finally:
+        metrics_repository.use("flat")
+    assert len(db[BUCKET_COLLECTION].docs) == 4
+
+
+class TimeSeriesCollection(FakeCollection):
+    """Rejects what MongoDB time-series collections do not support."""
+
+    async def find_one_and_update(self, *args, **kwargs):
+        raise AssertionError("findAndModify on a time-series collection")
+
+    async def update_one(self, q, update, upsert=False):
+        assert not upsert, "upsert on a time-series collection"
+        assert not {"user_id", "date"} & set(update.get("$set", {})), "update of meta/time field"
+        return await super().update_one(q, update)
+
+
+@pytest.mark.asyncio
+async def test_timeseries_layout_emulates_upserts():
+    db = _db()
+    db.daily_metrics = TimeSeriesCollection()
+    metrics_repository.use("timeseries")
+    try:
+        start = date(2026, 1, 1)
+        history = [_payload(start + timedelta(days=i), 8000 + 50 * (i % 3)) for i in range(20)]
+        await replay_history(db, "u1", history)
+        await ingest_metrics(db, "u1", _payload(date(2026, 1, 21), 1500))
+        corrected = await store_daily_metrics(db, "u1", date(2026, 1, 21), 1600, 420, 500, 40.0, 30)
+
+        day = date(2026, 1, 22)
+        await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=300))
+        await apply_metrics_delta(db, "u1", MetricsDelta(date=day, steps=200, close=True))
+
+        days = await get_user_metrics_range(db, "u1", start, day, fields=["steps"])
+        found = await metrics_repository.find_by_id(db, "u1", corrected["_id"])
+    finally:
+        metrics_repository.use("flat")
+
+    assert len(db.daily_metrics.docs) == 22  # one document per day, no duplicates
+    assert [d["steps"] for d in days[-2:]] == [1600, 500]
+    assert found["steps"] == 1600 and found["deviation_flags"]["steps"] is True
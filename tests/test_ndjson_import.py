@@ -0,0 +1,151 @@
+import asyncio
+import json
+from datetime import date, datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from app.api import metrics_routes
+from app.config.settings import settings
+from app.db.client import get_database
+from app.services import ndjson_import
+from app.services.ndjson_import import NdjsonImporter, import_ndjson, iter_lines
+
+from fakes import FakeCollection, FakeDB, profile_doc
+
+
+def _row(user, day, steps=5000):
+    return {
+        "user_id": user,
+        "date": (date(2026, 1, 1) + timedelta(days=day)).isoformat(),
+        "steps": steps,
+        "sleep_duration_minutes": 420,
+        "sedentary_minutes": 600,
+        "location_diversity_score": 50.0,
+        "active_minutes": 30,
+    }
+
+
+def _body(rows):
+    return b"".join(json.dumps(r).encode() + b"\n" for r in rows)
+
+
+async def _chunks(data, size=37):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+class SlowCollection(FakeCollection):
+    """Tracks how many bulk writes are in flight at once."""
+
+    def __init__(self):
+        super().__init__()
+        self.inflight = 0
+        self.max_inflight = 0
+
+    async def bulk_write(self, ops, ordered=True):
+        assert ordered is False
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        await asyncio.sleep(0.001)
+        try:
+            return await super().bulk_write(ops, ordered=ordered)
+        finally:
+            self.inflight -= 1
+
+
+def _db():
+    return FakeDB(daily_metrics=SlowCollection())
+
+
+@pytest.mark.asyncio
+async def test_iter_lines_handles_chunk_boundaries_and_long_lines():
+    data = b'{"a": 1}\n\n' + b"x" * 50 + b'\n{"b": 2}'
+    lines = [line async for line in iter_lines(_chunks(data, 7), max_line_bytes=20)]
+    assert lines == [b'{"a": 1}', b"", None, b'{"b": 2}']
+
+
+@pytest.mark.asyncio
+async def test_raw_import_bounds_buffers_and_flushes():
+    db = _db()
+    rows = [_row(f"user-{u}", d) for d in range(30) for u in range(12)]
+    rows.insert(5, {"user_id": "user-0", "date": "2026-01-01", "steps": -1})
+    rows.insert(9, {"date": "2026-01-01"})
+    lines = _body(rows) + b"not json\n"
+
+    importer = NdjsonImporter(db, replay=False, user_buffer_rows=8, max_buffered_rows=40, max_inflight=2)
+    peak = 0
+    line_no = 0
+    async for line in iter_lines(_chunks(lines), settings.IMPORT_MAX_LINE_BYTES):
+        line_no += 1
+        await importer.add_line(line_no, line)
+        peak = max(peak, importer._buffered)
+    await importer.finish()
+
+    assert peak < 40
+    assert db.daily_metrics.max_inflight <= 2
+    assert importer.stats["stored"] == 360 and len(db.daily_metrics.docs) == 360
+    assert importer.stats["invalid"] == 3
+    assert [e["type"] for e in importer.errors] == ["validation", "missing_user_id", "invalid_json"]
+    assert importer.errors[0]["line"] == 6
+
+
+@pytest.mark.asyncio
+async def test_replay_flushes_of_one_user_stay_in_order(monkeypatch):
+    seen = []
+
+    async def fake_replay(db, user_id, rows):
+        seen.append((user_id, [r.date.day for r in rows]))
+        await asyncio.sleep(0.001 if user_id == "a" else 0)
+        if user_id == "ghost":
+            return None
+        return {"failed_dates": set()}
+
+    monkeypatch.setattr(ndjson_import, "replay_history", fake_replay)
+    rows = [_row(u, d) for d in range(9) for u in ("a", "b", "ghost")]
+    report = await import_ndjson(_db(), _chunks(_body(rows)))
+
+    a_days = [d for user, days in seen if user == "a" for d in days]
+    assert a_days == list(range(1, 10))
+    assert report["stored"] == 18 and report["failed"] == 9
+    assert report["errors"][0]["type"] == "no_profile"
+    assert report["rows_per_second"] is not None
+
+
+@pytest.mark.asyncio
+async def test_import_route_requires_key_and_ndjson(monkeypatch):
+    app = FastAPI()
+    app.include_router(metrics_routes.router)
+    db = _db()
+    app.dependency_overrides[get_database] = lambda: db
+    body = _body([_row("u1", d) for d in range(5)])
+    headers = {"content-type": "application/x-ndjson", "x-import-key": "secret"}
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        disabled = await client.post("/metrics/import", content=body, headers=headers)
+        monkeypatch.setattr(settings, "METRICS_IMPORT_KEY", "secret")
+        wrong_type = await client.post("/metrics/import", content=body,
+                                       headers={**headers, "content-type": "application/json"})
+        ok = await client.post("/metrics/import?replay=false", content=body, headers=headers)
+
+    assert disabled.status_code == 403
+    assert wrong_type.status_code == 415
+    assert ok.status_code == 200 and ok.json()["stored"] == 5
+    assert len(db.daily_metrics.docs) == 5
+
+
+@pytest.mark.asyncio
+async def test_raw_import_clears_intraday_state_and_replays_collecting_users():
+    db = FakeDB(daily_metrics=SlowCollection(), health_profiles=FakeCollection([profile_doc("collecting-user")]))
+    open_day = {"user_id": "raw-user", "date": datetime(2026, 1, 1), "steps": 10, "intraday": True,
+                "baseline_sample": {"steps": 10}, "pipeline_at": datetime(2026, 1, 1, 9)}
+    db.daily_metrics.docs.append(open_day)
+    rows = [_row("raw-user", 0)] + [_row("collecting-user", d) for d in range(3)]
+    report = await import_ndjson(db, _chunks(_body(rows)), replay=False)
+
+    assert report["stored"] == 4
+    assert open_day["steps"] == 5000 and not {"intraday", "baseline_sample", "pipeline_at"} & set(open_day)
+    profile = db.health_profiles.docs[0]
+    assert profile["baseline_days_collected"] == 3
+    assert profile["baseline_metrics"]["steps"]["count"] == 3
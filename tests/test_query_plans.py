@@ -0,0 +1,187 @@
+"""
+Query-plan check for the index registry, against a real mongod.
+
+Runs the hot service paths on a scratch database with the registry applied,
+records every filter they send (through a recording proxy around the
+database) and runs ``explain()`` on each one. A plan with a COLLSCAN stage
+fails the test with the collection and filter.
+
+Skipped unless MONGODB_TEST_URI points at a server, e.g.
+
+    MONGODB_TEST_URI=mongodb://localhost:27017 pytest tests/test_query_plans.py
+"""
+import os
+import uuid
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app.db.indexes import ensure_indexes, registry
+from app.models.metrics_model import MetricsCreate, MetricsDelta
+from app.services import alert_service, auth_service, chat_history_service, user_service
+from app.services.ai_service import get_latest_insights
+from app.services.daily_metrics_service import get_user_metrics_range
+from app.services.dashboard_service import get_dashboard_data
+from app.services.health_profile_service import create_health_profile, get_health_profile
+from app.services.health_service import query_trends, store_health_samples
+from app.services.intraday_service import apply_metrics_delta
+from app.services.metrics_repository import metrics_repository
+from app.services.metrics_service import ingest_metrics
+from app.services.replay_service import replay_history
+from app.services.sample_rollup import run_rollup_cycle
+from app.utils.tokens import hash_token
+
+MONGODB_TEST_URI = os.environ.get("MONGODB_TEST_URI")
+
+pytestmark = pytest.mark.skipif(not MONGODB_TEST_URI, reason="MONGODB_TEST_URI not set")
+
+FILTER_METHODS = {
+    "find", "find_one", "find_one_and_update", "update_one", "update_many",
+    "delete_one", "delete_many", "count_documents",
+}
+
+# filters sent from the auth dependency and refresh middleware (not services)
+ROUTE_QUERIES = [
+    ("users", {"user_id": "u1"}),
+    ("users", {"email": "u1@example.com"}),
+    ("refresh_tokens", {"token_hash": "h", "revoked": False, "expires_at": {"$gt": datetime(2026, 1, 1)}}),
+    ("devices", {"fingerprint": "d1", "user_id": "u1"}),
+]
+
+
+class RecordingCollection:
+    def __init__(self, collection, log):
+        self._collection = collection
+        self._log = log
+
+    def _record(self, query):
+        if query:
+            self._log.append((self._collection.name, query))
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in FILTER_METHODS:
+            def call(*args, **kwargs):
+                self._record(args[0] if args else kwargs.get("filter"))
+                return attr(*args, **kwargs)
+            return call
+        if name == "aggregate":
+            def aggregate(pipeline, **kwargs):
+                if pipeline and "$match" in pipeline[0]:
+                    self._record(pipeline[0]["$match"])
+                return attr(pipeline, **kwargs)
+            return aggregate
+        if name == "bulk_write":
+            def bulk_write(ops, **kwargs):
+                for op in ops:
+                    self._record(getattr(op, "_filter", None))
+                return attr(ops, **kwargs)
+            return bulk_write
+        return attr
+
+
+class RecordingDB:
+    def __init__(self, db):
+        self._db = db
+        self.log = []
+
+    def __getitem__(self, name):
+        return RecordingCollection(self._db[name], self.log)
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def _collscans(plan):
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_collscans(v) for v in plan.values())
+    if isinstance(plan, list):
+        return any(_collscans(v) for v in plan)
+    return False
+
+
+@pytest.fixture
+def scratch_db():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(MONGODB_TEST_URI)
+    name = f"test_query_plans_{uuid.uuid4().hex[:8]}"
+    previous = metrics_repository.layout
+    metrics_repository.use("flat")
+    yield client, name
+    metrics_repository.layout = previous
+    client.close()
+
+
+def _payload(day, steps):
+    return MetricsCreate(date=day, steps=steps, sleep_duration_minutes=420, sedentary_minutes=500,
+                         location_diversity_score=40.0, active_minutes=30, screen_time_minutes=100)
+
+
+@pytest.mark.asyncio
+async def test_registry_is_idempotent_and_unique_day(scratch_db):
+    client, name = scratch_db
+    db = client[name]
+    try:
+        first = await ensure_indexes(db)
+        again = await ensure_indexes(db)
+        assert sorted(first) == sorted(again) and len(first) == len(registry())
+        info = await db.daily_metrics.index_information()
+        assert any(i["key"] == [("user_id", 1), ("date", 1)] and i.get("unique") for i in info.values())
+    finally:
+        await client.drop_database(name)
+
+
+@pytest.mark.asyncio
+async def test_service_queries_use_indexes(scratch_db):
+    client, name = scratch_db
+    raw = client[name]
+    try:
+        await ensure_indexes(raw)
+        db = RecordingDB(raw)
+        user_id = "u1"
+        await raw.users.insert_one({"user_id": user_id, "email": "u1@example.com", "name": "U"})
+        await create_health_profile(db, user_id)
+
+        start = date(2026, 1, 1)
+        await replay_history(db, user_id, [_payload(start + timedelta(days=i), 8000 + 10 * i) for i in range(20)])
+        await ingest_metrics(db, user_id, _payload(date(2026, 1, 21), 1200))
+        await apply_metrics_delta(db, user_id, MetricsDelta(date=date(2026, 1, 22), steps=300, close=True))
+        await get_user_metrics_range(db, user_id, start, date(2026, 1, 22), fields=["steps"])
+        await get_dashboard_data(db, user_id)
+        await get_latest_insights(db, user_id)
+        await get_health_profile(db, user_id)
+        await user_service.get_profile(db, user_id)
+
+        await chat_history_service.save_chat_message(db, user_id, "user", "hi")
+        await chat_history_service.get_chat_history(db, user_id)
+        await alert_service.create_alert(db, user_id, "steps", "high", "low activity")
+        await alert_service.list_alerts(db, user_id)
+
+        await auth_service.store_refresh_token(db, user_id, "refresh-1", device_id="d1")
+        await auth_service.rotate_refresh_token(db, "refresh-1", user_id, "d1")
+        otp = await auth_service.generate_device_otp(db, user_id, "d1")
+        assert await auth_service.mark_device_trusted(db, user_id, "d1", otp)
+
+        now = datetime.utcnow()
+        await store_health_samples(db, user_id, [
+            {"type": "steps", "timestamp": now - timedelta(minutes=i), "value": 10} for i in range(30)
+        ])
+        await run_rollup_cycle(db, "plans")
+        await query_trends(db, user_id, "steps")
+
+        queries = db.log + ROUTE_QUERIES + [("refresh_tokens", {
+            "token_hash": hash_token("refresh-1"), "revoked": False, "expires_at": {"$gt": now},
+        })]
+        assert len({coll for coll, _ in queries}) >= 10
+
+        scans = []
+        for coll, query in queries:
+            plan = await raw.command("explain", {"find": coll, "filter": query}, verbosity="queryPlanner")
+            if _collscans(plan["queryPlanner"]["winningPlan"]):
+                scans.append(f"{coll}: {query}")
+        assert not scans, "queries without an index:\n" + "\n".join(scans)
+    finally:
+        await client.drop_database(name)
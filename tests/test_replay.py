@@ -0,0 +1,212 @@
+import copy
+from datetime import date, datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from pymongo.errors import BulkWriteError
+
+from app import deps
+from app.api import metrics_routes
+from app.config.settings import settings
+from app.db.client import get_database
+from app.models.metrics_model import MetricsCreate
+from app.services import replay_service
+from app.services.metrics_repository import metrics_repository
+from app.services.metrics_service import ingest_metrics, ingest_metrics_batch
+from app.services.replay_service import replay_history
+from app.services.scoring_executor import scoring_executor
+
+from fakes import FakeCollection, FakeDB, profile_doc
+
+
+def _db(stored):
+    return FakeDB(health_profiles=FakeCollection([profile_doc()]), daily_metrics=FakeCollection(copy.deepcopy(stored)))
+
+
+def _history():
+    start = date(2026, 1, 1)
+    payloads = []
+    for i in range(40):
+        dip = 22 <= i <= 27
+        payloads.append(MetricsCreate(
+            date=start + timedelta(days=i),
+            steps=(2500 if dip else 8000) + 137 * (i % 5),
+            sleep_duration_minutes=(300 if dip else 420) + 11 * (i % 3),
+            sedentary_minutes=500 + 9 * (i % 7),
+            location_diversity_score=40.0 + i % 4,
+            active_minutes=(10 if dip else 35) + i % 6,
+            screen_time_minutes=200 if i % 2 else None,
+        ))
+    # a correction of an earlier day inside the same upload
+    payloads.append(payloads[25].model_copy(update={"steps": 9100}))
+    return payloads
+
+
+def _snapshot(db):
+    volatile = {"_id", "created_at", "updated_at", "date"}
+    daily = {d["date"]: {k: v for k, v in d.items() if k not in volatile - {"date"}}
+             for d in db.daily_metrics.docs}
+    insights = [{k: v for k, v in i.items() if k not in volatile} for i in db.ai_insights.docs]
+    profile = {k: v for k, v in db.health_profiles.docs[0].items() if k not in volatile}
+    return daily, insights, profile
+
+
+@pytest.mark.asyncio
+async def test_replay_matches_day_by_day_ingestion():
+    # a stored day before the upload provides trend context
+    stored = [{"_id": "old", "user_id": "u1", "date": datetime(2025, 12, 31), "steps": 1,
+               "sleep_duration_minutes": 1, "sedentary_minutes": 1,
+               "location_diversity_score": 1.0, "active_minutes": 1}]
+
+    one_by_one = _db(stored)
+    for payload in sorted(_history(), key=lambda p: p.date):
+        await ingest_metrics(one_by_one, "u1", payload)
+
+    replayed = _db(stored)
+    # out of date order; the correction still comes after the original day
+    history = _history()
+    summary = await replay_history(replayed, "u1", history[20:] + history[:20])
+
+    expected_daily, expected_insights, expected_profile = _snapshot(one_by_one)
+    daily, insights, profile = _snapshot(replayed)
+    assert daily == expected_daily
+    assert insights == expected_insights
+    assert profile == expected_profile
+
+    assert summary["days"] == 40
+    assert summary["activated_on"] == date(2026, 1, 14)
+    assert summary["insights"] == len(expected_insights) == 28
+    assert any(d.get("deviation_flags", {}).get("steps") for d in daily.values())
+    stamps = [i["date"] for i in replayed.ai_insights.docs]
+    assert stamps == sorted(stamps) and len(set(stamps)) == len(stamps)
+
+
+@pytest.mark.asyncio
+async def test_replay_without_profile():
+    db = _db([])
+    db.health_profiles.docs = []
+    assert await replay_history(db, "u1", _history()[:3]) is None
+    assert db.daily_metrics.docs == []
+
+
+@pytest.mark.asyncio
+async def test_batch_reports_per_item_status(monkeypatch):
+    db = _db([])
+    items = [p.model_dump(mode="json") for p in _history()[:20]]
+    items.insert(3, {"date": "2026-02-01", "steps": -5})
+    bad_day = datetime(2026, 1, 7)
+    real_bulk_write = db.daily_metrics.bulk_write
+
+    async def bulk_write(ops, ordered=True):
+        # one upsert is rejected by the server, the rest still apply
+        keep = [op for op in ops if op._filter["date"] != bad_day]
+        await real_bulk_write(keep, ordered=ordered)
+        errors = [{"index": i, "code": 11000, "errmsg": "dup"} for i, op in enumerate(ops) if op._filter["date"] == bad_day]
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    monkeypatch.setattr(db.daily_metrics, "bulk_write", bulk_write)
+    result = await ingest_metrics_batch(db, "u1", items)
+
+    assert (result["stored"], result["invalid"], result["failed"]) == (19, 1, 1)
+    assert result["baseline_status"] == "active"
+    invalid = result["items"][3]
+    assert invalid["status"] == "invalid" and invalid["errors"][0]["loc"] == ["steps"]
+    assert result["items"][7]["status"] == "error"
+    last = result["items"][-1]
+    assert last["status"] == "stored" and last["date"] == date(2026, 1, 20)
+    assert last["deviation_flags"] is not None and last["risk_score"] == result["risk_score"]
+    assert len(db.daily_metrics.docs) == 19
+    # the rejected day is left out of the baseline and gets no insight
+    assert db.health_profiles.docs[0]["baseline_metrics"]["steps"]["count"] == 19
+    assert len(db.ai_insights.docs) == 19 - 13
+
+
+@pytest.mark.asyncio
+async def test_batch_route_is_one_request():
+    app = FastAPI()
+    app.include_router(metrics_routes.router)
+    db = _db([])
+
+    async def _user():
+        return {"user_id": "u1"}
+
+    app.dependency_overrides[deps.get_current_user] = _user
+    app.dependency_overrides[get_database] = lambda: db
+    items = [p.model_dump(mode="json") for p in _history()[:30]]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        resp = await client.post("/metrics/batch", json=items)
+        too_many = await client.post("/metrics/batch", json=[{}] * (settings.METRICS_BATCH_MAX_ITEMS + 1))
+
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["stored"] == 30 and [i["status"] for i in body["items"]] == ["stored"] * 30
+    assert len(db.daily_metrics.docs) == 30 and len(db.ai_insights.docs) == 17
+    assert too_many.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_replay_writes_only_the_replayed_baseline_entries(monkeypatch):
+    db = _db([])
+    real_pass = replay_service.replay_pass
+
+    def replay_pass(*args):
+        # another write lands on the profile while the replay runs
+        db.health_profiles.docs[0]["baseline_metrics"]["legacy"] = {"count": 3}
+        return real_pass(*args)
+
+    monkeypatch.setattr(scoring_executor, "processes", 0)
+    monkeypatch.setattr(replay_service, "replay_pass", replay_pass)
+    await replay_history(db, "u1", _history()[:5])
+
+    baseline = db.health_profiles.docs[0]["baseline_metrics"]
+    assert baseline["legacy"] == {"count": 3}
+    assert baseline["steps"]["count"] == 5
+
+
+@pytest.mark.asyncio
+async def test_replay_failed_dates_with_bucket_layout(monkeypatch):
+    metrics_repository.use("monthly")
+    try:
+        db = _db([])
+        buckets = db.daily_metrics_buckets
+        real_bulk_write = buckets.bulk_write
+
+        async def bulk_write(ops, ordered=True):
+            # the February bucket is rejected in every phase
+            rejected = [i for i, op in enumerate(ops) if op._filter["_id"] == "u1:2026-02"]
+            await real_bulk_write([op for i, op in enumerate(ops) if i not in rejected], ordered=ordered)
+            if rejected:
+                raise BulkWriteError({"writeErrors": [{"index": i, "code": 121, "errmsg": "invalid"}
+                                                      for i in rejected]})
+
+        monkeypatch.setattr(buckets, "bulk_write", bulk_write)
+        summary = await replay_history(db, "u1", _history())
+    finally:
+        metrics_repository.use("flat")
+
+    feb = {datetime(2026, 2, 1) + timedelta(days=i) for i in range(9)}
+    assert summary["failed_dates"] == feb and summary["failed"] == 9
+
+
+@pytest.mark.asyncio
+async def test_history_route_limits_items(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_HISTORY_MAX_ITEMS", 5)
+    app = FastAPI()
+    app.include_router(metrics_routes.router)
+    db = _db([])
+
+    async def _user():
+        return {"user_id": "u1"}
+
+    app.dependency_overrides[deps.get_current_user] = _user
+    app.dependency_overrides[get_database] = lambda: db
+    items = [p.model_dump(mode="json") for p in _history()[:6]]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        too_many = await client.post("/metrics/history", json=items)
+        ok = await client.post("/metrics/history", json=items[:5])
+
+    assert too_many.status_code == 400
+    assert too_many.json()["detail"]["error_type"] == "batch_too_large"
+    assert ok.status_code == 200 and len(db.daily_metrics.docs) == 5
@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.jobs import rescore
+from app.services.vector_engine import score_user_window
+
+from fakes import FakeCollection, FakeDB
+
+
+def _setup(n_users=5, days=10):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    profiles, metrics = [], []
+    for u in range(n_users):
+        uid = f"user-{u}"
+        profiles.append({
+            "user_id": uid,
+            "baseline_status": "active",
+            "enabled_signals": {},
+            "baseline_metrics": {"steps": {"mean": 8000.0, "std": 1000.0}, "sleep": {"mean": 420.0, "std": 30.0}},
+        })
+        for d in range(days):
+            metrics.append({
+                "_id": f"{uid}-{d}",
+                "user_id": uid,
+                "date": today - timedelta(days=days - 1 - d),
+                "steps": 8000 - 400 * d,
+                "sleep_duration_minutes": 420,
+            })
+    profiles.append({"user_id": "collecting", "baseline_status": "collecting"})
+    return FakeDB(health_profiles=FakeCollection(profiles), daily_metrics=FakeCollection(metrics))
+
+
+@pytest.mark.asyncio
+async def test_rescore_writes_flags_insights_and_checkpoint():
+    db = _setup()
+    summary = await rescore.run_rescore(db, chunk_size=2, workers=3, window_days=5)
+
+    assert summary["processed"] == 5 and summary["rescored"] == 5
+    assert len(db.ai_insights.docs) == 5
+    assert db.job_checkpoints.docs[0]["done"] is True
+    assert db.job_checkpoints.docs[0]["last_user_id"] == "user-4"
+
+    user_docs = sorted((d for d in db.daily_metrics.docs if d["user_id"] == "user-0"), key=lambda d: d["date"])
+    expected = score_user_window(db.health_profiles.docs[0], user_docs[-8:])
+    rescored = [d for d in user_docs if "deviation_flags" in d]
+    assert len(rescored) == 5
+    assert [d["deviation_flags"] for d in rescored] == [e["deviation_flags"] for e in expected[-5:]]
+    assert db.health_profiles.docs[0]["risk_score"] == expected[-1]["risk_score"]
+
+
+@pytest.mark.asyncio
+async def test_rescore_resumes_from_checkpoint():
+    db = _setup()
+    await rescore.save_checkpoint(db, rescore.JOB_NAME, "user-2", 3)
+    summary = await rescore.run_rescore(db, chunk_size=2, workers=2, window_days=5)
+
+    assert summary["processed"] == 5 and summary["rescored"] == 2
+    assert sorted(i["user_id"] for i in db.ai_insights.docs) == ["user-3", "user-4"]
+
+
+@pytest.mark.asyncio
+async def test_rescore_skips_users_with_only_context_days():
+    db = _setup(n_users=2, days=10)
+    # user-1 has nothing inside the 5-day window, only trend context before it
+    db.daily_metrics.docs = [d for d in db.daily_metrics.docs
+                             if d["user_id"] == "user-0" or d["date"] < datetime.utcnow() - timedelta(days=6)]
+    summary = await rescore.run_rescore(db, chunk_size=2, workers=1, window_days=5)
+
+    assert summary["rescored"] == 1
+    assert [i["user_id"] for i in db.ai_insights.docs] == ["user-0"]
+    assert "risk_score" not in db.health_profiles.docs[1]
+
+
+@pytest.mark.asyncio
+async def test_rescore_trend_context_skips_missing_days():
+    db = _setup(n_users=1, days=14)
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    # nothing stored for the 3 days right before the 5-day window
+    gap = {today - timedelta(days=d) for d in (5, 6, 7)}
+    db.daily_metrics.docs = [d for d in db.daily_metrics.docs if d["date"] not in gap]
+    # a normal window after a low-steps run, so only the trend can flag its first day
+    for doc in db.daily_metrics.docs:
+        doc["steps"] = 3000 if doc["date"] < today - timedelta(days=7) else 8000
+    await rescore.run_rescore(db, chunk_size=2, workers=1, window_days=5)
+
+    user_docs = sorted(db.daily_metrics.docs, key=lambda d: d["date"])
+    expected = score_user_window(db.health_profiles.docs[0], user_docs[-8:])
+    rescored = [d for d in user_docs if "deviation_flags" in d]
+    assert len(rescored) == 5
+    assert [d["deviation_flags"] for d in rescored] == [e["deviation_flags"] for e in expected[-5:]]
+    assert [d["deviation_flags"]["steps"] for d in rescored] == [True, False, False, False, False]
+
+
+@pytest.mark.asyncio
+async def test_rescore_raises_when_a_worker_fails(monkeypatch):
+    db = _setup(n_users=20)
+
+    async def boom(db, chunk, window_days):
+        raise RuntimeError("bulk write failed")
+
+    monkeypatch.setattr(rescore, "rescore_chunk", boom)
+    # chunk_size=1 and one worker fill the queue, so the producer would block forever
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(rescore.run_rescore(db, chunk_size=1, workers=1, window_days=5), timeout=2)
+    assert not db.job_checkpoints.docs
@@ -0,0 +1,88 @@
+import random
+import statistics
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.config.settings import settings
+from app.services.ai_service import evaluate_daily_deviations
+from app.services.baseline_service import apply_metrics_change, resolve_baseline
+from app.services.robust_baseline import MAD_SCALE, SlidingWindow
+from app.services.vector_engine import score_user_window
+
+
+def _mad(values):
+    m = statistics.median(values)
+    return statistics.median(abs(v - m) for v in values)
+
+
+def test_window_matches_statistics_under_churn():
+    rng = random.Random(5)
+    start = datetime(2026, 1, 1)
+    window = SlidingWindow(max_days=30)
+    reference = {}
+    for i in range(200):
+        day = start + timedelta(days=rng.randint(0, i // 2 + 40))
+        if rng.random() < 0.15 and reference:
+            day = rng.choice(sorted(reference))
+            window.remove(day)
+            reference.pop(day)
+        else:
+            value = float(rng.choice([rng.randint(0, 20), rng.uniform(-50, 50)]))
+            window.add(day, value)
+            reference[day] = value
+        if reference:
+            cutoff = max(reference) - timedelta(days=29)
+            reference = {d: v for d, v in reference.items() if d >= cutoff}
+        assert list(window.dates) == sorted(reference)
+        assert sorted(window.values) == window.sorted == sorted(reference.values())
+        if reference:
+            assert window.median() == pytest.approx(statistics.median(reference.values()))
+            assert window.mad() == pytest.approx(_mad(list(reference.values())))
+
+
+def test_outlier_day_barely_moves_robust_baseline(monkeypatch):
+    baseline = {}
+    start = datetime(2026, 1, 5)
+    steps = [8000, 8200, 7900, 8100, 8050, 7950, 8150, 40, 8000, 8100]
+    for i, value in enumerate(steps):
+        baseline.update(apply_metrics_change(baseline, None, {"date": start + timedelta(days=i), "steps": value},
+                                             mode="robust"))
+
+    entry = baseline["steps"]
+    robust = resolve_baseline(entry, mode="robust")
+    assert robust["mean"] == pytest.approx(statistics.median(steps))
+    assert robust["std"] == pytest.approx(MAD_SCALE * _mad(steps))
+    # the charger day drags the running mean down and inflates std
+    assert entry["std"] > 10 * robust["std"]
+
+    profile = {"baseline_status": "active", "enabled_signals": {}, "baseline_metrics": baseline}
+    today = {"date": start + timedelta(days=len(steps)), "steps": 7000}
+    monkeypatch.setattr(settings, "AI_MODEL_TYPE", "robust")
+    assert evaluate_daily_deviations(profile, today, [])["steps"] is True
+    assert score_user_window(profile, [today])[0]["deviation_flags"]["steps"] is True
+    monkeypatch.setattr(settings, "AI_MODEL_TYPE", "baseline")
+    assert evaluate_daily_deviations(profile, today, [])["steps"] is False
+
+
+def test_window_evicts_days_older_than_history(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_HISTORY_DAYS", 7)
+    monkeypatch.setattr(settings, "AI_MODEL_TYPE", "robust")
+    baseline = {}
+    start = datetime(2026, 1, 1)
+    for i in range(20):
+        baseline.update(apply_metrics_change(baseline, None, {"date": start + timedelta(days=i), "steps": i}))
+    state = baseline["steps"]["robust"]
+    assert state["values"] == list(range(13, 20))
+    assert resolve_baseline(baseline["steps"], mode="robust")["mean"] == 16
+
+
+def test_entries_only_keep_the_state_of_their_mode():
+    day = {"date": datetime(2026, 1, 5), "steps": 8000}
+    baseline = apply_metrics_change({}, None, day)
+    assert "weekday" in baseline["steps"] and "robust" not in baseline["steps"]
+
+    # switching modes drops the other mode's state on the next write
+    robust = apply_metrics_change(baseline, None, {**day, "date": datetime(2026, 1, 6)}, mode="robust")
+    assert robust["steps"]["count"] == 2 and "weekday" not in robust["steps"]
+    assert robust["steps"]["robust"]["values"] == [8000.0]
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from app.services import sample_rollup
+from app.services.health_service import store_health_samples
+from app.services.sample_rollup import rollup_user_samples, run_rollup_cycle
+
+from fakes import FakeCollection, FakeCursor, FakeDB, matches
+
+
+class SampleCollection(FakeCollection):
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        self.inserted = 0
+
+    async def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            # ObjectIds carry the insert time; the test drives it through `clock`
+            self.inserted += 1
+            stamp = ObjectId.from_datetime(self.clock[0]).binary[:4]
+            doc.setdefault("_id", ObjectId(stamp + self.inserted.to_bytes(8, "big")))
+        return await super().insert_many(docs, ordered=ordered)
+
+    def aggregate(self, pipeline):
+        # $match, then $group by ($dateTrunc day of timestamp, type) summing value
+        match, group = pipeline[0]["$match"], pipeline[1]["$group"]
+        totals = {}
+        for doc in self.docs:
+            if matches(doc, match):
+                key = (doc["timestamp"].replace(hour=0, minute=0, second=0, microsecond=0), doc["type"])
+                totals[key] = totals.get(key, 0) + doc["value"]
+        assert "total" in group
+        return FakeCursor([{"_id": {"day": day, "type": t}, "total": v} for (day, t), v in totals.items()])
+
+
+def _db():
+    clock = [datetime.utcnow()]
+    return FakeDB(clock=clock, health=SampleCollection(clock))
+
+
+DAY = datetime(2026, 2, 21)
+
+
+def _samples(*rows):
+    return [{"type": t, "timestamp": DAY + timedelta(hours=h, minutes=m), "value": v} for t, h, m, v in rows]
+
+
+def _later(db):
+    """A rollup time after the lag, then move the insert clock past it."""
+    now = db.clock[0] + timedelta(minutes=1)
+    db.clock[0] += timedelta(minutes=2)
+    return now
+
+
+@pytest.mark.asyncio
+async def test_samples_roll_up_once_into_daily_metrics():
+    db = _db()
+    stored = await store_health_samples(db, "u1", _samples(
+        ("steps", 8, 0, 100), ("steps", 8, 1, 50), ("sleep", 2, 0, 60), ("sedentary", 9, 0, 1),
+        ("heart_rate", 9, 0, 70), ("steps", 26, 0, 40),  # next day
+    ))
+    assert stored == 6 and db.health_rollups.docs[0]["dirty"] is True
+
+    assert await rollup_user_samples(db, "u1", "w1", _later(db)) == 2
+    day = next(d for d in db.daily_metrics.docs if d["date"] == DAY)
+    assert (day["steps"], day["sleep_duration_minutes"], day["sedentary_minutes"]) == (150, 60, 1)
+    assert next(d for d in db.daily_metrics.docs if d["date"] == DAY + timedelta(days=1))["steps"] == 40
+    assert db.health_rollups.docs[0]["dirty"] is False
+
+    # nothing new: the high-water mark keeps samples from counting twice
+    assert await run_rollup_cycle(db, "w1") == 0
+    assert await rollup_user_samples(db, "u1", "w1", _later(db)) == 0
+    assert day["steps"] == 150
+
+    await store_health_samples(db, "u1", _samples(("steps", 10, 0, 25), ("sleep", 3, 0, 30)))
+    assert await rollup_user_samples(db, "u1", "w1", _later(db)) == 1
+    # counters add the new samples; sleep is re-summed over the whole day
+    assert (day["steps"], day["sleep_duration_minutes"]) == (175, 90)
+
+
+@pytest.mark.asyncio
+async def test_recent_samples_wait_for_the_lag():
+    db = _db()
+    await store_health_samples(db, "u1", _samples(("steps", 8, 0, 100)))
+    assert await rollup_user_samples(db, "u1", "w1", db.clock[0]) == 0
+    assert db.daily_metrics.docs == []
+    assert db.health_rollups.docs[0]["dirty"] is True  # picked up by a later pass
+    assert await rollup_user_samples(db, "u1", "w1", _later(db)) == 1
+
+
+@pytest.mark.asyncio
+async def test_interrupted_rollup_resumes_without_double_counting(monkeypatch):
+    db = _db()
+    await store_health_samples(db, "u1", _samples(("steps", 8, 0, 100), ("steps", 32, 0, 70)))
+    real_apply = sample_rollup.apply_metrics_delta
+    calls = []
+
+    async def crash_on_second_day(db_, user_id, delta):
+        calls.append(delta.date)
+        if len(calls) == 2:
+            raise RuntimeError("worker died")
+        return await real_apply(db_, user_id, delta)
+
+    monkeypatch.setattr(sample_rollup, "apply_metrics_delta", crash_on_second_day)
+    with pytest.raises(RuntimeError):
+        await rollup_user_samples(db, "u1", "w1", _later(db))
+    monkeypatch.setattr(sample_rollup, "apply_metrics_delta", real_apply)
+
+    # another worker cannot take over while a lease is held
+    state = db.health_rollups.docs[0]
+    state.update(owner="w1", lease_until=datetime.utcnow() + timedelta(minutes=5))
+    assert await rollup_user_samples(db, "u1", "w2", _later(db)) is None
+    state["lease_until"] = datetime.utcnow()  # expired
+    assert await rollup_user_samples(db, "u1", "w2", _later(db)) == 1
+    assert sorted(d["steps"] for d in db.daily_metrics.docs) == [70, 100]
+
+
+@pytest.mark.asyncio
+async def test_high_water_mark_never_moves_back():
+    db = _db()
+    await store_health_samples(db, "u1", _samples(("steps", 8, 0, 100)))
+    assert await rollup_user_samples(db, "u1", "w1", _later(db)) == 1
+    mark = db.health_rollups.docs[0]["last_id"]
+    # a worker whose clock is behind finds nothing and keeps the mark
+    assert await rollup_user_samples(db, "u1", "w2", datetime.utcnow() - timedelta(hours=1)) == 0
+    assert db.health_rollups.docs[0]["last_id"] == mark
+    assert db.daily_metrics.docs[0]["steps"] == 100
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.ai_pipeline import score_day
+from app.services.replay_service import replay_pass
+from app.services.scoring_executor import ScoringExecutor
+
+NOW = datetime(2026, 3, 20, 12)
+
+
+def _profile():
+    return {
+        "user_id": "u1",
+        "baseline_status": "active",
+        "baseline_days_collected": 20,
+        "enabled_signals": {"location": False},
+        "baseline_metrics": {
+            "steps": {"count": 20, "mean": 8000.0, "m2": 20 * 1000.0 ** 2, "std": 1000.0},
+            "sleep": {"count": 20, "mean": 420.0, "m2": 20 * 30.0 ** 2, "std": 30.0},
+        },
+    }
+
+
+def _days(n=6):
+    return [
+        {"_id": f"d{i}", "user_id": "u1", "date": datetime(2026, 3, 10) + timedelta(days=i),
+         "steps": 8000 - 900 * i, "sleep_duration_minutes": 420 - 20 * i, "sedentary_minutes": 500,
+         "location_diversity_score": 40.0, "active_minutes": 30, "screen_time_minutes": 100}
+        for i in range(n)
+    ]
+
+
+def _without_clock(result):
+    # build_insight stamps the insight with the time it ran
+    insight = {k: v for k, v in result["insight"].items() if k not in ("date", "created_at", "updated_at")}
+    return {**result, "insight": insight}
+
+
+@pytest.fixture(params=[0, 2], ids=["inline", "process-pool"])
+def executor(request):
+    executor = ScoringExecutor(processes=request.param, chunk_size=2)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_score_day_matches_direct_call(executor):
+    days = _days()
+    args = ("u1", _profile(), days[-1], list(reversed(days[:-1])))
+
+    result = await executor.run(score_day, *args)
+
+    assert _without_clock(result) == _without_clock(score_day(*args))
+    assert result["deviation_flags"]["steps"] is True
+
+
+@pytest.mark.asyncio
+async def test_replay_pass_matches_direct_call(executor):
+    stored = _days()
+    metrics = [{k: v for k, v in d.items() if k != "_id"} for d in stored[2:]]
+    args = ("u1", _profile(), metrics, stored, NOW)
+
+    result = await executor.run(replay_pass, *args)
+
+    assert result == replay_pass(*args)
+    assert len(result["insights"]) == 4
+    # the caller's profile is not modified by either run
+    assert args[1] == _profile()
@@ -0,0 +1,106 @@
+"""
+Time-series storage against a real mongod (7.0+).
+
+Skipped unless MONGODB_TEST_URI points at a server, e.g.
+
+    MONGODB_TEST_URI=mongodb://localhost:27017 pytest tests/test_timeseries_mongo.py
+
+Each test uses (and drops) its own scratch database.
+"""
+import os
+import uuid
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.config.settings import settings
+from app.db.client import close_mongo, connect_to_mongo
+from app.models.metrics_model import MetricsDelta
+from app.services.daily_metrics_service import get_user_metrics_range, store_daily_metrics
+from app.services.health_service import query_trends, store_health_entry
+from app.services.intraday_service import apply_metrics_delta
+from app.services.metrics_repository import metrics_repository
+
+MONGODB_TEST_URI = os.environ.get("MONGODB_TEST_URI")
+
+pytestmark = pytest.mark.skipif(not MONGODB_TEST_URI, reason="MONGODB_TEST_URI not set")
+
+
+@pytest.fixture
+def timeseries(monkeypatch):
+    monkeypatch.setattr(settings, "MONGODB_URI", MONGODB_TEST_URI)
+    monkeypatch.setattr(settings, "DATABASE_NAME", f"test_timeseries_{uuid.uuid4().hex[:8]}")
+    monkeypatch.setattr(settings, "DAILY_METRICS_LAYOUT", "timeseries")
+    metrics_repository.use("timeseries")
+    yield SimpleNamespace(state=SimpleNamespace())
+    metrics_repository.use("flat")
+
+
+async def _connect(app):
+    await connect_to_mongo(app)
+    return app.state.db
+
+
+async def _drop(app):
+    await app.state.mongo_client.drop_database(settings.DATABASE_NAME)
+    await close_mongo(app)
+
+
+@pytest.mark.asyncio
+async def test_collections_are_created_as_time_series(timeseries):
+    db = await _connect(timeseries)
+    try:
+        # a second startup leaves the existing collections alone
+        await connect_to_mongo(timeseries)
+        db = timeseries.state.db
+        infos = {info["name"]: info async for info in await db.list_collections()}
+        assert infos["daily_metrics"]["type"] == "timeseries"
+        assert infos["daily_metrics"]["options"]["timeseries"]["timeField"] == "date"
+        assert infos["daily_metrics"]["options"]["timeseries"]["metaField"] == "user_id"
+        assert infos["health"]["type"] == "timeseries"
+    finally:
+        await _drop(timeseries)
+
+
+@pytest.mark.asyncio
+async def test_days_round_trip_through_time_series(timeseries):
+    db = await _connect(timeseries)
+    try:
+        await db.health_profiles.insert_one({
+            "user_id": "u1", "baseline_status": "collecting", "baseline_days_collected": 0,
+            "enabled_signals": {"location": False}, "baseline_metrics": {},
+        })
+        start = date(2026, 1, 1)
+        for i in range(10):
+            await store_daily_metrics(db, "u1", start + timedelta(days=i), 1000 * i, 420, 500, 40.0, 30)
+        corrected = await store_daily_metrics(db, "u1", start, 7777, 420, 500, 40.0, 30)
+        await apply_metrics_delta(db, "u1", MetricsDelta(date=date(2026, 1, 11), steps=300))
+        await apply_metrics_delta(db, "u1", MetricsDelta(date=date(2026, 1, 11), steps=200, close=True))
+
+        days = await get_user_metrics_range(db, "u1", start, date(2026, 1, 11), fields=["steps"])
+        assert [d["steps"] for d in days] == [7777] + [1000 * i for i in range(1, 10)] + [500]
+        assert set(days[1]) == {"_id", "user_id", "date", "steps"}
+        assert await db.daily_metrics.count_documents({"user_id": "u1"}) == 11
+        assert (await metrics_repository.find_by_id(db, "u1", corrected["_id"]))["steps"] == 7777
+    finally:
+        await _drop(timeseries)
+
+
+@pytest.mark.asyncio
+async def test_query_trends_aggregates_on_the_server(timeseries):
+    db = await _connect(timeseries)
+    try:
+        now = datetime.utcnow()
+        for hours, value in ((1, 60), (5, 80), (30, 70)):
+            await store_health_entry(db, "u1", {"type": "heart_rate", "value": value,
+                                                "timestamp": now - timedelta(hours=hours)})
+        await store_health_entry(db, "u1", {"type": "heart_rate", "value": 99,
+                                            "timestamp": now - timedelta(days=30)})
+        await store_health_entry(db, "u2", {"type": "heart_rate", "value": 120})
+
+        trends = await query_trends(db, "u1", "heart_rate", days=7)
+        assert (trends["count"], trends["avg"], trends["min"], trends["max"]) == (3, 70, 60, 80)
+        assert (await query_trends(db, "u1", "steps"))["count"] == 0
+    finally:
+        await _drop(timeseries)
@@ -0,0 +1,99 @@
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.services.ai_service import evaluate_daily_deviations, score_risk
+from app.services.scoring_executor import ScoringExecutor
+from app.services.vector_engine import score_batch, score_pairs, score_user_window
+
+
+def _random_profile(rng):
+    baseline = {}
+    for key, mean in (("steps", 8000), ("sleep", 420), ("sedentary", 500), ("location", 40), ("active_minutes", 30)):
+        if rng.random() < 0.1:
+            continue  # no baseline for this signal
+        std = 0.0 if rng.random() < 0.1 else mean * rng.uniform(0.05, 0.4)
+        baseline[key] = {"count": 20, "mean": 0.0 if rng.random() < 0.05 else mean, "std": std}
+        if rng.random() < 0.7:
+            # weekday buckets, some still too sparse to be used
+            baseline[key]["weekday"] = [
+                [rng.randint(0, 5), mean * rng.uniform(0.7, 1.3), (mean * rng.uniform(0.0, 0.4)) ** 2 * 4]
+                for _ in range(7)
+            ]
+    return {
+        "user_id": "u",
+        "baseline_status": "active" if rng.random() < 0.9 else "collecting",
+        "enabled_signals": {"location": rng.random() < 0.7, "sleep": rng.random() < 0.9},
+        "baseline_metrics": baseline,
+    }
+
+
+def _random_window(rng, days):
+    start = datetime(2026, 1, 1)
+    docs = []
+    for i in range(days):
+        docs.append({
+            "date": start + timedelta(days=i),
+            "steps": rng.choice([rng.randint(0, 16000), None]) if rng.random() < 0.05 else rng.randint(0, 16000),
+            "sleep_duration_minutes": rng.randint(200, 600),
+            "sedentary_minutes": rng.randint(200, 900),
+            "location_diversity_score": rng.uniform(0, 100),
+            "active_minutes": rng.randint(0, 90),
+        })
+    return docs
+
+
+def _scalar(profile, docs):
+    out = []
+    for i, doc in enumerate(docs):
+        recent = list(reversed(docs[max(0, i - 3):i]))
+        flags = evaluate_daily_deviations(profile, doc, recent)
+        risk = score_risk(profile.get("baseline_metrics", {}), flags, doc) if profile["baseline_status"] == "active" else 0.0
+        out.append({"deviation_flags": flags, "risk_score": risk})
+    return out
+
+
+def test_vector_engine_matches_scalar_engine():
+    rng = random.Random(7)
+    for _ in range(200):
+        profile = _random_profile(rng)
+        docs = _random_window(rng, rng.randint(1, 30))
+        assert score_user_window(profile, docs) == _scalar(profile, docs)
+
+
+def test_trend_run_flags_fourth_day():
+    profile = {
+        "baseline_status": "active",
+        "enabled_signals": {},
+        "baseline_metrics": {"steps": {"mean": 10000.0, "std": 4000.0}},
+    }
+    # 3 low days (z = -1.75, pct -70%) then a normal-looking day
+    docs = [{"steps": 3000}] * 3 + [{"steps": 9000}]
+    results = score_user_window(profile, docs)
+    assert results[3]["deviation_flags"]["steps"] is True
+    assert results[3]["risk_score"] == pytest.approx(round(0.25 * 0.25 * 30, 1))
+
+
+def test_batch_matches_per_user():
+    rng = random.Random(11)
+    profiles = [_random_profile(rng) for _ in range(25)]
+    windows = [_random_window(rng, rng.randint(0, 20)) for _ in profiles]
+    batch = score_batch(profiles, windows)
+    for profile, docs, res in zip(profiles, windows, batch):
+        assert res == score_user_window(profile, docs)
+        assert len(res) == len(docs)
+    assert np.isfinite([r["risk_score"] for res in batch for r in res]).all()
+
+
+@pytest.mark.asyncio
+async def test_pool_map_chunks_preserves_order():
+    rng = random.Random(3)
+    pairs = [(_random_profile(rng), _random_window(rng, 10)) for _ in range(9)]
+    executor = ScoringExecutor(processes=2, chunk_size=2)
+    try:
+        results = await executor.map_chunks(score_pairs, pairs)
+    finally:
+        executor.shutdown()
+    assert results == score_pairs(pairs)
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.window_cache import TrailingWindow, WindowCache
+
+from fakes import FakeCollection, FakeCursor, FakeDB
+
+START = datetime(2026, 3, 1)
+
+
+def _docs(n, offset=0):
+    return [{"date": START + timedelta(days=offset + i), "steps": 1000 * (offset + i)} for i in range(n)]
+
+
+class DelayedCursor(FakeCursor):
+    def __init__(self, items, delay):
+        super().__init__(items)
+        self._delay = delay
+
+    async def to_list(self, length=None):
+        if self._delay is not None:
+            await self._delay.wait()
+        return await super().to_list(length)
+
+
+class DelayedCollection(FakeCollection):
+    """`find` results wait for `delay` (when set) before they arrive."""
+
+    def __init__(self, docs):
+        super().__init__(docs)
+        self.delay = None
+
+    def find(self, q=None, projection=None, sort=None, limit=0):
+        cursor = super().find(q, projection, sort, limit)
+        return DelayedCursor(cursor._items, self.delay)
+
+
+def _db(docs):
+    return FakeDB(daily_metrics=DelayedCollection([{**d, "user_id": "u1"} for d in docs]))
+
+
+def test_window_before_and_since_coverage():
+    window = TrailingWindow(5, list(reversed(_docs(8)))[:5])  # newest 5 of 8 days
+    assert not window.complete
+    assert [d["steps"] for d in window.before(START + timedelta(days=7), 3)] == [6000, 5000, 4000]
+    # too close to the oldest cached day: older days may exist in Mongo
+    assert window.before(START + timedelta(days=4), 3) is None
+    assert [d["steps"] for d in window.since(START + timedelta(days=5))] == [5000, 6000, 7000]
+    assert window.since(START) is None
+
+    short = TrailingWindow(5, _docs(2))
+    assert short.complete
+    assert [d["steps"] for d in short.before(START + timedelta(days=1), 3)] == [0]
+
+
+def test_upsert_updates_in_place_and_trims():
+    window = TrailingWindow(3, _docs(3))
+    window.upsert({"date": START + timedelta(days=1), "steps": 42})
+    assert window.columns["steps"] == [0, 42, 2000]
+    window.upsert({"date": START + timedelta(days=3), "steps": 3000})
+    assert window.dates[0] == START + timedelta(days=1)
+    assert not window.complete
+    # a backfilled day older than the window is ignored
+    window.upsert({"date": START - timedelta(days=5), "steps": 1})
+    assert len(window) == 3 and window.latest()["steps"] == 3000
+
+
+@pytest.mark.asyncio
+async def test_cache_hits_lru_and_ttl():
+    db = _db(_docs(4))
+    cache = WindowCache(days=14, ttl_seconds=60, max_users=1)
+    await cache.get(db, "u1")
+    await cache.get(db, "u1")
+    assert db.daily_metrics.calls["find"] == 1 and cache.hits == 1
+
+    await cache.get(db, "u2")  # evicts u1
+    await cache.get(db, "u1")
+    assert db.daily_metrics.calls["find"] == 3
+
+    expired = WindowCache(days=14, ttl_seconds=0, max_users=10)
+    await expired.get(db, "u1")
+    await expired.get(db, "u1")
+    assert db.daily_metrics.calls["find"] == 5
+
+
+@pytest.mark.asyncio
+async def test_upsert_during_load_is_not_lost():
+    db = _db(_docs(2))
+    db.daily_metrics.delay = asyncio.Event()
+    cache = WindowCache(days=14, ttl_seconds=60, max_users=10)
+    load = asyncio.create_task(cache.get(db, "u1"))
+    await asyncio.sleep(0)
+    # the write lands after the load's query was issued
+    cache.apply("u1", {"date": START + timedelta(days=2), "steps": 9})
+    db.daily_metrics.delay.set()
+    await load
+    assert "u1" not in cache._entries
+
+    db.daily_metrics.docs.append({"user_id": "u1", "date": START + timedelta(days=2), "steps": 9})
+    window = await cache.get(db, "u1")
+    cache.apply("u1", {"date": START + timedelta(days=3), "steps": 10})
+    assert (await cache.get(db, "u1")) is window
+    assert window.columns["steps"] == [0, 1000, 9, 10]
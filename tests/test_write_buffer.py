@@ -0,0 +1,165 @@
+import contextlib
+from datetime import date, datetime, timedelta
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from app.models.metrics_model import MetricsCreate
+from app.services.daily_metrics_service import get_daily_metrics, get_user_metrics_range
+from app.services.metrics_service import ingest_metrics
+from app.services.write_buffer import metrics_write_buffer
+
+from fakes import FakeCollection, FakeDB, profile_doc
+
+
+class FlakyCollection(FakeCollection):
+    """Counts day writes; `fail_next_write` makes the next day write fail.
+
+    Upserts of days in `reject_dates` are rejected like a failed validation.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.fail_next_write = False
+        self.reject_dates = set()
+
+    @property
+    def writes(self):
+        return self.calls["find_one_and_update"] + self.calls["insert_one"] + self.calls["bulk_write"]
+
+    async def find_one_and_update(self, q, update, **kwargs):
+        if self.fail_next_write:
+            self.fail_next_write = False
+            raise ConnectionError("primary stepped down")
+        if q.get("date") in self.reject_dates:
+            raise OperationFailure("Document failed validation", code=121)
+        return await super().find_one_and_update(q, update, **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def long_window(monkeypatch):
+    # the tests flush by hand
+    monkeypatch.setattr(metrics_write_buffer, "window_seconds", 3600)
+
+
+@contextlib.asynccontextmanager
+async def buffered():
+    db = FakeDB(health_profiles=FakeCollection([profile_doc()]), daily_metrics=FlakyCollection())
+    metrics_write_buffer.start(db)
+    try:
+        yield db
+    finally:
+        await metrics_write_buffer.stop()
+
+
+def _payload(day, steps):
+    return MetricsCreate(date=day, steps=steps, sleep_duration_minutes=420, sedentary_minutes=500,
+                         location_diversity_score=40.0, active_minutes=30, screen_time_minutes=100)
+
+
+@pytest.mark.asyncio
+async def test_posts_of_one_day_coalesce_into_one_write():
+    async with buffered() as db:
+        day = date(2026, 2, 2)
+        for steps in range(1000, 13000, 1000):
+            await ingest_metrics(db, "u1", _payload(day, steps))
+
+        assert db.daily_metrics.docs == []
+        assert (await get_daily_metrics(db, "u1", day))["steps"] == 12000
+        [pending] = await get_user_metrics_range(db, "u1", day, day)
+        assert pending["steps"] == 12000
+
+        assert await metrics_write_buffer.flush() == 1
+        [stored] = db.daily_metrics.docs
+        assert stored["steps"] == 12000
+        assert db.daily_metrics.writes == 1
+        # every post swapped the day's sample in the running baseline
+        profile = db.health_profiles.docs[0]
+        assert profile["baseline_metrics"]["steps"]["count"] == 1
+        assert profile["baseline_metrics"]["steps"]["mean"] == 12000
+
+
+@pytest.mark.asyncio
+async def test_flags_of_a_buffered_day_ride_along():
+    async with buffered() as db:
+        start = date(2026, 1, 1)
+        for i in range(14):
+            await ingest_metrics(db, "u1", _payload(start + timedelta(days=i), 8000 + 50 * (i % 3)))
+        await metrics_write_buffer.flush()
+        assert db.health_profiles.docs[0]["baseline_status"] == "active"
+
+        day = start + timedelta(days=14)
+        writes = db.daily_metrics.writes
+        result = await ingest_metrics(db, "u1", _payload(day, 1500))
+        await ingest_metrics(db, "u1", _payload(day, 1600))
+        assert result["deviation_flags"]["steps"] is True
+        assert db.daily_metrics.writes == writes
+
+        await metrics_write_buffer.stop()
+        assert db.daily_metrics.writes == writes + 1
+        stored = next(d for d in db.daily_metrics.docs if d["date"] == datetime(2026, 1, 15))
+        assert stored["steps"] == 1600
+        assert stored["deviation_flags"]["steps"] is True
+        assert stored["risk_score"] > 0
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_days_for_the_next_window():
+    async with buffered() as db:
+        day = date(2026, 2, 2)
+        await ingest_metrics(db, "u1", _payload(day, 1000))
+        db.daily_metrics.fail_next_write = True
+        with pytest.raises(ConnectionError):
+            await metrics_write_buffer.flush()
+        await ingest_metrics(db, "u1", _payload(day, 2000))
+
+        assert await metrics_write_buffer.flush() == 1
+        [stored] = db.daily_metrics.docs
+        assert stored["steps"] == 2000
+
+
+@pytest.mark.asyncio
+async def test_rejected_days_are_retried_then_dead_lettered():
+    async with buffered() as db:
+        good, bad = date(2026, 2, 2), date(2026, 2, 3)
+        await ingest_metrics(db, "u1", _payload(good, 1000))
+        await ingest_metrics(db, "u1", _payload(bad, 2000))
+        db.daily_metrics.reject_dates.add(datetime(2026, 2, 3))
+
+        assert await metrics_write_buffer.flush() == 1
+        # the rejected day stays readable and is retried in the next windows
+        assert (await get_daily_metrics(db, "u1", bad))["steps"] == 2000
+        await metrics_write_buffer.flush()
+        assert not db.metrics_dead_letters.docs
+        assert await metrics_write_buffer.flush() == 0
+
+        [dead] = db.metrics_dead_letters.docs
+        assert (dead["date"], dead["doc"]["steps"], dead["attempts"]) == (datetime(2026, 2, 3), 2000, 3)
+        assert dead["error"]["code"] == 121 and "steps" in dead["fields"]
+        assert metrics_write_buffer.get("u1", datetime(2026, 2, 3)) is None
+        assert [d["date"] for d in db.daily_metrics.docs] == [datetime(2026, 2, 2)]
+        # only the stored day reached the baseline
+        assert db.health_profiles.docs[0]["baseline_metrics"]["steps"]["count"] == 1
+        assert metrics_write_buffer.stats["rejected"] >= 3 and metrics_write_buffer.stats["dead_lettered"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_baseline_follows_the_flush_and_swaps_what_was_replaced():
+    async with buffered() as db:
+        day = date(2026, 2, 2)
+        await ingest_metrics(db, "u1", _payload(day, 1000))
+        # nothing is folded before the day is stored
+        assert db.health_profiles.docs[0]["baseline_metrics"] == {}
+        await metrics_write_buffer.flush()
+
+        # another process stored a newer version of the day in the meantime
+        stored = db.daily_metrics.docs[0]
+        await db.health_profiles.update_one({"user_id": "u1"}, {"$set": {
+            "baseline_metrics.steps": {"count": 1, "mean": 4000.0, "m2": 0.0, "std": 0.0},
+        }})
+        stored["steps"] = 4000
+
+        await ingest_metrics(db, "u1", _payload(day, 5000))
+        await metrics_write_buffer.flush()
+        steps = db.health_profiles.docs[0]["baseline_metrics"]["steps"]
+        assert (steps["count"], steps["mean"]) == (1, 5000)